@@ -0,0 +1,112 @@
+"""benchmark_records.py
+
+Measures the memory used to hold the sessions of a large project while the
+listmode checks run, comparing the original representation with the compact
+one used by the commands.
+
+The original representation is the list of dicts returned by a pyxnat search,
+plus a set of frozen dataclass records each holding a rendered HTML error
+message. The compact representation is a list of slotted SessionRows with
+interned subject IDs and dates, plus slotted ListModeRecords holding interned
+error codes which are only rendered when the email is constructed.
+
+Synthetic sessions are generated, with three sessions per subject spread over
+three years, and every session is given a listmode error as a worst case.
+
+Run this script from the repository root with the package installed:
+
+python ./benchmark_records.py [number of sessions ...]
+
+The default is to measure 100,000 and 1,000,000 sessions.
+"""
+
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from drc_containers.email_listmode import ListModeError, listmode_record
+from drc_containers.xnat_utils.compact import session_rows
+
+
+@dataclass(frozen=True)
+class OriginalListModeRecord:
+    id: str
+    label: str
+    subject_id: str
+    date: str
+    errors: str
+
+
+def search_rows(num_sessions: int):
+    """Yield rows as returned by a pyxnat search, each value a new string"""
+    for n in range(num_sessions):
+        subject = n // 3
+        yield {
+            "session_id": f"XNAT_E{n:08d}",
+            "subject_id": f"XNAT_S{subject:08d}",
+            "date": f"{2022 + n % 3}-{1 + n % 12:02d}-{1 + n % 28:02d}",
+            "label": f"{subject:08d}_{1 + n % 3:02d}_PETMR",
+            "project": "PROJ",
+        }
+
+
+def original(num_sessions: int):
+    rows = list(search_rows(num_sessions))
+    records = set()
+    for row in rows:
+        message = (
+            f"Subject ID: {row['subject_id']}   "
+            f"Scan Date: {row['date']}   "
+            "Errors: LM does not exist, Norm does not exist<br>"
+        )
+        records.add(
+            OriginalListModeRecord(
+                id=row["session_id"],
+                label=row["label"],
+                subject_id=row["subject_id"],
+                date=row["date"],
+                errors=message,
+            )
+        )
+    return rows, records
+
+
+def compact(num_sessions: int):
+    rows = session_rows(search_rows(num_sessions))
+    errors = [(ListModeError.LM_MISSING, ""), (ListModeError.NORM_MISSING, "")]
+    records = {listmode_record(row, errors) for row in rows}
+    return rows, records
+
+
+def measure(build, num_sessions: int) -> tuple[float, float]:
+    """Return the memory in MB held by the result of build, and the time in
+    seconds taken to build it"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(num_sessions)
+    seconds = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / 1e6, seconds
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    print(f"{'sessions':>10}  {'original MB':>12}  {'compact MB':>11}  {'ratio':>6}")
+    for num_sessions in sizes:
+        original_mb, original_seconds = measure(original, num_sessions)
+        compact_mb, compact_seconds = measure(compact, num_sessions)
+        print(
+            f"{num_sessions:>10,}  {original_mb:>12.1f}  {compact_mb:>11.1f}  "
+            f"{original_mb / compact_mb:>5.1f}x"
+        )
+        print(
+            f"{'':>10}  {original_seconds:>11.2f}s  {compact_seconds:>10.2f}s  "
+            f"(build time under tracemalloc)"
+        )
+
+
+if __name__ == "__main__":
+    main()
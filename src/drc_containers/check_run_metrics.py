@@ -0,0 +1,87 @@
+from argparse import ArgumentParser
+
+from drc_containers.xnat_utils.run_metrics import find_regressions, read_history
+
+
+def check_run_metrics(
+    history_path: str,
+    window: int = 8,
+    min_runs: int = 3,
+    ratio: float = 1.5,
+    latest_only: bool = False,
+) -> bool:
+    """Report runs which were significantly slower than the rolling baseline
+    for the same command and project
+
+    Args:
+        history_path: JSON lines run metrics history written by the commands
+            when run with --metrics-history
+        window: number of previous runs used for the baseline
+        min_runs: minimum number of previous runs needed to form a baseline
+        ratio: a run is flagged if it took longer than ratio times the
+            baseline
+        latest_only: set to True to only check the most recent run of each
+            command and project
+
+    Returns:
+        True if any slow runs were found
+    """
+    runs = read_history(history_path)
+    regressions = find_regressions(
+        runs=runs, window=window, min_runs=min_runs, ratio=ratio
+    )
+    if latest_only:
+        latest = {(r.command, r.project): r for r in runs}
+        regressions = [
+            (run, baseline)
+            for run, baseline in regressions
+            if latest[(run.command, run.project)] is run
+        ]
+
+    if not regressions:
+        print(f"No slow runs found in {len(runs)} runs")
+    for run, baseline in regressions:
+        print(
+            f"Slow run: {run.command} {run.project} started {run.started} took "
+            f"{run.duration_seconds:.1f}s (baseline {baseline:.1f}s); "
+            f"{run.sessions_scanned} sessions, {run.requests} requests, "
+            f"{run.bytes_received} bytes"
+        )
+    return len(regressions) > 0
+
+
+def main(args=None):
+    """Entrypoint for check_run_metrics, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        check_run_metrics history_file [--window N] [--min-runs N]
+            [--ratio R] [--latest-only]
+
+    The exit code is 1 if any slow runs were found, so that the check can be
+    used to raise an alert from cron.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("history_file")
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--min-runs", type=int, default=3)
+    parser.add_argument("--ratio", type=float, default=1.5)
+    parser.add_argument("--latest-only", action="store_true")
+    parsed = parser.parse_args(args)
+
+    slow_runs_found = check_run_metrics(
+        history_path=parsed.history_file,
+        window=parsed.window,
+        min_runs=parsed.min_runs,
+        ratio=parsed.ratio,
+        latest_only=parsed.latest_only,
+    )
+    if slow_runs_found:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from importlib import import_module
+
+# Modules providing the entry point main() for each command, as listed in
+# pyproject.toml
+COMMAND_MODULES = {
+    "email_chenies": "drc_containers.email_chenies",
+    "email_listmode": "drc_containers.email_listmode",
+    "email_radreads": "drc_containers.email_radreads",
+    "flush_outbox": "drc_containers.flush_outbox",
+    "share_subject_to_genetic_project": (
+        "drc_containers.share_subject_to_genetic_project"
+    ),
+}
+
+
+def get_command(name: str):
+    """Return the entry point main() function for a command
+
+    Args:
+        name: command name, as used in pyproject.toml and the JSON command
+            definitions
+
+    Returns:
+        function which takes a list of command-line arguments
+    """
+    if name not in COMMAND_MODULES:
+        raise ValueError(f"Unknown command {name}")
+    return import_module(COMMAND_MODULES[name]).main
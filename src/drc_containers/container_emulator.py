@@ -0,0 +1,307 @@
+import glob
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import zip_longest
+
+from drc_containers.commands import COMMAND_MODULES
+from drc_containers.xnat_utils.standin_server import StandinServer, percentile
+
+
+@dataclass
+class JobResult:
+    """Outcome of one emulated container launch"""
+
+    wrapper: str
+    args: list[str]
+    queued_seconds: float = 0.0
+    run_seconds: float = 0.0
+    returncode: int = 0
+    output: str = ""
+
+
+def load_wrappers(definitions_dir: str) -> dict[str, tuple[dict, dict]]:
+    """Read the JSON command definitions in a directory
+
+    Args:
+        definitions_dir: directory containing JSON command definition files
+
+    Returns:
+        dict of wrapper name to (command definition, wrapper definition)
+    """
+    wrappers = {}
+    for path in sorted(glob.glob(os.path.join(definitions_dir, "*.json"))):
+        with open(path) as f:
+            command = json.load(f)
+        if not isinstance(command, dict) or "command-line" not in command:
+            continue
+        for wrapper in command.get("xnat", []):
+            wrappers[wrapper["name"]] = (command, wrapper)
+    return wrappers
+
+
+def resolve_command_line(
+    command: dict, wrapper: dict, external_inputs: dict, input_values: dict
+) -> list[str]:
+    """Build the command line for a container launch, in the same way as the
+    XNAT container service
+
+    Values for the command inputs are taken from input_values, then from the
+    wrapper's derived inputs, then from the input's default value. Each
+    input's replacement key (such as #PROJECTID#) in the command line is then
+    replaced with its value.
+
+    Args:
+        command: JSON command definition
+        wrapper: the entry in the command's "xnat" list which was launched
+        external_inputs: XNAT objects passed to the wrapper, as a dict of
+            external input name to a dict of object properties, for example
+            {"project": {"id": "PROJ"}}
+        input_values: values set directly for command inputs, for example the
+            inputs configured for an event subscription
+
+    Returns:
+        list of command-line arguments, starting with the command name
+    """
+    values = {}
+    for derived in wrapper.get("derived-inputs", []):
+        source = external_inputs.get(derived["derived-from-wrapper-input"], {})
+        prop = derived.get("derived-from-xnat-object-property")
+        if prop in source:
+            values[derived["provides-value-for-command-input"]] = source[prop]
+    values.update(input_values)
+
+    command_line = command["command-line"]
+    for command_input in command.get("inputs", []):
+        value = values.get(command_input["name"], command_input.get("default-value"))
+        if value is None:
+            if command_input.get("required"):
+                raise ValueError(
+                    f"No value for required input {command_input['name']} of "
+                    f"{wrapper['name']}"
+                )
+            value = ""
+        key = command_input.get("replacement-key")
+        if key:
+            command_line = command_line.replace(key, str(value))
+    return shlex.split(command_line)
+
+
+def _substitute_index(value, index: int):
+    """Replace {n} in the string values of an event with the launch number,
+    so that each launch can refer to a different project or subject"""
+    if isinstance(value, str):
+        return value.replace("{n}", str(index))
+    if isinstance(value, dict):
+        return {k: _substitute_index(v, index) for k, v in value.items()}
+    return value
+
+
+def plan_jobs(wrappers: dict, events: list[dict]) -> list[tuple[str, list[str]]]:
+    """Resolve the command lines for all the launches in a scenario
+
+    Launches of different events are interleaved, as when several event
+    subscriptions fire at the same time.
+
+    Args:
+        wrappers: wrappers returned by load_wrappers
+        events: list of scenario events, each a dict with keys "wrapper",
+            "count" (default 1), "external-inputs" and "inputs"
+
+    Returns:
+        list of (wrapper name, command-line arguments)
+    """
+    per_event = []
+    for event in events:
+        name = event["wrapper"]
+        if name not in wrappers:
+            raise ValueError(f"Unknown wrapper {name}")
+        command, wrapper = wrappers[name]
+        launches = []
+        for index in range(event.get("count", 1)):
+            args = resolve_command_line(
+                command=command,
+                wrapper=wrapper,
+                external_inputs=_substitute_index(
+                    event.get("external-inputs", {}), index
+                ),
+                input_values=_substitute_index(event.get("inputs", {}), index),
+            )
+            launches.append((name, args))
+        per_event.append(launches)
+    return [job for group in zip_longest(*per_event) for job in group if job]
+
+
+def run_job(
+    wrapper: str, args: list[str], env: dict, queued: float, timeout: float
+) -> JobResult:
+    """Run one command in a separate process, as a container would"""
+    result = JobResult(wrapper=wrapper, args=args)
+    if args[0] not in COMMAND_MODULES:
+        result.returncode = -1
+        result.output = f"Unknown command {args[0]}"
+        return result
+    start = time.perf_counter()
+    result.queued_seconds = start - queued
+    try:
+        process = subprocess.run(
+            [sys.executable, "-m", COMMAND_MODULES[args[0]], *args[1:]],
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            check=False,
+        )
+        result.returncode = process.returncode
+        result.output = process.stdout + process.stderr
+    except subprocess.TimeoutExpired:
+        result.returncode = -1
+        result.output = f"Timed out after {timeout}s"
+    result.run_seconds = time.perf_counter() - start
+    return result
+
+
+def container_emulator(
+    scenario_path: str,
+    definitions_dir: str,
+    concurrency: int | None = None,
+    rate: float | None = None,
+    cassette_path: str | None = None,
+    time_scale: float = 1.0,
+    server_latency: float = 0.0,
+    job_timeout: float = 600,
+) -> list[JobResult]:
+    """Launch the commands described by a scenario concurrently against a
+    local stand-in XNAT server, and print throughput, latency and server load
+
+    Args:
+        scenario_path: JSON file with an "events" list describing the
+            launches. See plan_jobs
+        definitions_dir: directory containing the JSON command definitions
+        concurrency: maximum number of commands running at once. Default is
+            to run all launches at once
+        rate: launches per second. Default is to launch all at once
+        cassette_path: optional cassette from which the stand-in server
+            serves its responses
+        time_scale: multiplier for the latencies recorded in the cassette
+        server_latency: extra delay in seconds added to every response
+        job_timeout: seconds after which a command is stopped
+
+    Returns:
+        list of JobResult in launch order
+    """
+    with open(scenario_path) as f:
+        scenario = json.load(f)
+    jobs = plan_jobs(load_wrappers(definitions_dir), scenario["events"])
+    if not jobs:
+        print("No launches in scenario")
+        return []
+
+    with StandinServer(
+        cassette_path=cassette_path, time_scale=time_scale, latency=server_latency
+    ) as server:
+        env = dict(os.environ)
+        env.pop("DRC_CASSETTE", None)
+        env.update(XNAT_HOST=server.url, XNAT_USER="emulator", XNAT_PASS="emulator")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency or len(jobs)) as executor:
+            futures = []
+            for index, (wrapper, args) in enumerate(jobs):
+                if rate:
+                    time.sleep(max(0.0, start + index / rate - time.perf_counter()))
+                futures.append(
+                    executor.submit(
+                        run_job, wrapper, args, env, time.perf_counter(), job_timeout
+                    )
+                )
+            results = [future.result() for future in futures]
+        wall_seconds = time.perf_counter() - start
+
+    print(_report(results, wall_seconds))
+    print(server.load.summary(wall_seconds))
+    return results
+
+
+def _report(results: list[JobResult], wall_seconds: float) -> str:
+    failed = [r for r in results if r.returncode != 0]
+    lines = [
+        (
+            f"Launched {len(results)} jobs in {wall_seconds:.2f}s "
+            f"({len(results) / wall_seconds:.2f} jobs/s), {len(failed)} failed"
+        )
+    ]
+    by_wrapper: dict[str, list[JobResult]] = {}
+    for result in results:
+        by_wrapper.setdefault(result.wrapper, []).append(result)
+    for wrapper, wrapper_results in [("all", results)] + sorted(by_wrapper.items()):
+        latencies = [r.queued_seconds + r.run_seconds for r in wrapper_results]
+        lines.append(
+            f"  {wrapper}: {len(wrapper_results)} jobs, latency "
+            f"p50 {percentile(latencies, 50):.2f}s, "
+            f"p95 {percentile(latencies, 95):.2f}s, "
+            f"p99 {percentile(latencies, 99):.2f}s, "
+            f"max {max(latencies):.2f}s, "
+            f"max queued {max(r.queued_seconds for r in wrapper_results):.2f}s"
+        )
+    for result in failed[:3]:
+        output = "\n    ".join(result.output.strip().splitlines()[-5:])
+        lines.append(f"Failed: {shlex.join(result.args)}\n    {output}")
+    return "\n".join(lines)
+
+
+def main(args=None):
+    """Entrypoint for container_emulator, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        container_emulator [options] scenario
+
+    For example, a scenario in which 20 subjects are created and 5 cron
+    events fire at once:
+        {
+          "events": [
+            {"wrapper": "share-subject-to-genetic", "count": 20,
+             "external-inputs": {"subject": {"id": "XNAT_S{n}"}}},
+            {"wrapper": "email-listmode-project", "count": 5,
+             "external-inputs": {"project": {"id": "PROJ{n}"}},
+             "inputs": {"email-list": "user1@foo.org"}}
+          ]
+        }
+    """
+    parser = ArgumentParser()
+    parser.add_argument("scenario")
+    parser.add_argument("--definitions", default=".", metavar="DIR")
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None)
+    parser.add_argument("--cassette", default=None)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--server-latency", type=float, default=0.0)
+    parser.add_argument("--job-timeout", type=float, default=600)
+    parsed = parser.parse_args(args)
+
+    results = container_emulator(
+        scenario_path=parsed.scenario,
+        definitions_dir=parsed.definitions,
+        concurrency=parsed.concurrency,
+        rate=parsed.rate,
+        cassette_path=parsed.cassette,
+        time_scale=parsed.time_scale,
+        server_latency=parsed.server_latency,
+        job_timeout=parsed.job_timeout,
+    )
+    if any(r.returncode != 0 for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,48 @@
+import os
+import re
 from argparse import ArgumentParser
+from collections.abc import Iterable
+from contextlib import nullcontext
 from dataclasses import dataclass
+from datetime import datetime, timezone
 
 from pyxnat import Interface
-from pyxnat.core.resources import Experiments
 
 from drc_containers.xnat_utils.command_line import string_to_list
-from drc_containers.xnat_utils.email import send_email
+from drc_containers.xnat_utils.compact import intern
+from drc_containers.xnat_utils.deadline import (
+    Coverage,
+    Deadline,
+    apply_deadline,
+    is_deadline_error,
+)
+from drc_containers.xnat_utils.outbox import send_or_queue_email
+from drc_containers.xnat_utils.profiling import (
+    add_profiling_arguments,
+    profile_run,
+    span,
+)
+from drc_containers.xnat_utils.query_backend import (
+    QueryBackend,
+    RestQueryBackend,
+    open_query_backend,
+)
+from drc_containers.xnat_utils.run_metrics import (
+    RunMetrics,
+    add_metrics_arguments,
+    record_run,
+    track_requests,
+)
+from drc_containers.xnat_utils.subject_index import SubjectLabelIndex
 from drc_containers.xnat_utils.xnat_credentials import (
-    open_pyxnat_session,
     XnatContainerCredentials,
     XnatCredentials,
+    get_http_session,
+    open_pyxnat_session,
 )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class PetmrSessionRecord:
     """Store data from sessions missing Chenies Mews MR data
     The frozen dataclass allows this to be used in a set to ensure no sessions
@@ -25,9 +54,14 @@ class PetmrSessionRecord:
     date: str
 
 
+@span("get_sessions_for_phase")
 def get_sessions_for_phase(
-    pyxnat_interface: Interface, datatype: str, project_name: str, phase: int
-) -> Experiments:
+    pyxnat_interface: Interface,
+    datatype: str,
+    project_name: str,
+    phase: int,
+    query_backend: QueryBackend = None,
+) -> list[dict]:
     """Return sessions in this project for the specified datatype which
     have a label matching the specified phase number
 
@@ -36,9 +70,11 @@ def get_sessions_for_phase(
         datatype: data type to search for
         project_name: project to search in
         phase: phase number to search for in the session label
+        query_backend: optional QueryBackend used instead of the XNAT REST API
 
     Returns:
-        set of subject labels
+        search results with session_id, subject_label, date, label and
+        project columns
     """
     columns = [
         datatype + "/SESSION_ID",
@@ -53,12 +89,106 @@ def get_sessions_for_phase(
         (datatype + "/label", "LIKE", label_pattern),
         "AND",
     ]
-    sessions = pyxnat_interface.select(datatype, columns).where(constraints)
-    return sessions
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    return backend.search(datatype, columns, constraints)
 
 
+@span("get_petmr_sessions")
+def get_petmr_sessions(
+    pyxnat_interface: Interface,
+    datatype: str,
+    project_name: str,
+    query_backend: QueryBackend = None,
+) -> list[dict]:
+    """Return all sessions in this project for the specified datatype, so
+    that the phases can be found from the session labels in a single search
+
+    Args:
+        pyxnat_interface:  PyXnat session interface
+        datatype: data type to search for
+        project_name: project to search in
+        query_backend: optional QueryBackend used instead of the XNAT REST API
+
+    Returns:
+        search results with the same columns as get_sessions_for_phase
+    """
+    columns = [
+        datatype + "/SESSION_ID",
+        datatype + "/SUBJECT_LABEL",
+        datatype + "/DATE",
+        datatype + "/LABEL",
+        datatype + "/PROJECT",
+    ]
+    constraints = [(datatype + "/project", "=", project_name), "AND"]
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    return backend.search(datatype, columns, constraints)
+
+
+def get_label_phases(session_label: str) -> set[int]:
+    """Return the phase numbers in a session label
+
+    A label contains phase N if it contains N as two digits between
+    underscores, for example "12345678_03_PETMR" is a phase 3 session. This
+    matches the label pattern used by get_sessions_for_phase.
+
+    Args:
+        session_label: label of the session
+
+    Returns:
+        set of phase numbers, usually containing zero or one phase
+    """
+    # The lookahead allows overlapping matches such as "_03_04_"
+    return {int(phase) for phase in re.findall(r"(?=_(\d{2})_)", session_label)}
+
+
+def find_subjects_missing_mr(
+    petmr_sessions: Iterable[dict], subjects_with_mr: set[str], phases: list[int]
+) -> dict[int, set[PetmrSessionRecord]]:
+    """Find the subjects with PET-MR sessions in each phase which have no MR
+    data
+
+    Args:
+        petmr_sessions: PET-MR search results, with session_id, label and
+            date columns
+        subjects_with_mr: subject labels which have MR data
+        phases: phase numbers to report on
+
+    Returns:
+        dict of phase number to the set of PetmrSessionRecords for subjects
+        missing MR data. Only the first session found for each subject in a
+        phase is included
+    """
+    sessions_by_phase = {phase: set() for phase in phases}
+    subjects_already_added = {phase: set() for phase in phases}
+    for session in petmr_sessions:
+        session_label = session["label"]
+        subject_label = session_label.split("_", 1)[0]
+        if subject_label in subjects_with_mr:
+            continue
+        for phase in get_label_phases(session_label) & set(phases):
+            print(f"Phase {phase} subject missing MR data: {subject_label}")
+
+            # Only store the first session found for each subject
+            if subject_label not in subjects_already_added[phase]:
+                sessions_by_phase[phase].add(
+                    PetmrSessionRecord(
+                        id=session["session_id"],
+                        label=session_label,
+                        subject_label=subject_label,
+                        date=intern(session["date"]),
+                    )
+                )
+                subjects_already_added[phase].add(subject_label)
+    return sessions_by_phase
+
+
+@span("get_subject_labels")
 def get_subject_labels(
-    pyxnat_interface: Interface, datatype: str, project_name: str
+    pyxnat_interface: Interface,
+    datatype: str,
+    project_name: str,
+    inserted_since: str | None = None,
+    query_backend: QueryBackend = None,
 ) -> set[str]:
     """Return list of subject labels in this project
 
@@ -66,22 +196,146 @@ def get_subject_labels(
         pyxnat_interface: PyXnat session interface
         datatype: data type to search for
         project_name: project to search in
+        inserted_since: if set, only search sessions added to XNAT on or
+            after this date (YYYY-MM-DD)
+        query_backend: optional QueryBackend used instead of the XNAT REST API
 
     Returns:
         set of subject labels from datatypes in matching project
     """
     columns = [datatype + "/SUBJECT_LABEL", datatype + "/PROJECT"]
-    constraints = [(datatype + "/project", "=", project_name), "AND"]
-    sessions = pyxnat_interface.select(datatype, columns).where(constraints)
-    subjects = set(
-        [session["subject_label"].split("_", 1)[0] for session in sessions.data]
-    )
+    constraints = [(datatype + "/project", "=", project_name)]
+    if inserted_since:
+        constraints.append((datatype + "/meta/insert_date", ">=", inserted_since))
+    constraints.append("AND")
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    sessions = backend.search(datatype, columns, constraints)
+    subjects = {session["subject_label"].split("_", 1)[0] for session in sessions}
 
     return subjects
 
 
+@span("get_mr_subject_labels")
+def get_mr_subject_labels(
+    pyxnat_interface: Interface,
+    mr_projects: list[str],
+    query_backend: QueryBackend = None,
+) -> set[str]:
+    """Return the subject labels of subjects with MR sessions in any of these
+    projects
+
+    A single search is made at the subject level, so it returns one row per
+    subject rather than one row per session, and only one request is made
+    however many MR projects there are.
+
+    The subject search gives each subject's label in the project which owns
+    it. A subject owned by another project and shared into an MR project may
+    have a different label there, which is the label used by its MR
+    sessions. For these subjects only, the labels are taken from a second
+    search of their MR sessions, so the labels are the same as those found
+    by get_subject_labels.
+
+    Args:
+        pyxnat_interface: PyXnat session interface
+        mr_projects: projects to search for MR sessions
+        query_backend: optional QueryBackend used instead of the XNAT REST API
+
+    Returns:
+        set of subject labels, truncated at the first underscore in the same
+        way as get_subject_labels
+    """
+    if not mr_projects:
+        return set()
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    in_mr_project = [
+        ("xnat:mrSessionData/project", "=", mr_project) for mr_project in mr_projects
+    ]
+    subjects = backend.search(
+        "xnat:subjectData",
+        [
+            "xnat:subjectData/SUBJECT_ID",
+            "xnat:subjectData/SUBJECT_LABEL",
+            "xnat:subjectData/PROJECT",
+        ],
+        in_mr_project + ["OR"],
+    )
+    labels = set()
+    shared_ids = set()
+    for subject in subjects:
+        if subject["project"] in mr_projects:
+            labels.add(subject["subject_label"].split("_", 1)[0])
+        else:
+            shared_ids.add(subject["subject_id"])
+
+    if shared_ids:
+        sessions = backend.search(
+            "xnat:mrSessionData",
+            ["xnat:mrSessionData/SUBJECT_LABEL", "xnat:mrSessionData/PROJECT"],
+            [
+                in_mr_project + ["OR"],
+                [
+                    ("xnat:mrSessionData/subject_id", "=", subject_id)
+                    for subject_id in sorted(shared_ids)
+                ]
+                + ["OR"],
+                "AND",
+            ],
+        )
+        labels |= {session["subject_label"].split("_", 1)[0] for session in sessions}
+    return labels
+
+
+def get_indexed_subject_labels(
+    pyxnat_interface: Interface,
+    index: SubjectLabelIndex,
+    datatype: str,
+    project_name: str,
+    query_backend: QueryBackend = None,
+) -> set[str]:
+    """Return the subject label prefixes in this project, using a local index
+    which is brought up to date with a search for recently added sessions
+
+    Args:
+        pyxnat_interface: PyXnat session interface
+        index: local SubjectLabelIndex
+        datatype: data type to search for
+        project_name: project to search in
+        query_backend: optional QueryBackend used instead of the XNAT REST API
+
+    Returns:
+        set of subject labels from datatypes in matching project
+    """
+    started = datetime.now(timezone.utc)
+    inserted_since = index.inserted_since(project_name)
+    subjects = get_subject_labels(
+        pyxnat_interface=pyxnat_interface,
+        datatype=datatype,
+        project_name=project_name,
+        inserted_since=inserted_since,
+        query_backend=query_backend,
+    )
+    index.update(
+        project=project_name,
+        prefixes=subjects,
+        started=started,
+        full=inserted_since is None,
+    )
+    if inserted_since:
+        print(
+            f"Subject index for {project_name}: {len(subjects)} subjects in "
+            f"sessions added since {inserted_since}"
+        )
+    else:
+        print(f"Subject index for {project_name}: rebuilt")
+    return index.prefixes(project_name)
+
+
+@span("construct_email")
 def construct_email(
-    server_url: str, project_name: str, sessions_to_do: set[PetmrSessionRecord]
+    server_url: str,
+    project_name: str,
+    sessions_to_do: set[PetmrSessionRecord],
+    phase: int = 3,
 ) -> str:
     """Assemble the email html content with links to the subjects
 
@@ -89,12 +343,13 @@ def construct_email(
         server_url: Full URL of the XNAT server
         project_name: ID of the XNAT project
         sessions_to_do: set of PetmrSessionRecords to be linked in the email
+        phase: phase number of the sessions
 
     Returns:
         String containing the email body as HTML
     """
     body_html = (
-        "<p>The following subjects have phase 3 PET-MR sessions but "
+        f"<p>The following subjects have phase {phase} PET-MR sessions but "
         "do not have corresponding Chenies Mews MR data:"
     )
     body_html += "<p>"
@@ -106,12 +361,46 @@ def construct_email(
         )
         body_html += (
             f'<a href="{link_form}">Subject:{session.subject_label}'
-            f"</a> &nbsp; phase 3 session date: {session.date}<br><br>"
+            f"</a> &nbsp; phase {phase} session date: {session.date}<br><br>"
         )
 
     return body_html
 
 
+def construct_multi_phase_email(
+    server_url: str,
+    project_name: str,
+    sessions_by_phase: dict[int, set[PetmrSessionRecord]],
+) -> str:
+    """Assemble the email html content with a section for each phase
+
+    Args:
+        server_url: Full URL of the XNAT server
+        project_name: ID of the XNAT project
+        sessions_by_phase: dict of phase number to the PetmrSessionRecords to
+            be linked in that phase's section
+
+    Returns:
+        String containing the email body as HTML
+    """
+    body_html = ""
+    for phase, sessions_to_do in sorted(sessions_by_phase.items()):
+        body_html += f"<h3>Phase {phase}</h3>"
+        if sessions_to_do:
+            body_html += construct_email(
+                server_url=server_url,
+                project_name=project_name,
+                sessions_to_do=sessions_to_do,
+                phase=phase,
+            )
+        else:
+            body_html += (
+                f"<p>All subjects with phase {phase} PET-MR sessions have "
+                "Chenies Mews MR data.</p>"
+            )
+    return body_html
+
+
 def run_email_chenies(
     credentials: XnatCredentials,
     project_name: str,
@@ -120,6 +409,12 @@ def run_email_chenies(
     to_emails: list[str],
     cc_emails: list[str] = None,
     bcc_emails: list[str] = None,
+    deadline_seconds: float | None = None,
+    metrics: RunMetrics = None,
+    outbox_dir: str | None = None,
+    phases: list[int] | None = None,
+    subject_index_path: str | None = None,
+    sql_dsn: str | None = None,
 ):
     """Email notification about subjects which are missing phase 3 Chenies Mews
      data
@@ -129,10 +424,28 @@ def run_email_chenies(
     These subject labels are checked against the subject names in all projects
     specified by the list "mr_projects".
 
+    If several phases are given, all the PET-MR sessions in the project are
+    fetched in a single search and the phase of each session is found from
+    its label. The subjects for every phase are checked against the same MR
+    subject labels, and one email is sent with a section for each phase.
+
+    If subject_index_path is set, the MR subject labels are kept in a local
+    index, and each run only searches for MR sessions added since the
+    previous run (see SubjectLabelIndex).
+
+    If sql_dsn is set, the searches are run on a read-only replica of the
+    XNAT database instead of through the REST API (see SqlQueryBackend).
+
     Any subjects which have phase 3 PET-MR data but no corresponding MR data
     are listed in an email sent to the email addresses. Email addresses must
     correspond to registered XNAT users.
 
+    If deadline_seconds is set and the time budget runs out before the PET-MR
+    sessions have been found or all the MR projects have been searched, a
+    partial email is sent which states how many MR projects were checked.
+    Subjects whose MR data is in an unchecked project may be listed in a
+    partial email.
+
     Args:
         credentials: XNAT host name and user login details
         project_name: The project to search for PETMR sessions
@@ -144,61 +457,148 @@ def run_email_chenies(
             to addresses which already correspond to XNAT users on the server
         bcc_emails: list of email addresses for bcc. XNAT will only send emails
             to addresses which already correspond to XNAT users on the server
+        deadline_seconds: time budget for the run in seconds. If None there
+            is no time limit
+        metrics: optional RunMetrics which is filled in with the number of
+            sessions, requests, issues and the email size
+        outbox_dir: local outbox directory in which the email is stored
+            before it is sent, so that it can be retried if sending fails. If
+            None, the DRC_OUTBOX environment variable is used
+        phases: phase numbers to report on. Defaults to phase 3 only
+        subject_index_path: local SQLite file used to store the MR subject
+            labels between runs. If None, the DRC_SUBJECT_INDEX environment
+            variable is used. If neither is set, every MR session is listed
+            on each run
+        sql_dsn: if set, connection string of a read-only XNAT database used
+            for the searches (see open_query_backend)
     """
+    phases = phases or [3]
+    subject_index_path = subject_index_path or os.getenv("DRC_SUBJECT_INDEX")
+    deadline = Deadline(seconds=deadline_seconds)
+    coverage = Coverage(total=len(mr_projects), items="MR projects")
+
+    subject_index = (
+        SubjectLabelIndex(path=subject_index_path, host=credentials.host)
+        if subject_index_path
+        else None
+    )
 
-    with open_pyxnat_session(credentials=credentials) as pyxnat_interface:
-        # Get list of subjects containing phase 3 PET-MR sessions
-        phase3_petmr_sessions = get_sessions_for_phase(
-            pyxnat_interface=pyxnat_interface,
-            datatype="xnat:petmrSessionData",
-            phase=3,
-            project_name=project_name,
-        )
+    query_backend = open_query_backend(sql_dsn) if sql_dsn else None
+
+    with (
+        subject_index or nullcontext(),
+        query_backend or nullcontext(),
+        open_pyxnat_session(credentials=credentials) as pyxnat_interface,
+    ):
+        apply_deadline(get_http_session(pyxnat_interface), deadline)
+        if metrics:
+            track_requests(get_http_session(pyxnat_interface), metrics)
+
+        try:
+            if len(phases) == 1:
+                # Get list of subjects containing PET-MR sessions for this phase
+                petmr_sessions = get_sessions_for_phase(
+                    pyxnat_interface=pyxnat_interface,
+                    datatype="xnat:petmrSessionData",
+                    phase=phases[0],
+                    project_name=project_name,
+                    query_backend=query_backend,
+                )
+            else:
+                # Fetch all PET-MR sessions once; phases are found from the
+                # labels
+                petmr_sessions = get_petmr_sessions(
+                    pyxnat_interface=pyxnat_interface,
+                    datatype="xnat:petmrSessionData",
+                    project_name=project_name,
+                    query_backend=query_backend,
+                )
+        except Exception as ex:
+            if not is_deadline_error(ex):
+                raise
+            # No time remains to search the MR projects, so a partial report
+            # with no sessions is sent
+            print("Deadline reached before the PET-MR sessions were found")
+            petmr_sessions = []
+            coverage.truncated = True
         subjects_with_mr = set()
-        for mr_project in mr_projects:
-            subjects_with_mr = subjects_with_mr | get_subject_labels(
-                pyxnat_interface=pyxnat_interface,
-                datatype="xnat:mrSessionData",
-                project_name=mr_project,
-            )
-        subjects_already_added = set()
-        sessions = set()
-        for session in phase3_petmr_sessions:
-            session_id = session["session_id"]
-            session_label = session["label"]
-            session_date = session["date"]
-            subject_label = session_label.split("_", 1)[0]
-            if subject_label not in subjects_with_mr:
-                print(f"Phase 3 subject missing MR data: {subject_label}")
-
-                # Only store the first session found for each subject
-                if subject_label not in subjects_already_added:
-                    sessions.add(
-                        PetmrSessionRecord(
-                            id=session_id,
-                            label=session_label,
-                            subject_label=subject_label,
-                            date=session_date,
-                        )
+        if subject_index:
+            # The index is brought up to date separately for each project
+            for mr_project in mr_projects:
+                if deadline.expired():
+                    break
+                try:
+                    subjects_with_mr = subjects_with_mr | get_indexed_subject_labels(
+                        pyxnat_interface=pyxnat_interface,
+                        index=subject_index,
+                        datatype="xnat:mrSessionData",
+                        project_name=mr_project,
+                        query_backend=query_backend,
                     )
-                    subjects_already_added.add(subject_label)
+                except Exception as ex:
+                    if is_deadline_error(ex):
+                        break
+                    raise
+                coverage.checked += 1
+        elif not deadline.expired():
+            try:
+                subjects_with_mr = get_mr_subject_labels(
+                    pyxnat_interface=pyxnat_interface,
+                    mr_projects=mr_projects,
+                    query_backend=query_backend,
+                )
+                coverage.checked = len(mr_projects)
+            except Exception as ex:
+                if not is_deadline_error(ex):
+                    raise
+        print(f"Chenies checks {coverage.summary()}")
+        petmr_sessions = list(petmr_sessions)
+        sessions_by_phase = find_subjects_missing_mr(
+            petmr_sessions=petmr_sessions,
+            subjects_with_mr=subjects_with_mr,
+            phases=phases,
+        )
+        num_issues = sum(len(sessions) for sessions in sessions_by_phase.values())
 
-        if len(sessions) > 0:
+        if metrics:
+            metrics.sessions_scanned = len(petmr_sessions)
+            metrics.issues_found = num_issues
+            metrics.complete = coverage.complete
+
+        # Allow the time held in reserve to be used for sending the email
+        deadline.use_reserve()
+
+        if num_issues > 0 or not coverage.complete:
             # Construct email html body
-            body_html = construct_email(
-                server_url=credentials.host,
-                project_name=project_name,
-                sessions_to_do=sessions,
-            )
+            if len(phases) == 1:
+                body_html = construct_email(
+                    server_url=credentials.host,
+                    project_name=project_name,
+                    sessions_to_do=sessions_by_phase[phases[0]],
+                    phase=phases[0],
+                )
+            else:
+                body_html = construct_multi_phase_email(
+                    server_url=credentials.host,
+                    project_name=project_name,
+                    sessions_by_phase=sessions_by_phase,
+                )
+            body_html = coverage.summary_html() + body_html
+            if not coverage.complete:
+                email_subject += " (partial report)"
+            if metrics:
+                metrics.email_bytes = len(body_html.encode())
 
             # Send the email via XNAT
-            send_email(
+            send_or_queue_email(
                 session=pyxnat_interface,
+                host=credentials.host,
                 subject=email_subject,
                 to=to_emails,
                 cc=cc_emails,
                 bcc=bcc_emails,
                 content_html=body_html,
+                outbox_dir=outbox_dir,
             )
 
 
@@ -226,6 +626,24 @@ def main(args=None):
         For example:
             email_chenies "PETMRPROJ" "MRPROJECT1,MRPROJECT2" "user1@foo.org,user2@foo.org"
 
+    Optional arguments:
+        --deadline SECONDS: time budget for the run. When the budget runs
+            out, a partial email is sent
+        --profile PATH: write per-phase timings to PATH.folded (see
+            profile_run for further options)
+        --metrics-history PATH: append run metrics to this JSON lines file
+        --metrics-textfile PATH: write run metrics in OpenMetrics format
+        --outbox DIR: store the email in this local outbox before sending,
+            so that it can be retried if sending fails (see flush_outbox)
+        --phases LIST: comma-delimited phase numbers to report on in a
+            single email, for example "3,4". Default is phase 3
+        --subject-index PATH: keep the MR subject labels in this local
+            SQLite file and only search for MR sessions added since the
+            previous run
+        --sql DSN: run the searches on a read-only replica of the XNAT
+            database, for example "postgresql://user@replica/xnat". If not
+            given, the DRC_SQL_DSN environment variable is used
+
     For testing, main() can be called with an argument list to simulate
     command-line arguments, eg:
         main(['PETMRPROJ', 'MRPROJECT1,MRPROJECT2', 'user1@foo.org,user2@foo.org'])
@@ -235,21 +653,58 @@ def main(args=None):
     parser.add_argument("petmr_project")
     parser.add_argument("mr_projects")
     parser.add_argument("email_list")
+    parser.add_argument("--deadline", type=float, default=None)
+    add_profiling_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument("--outbox", default=None, metavar="DIR")
+    parser.add_argument("--phases", default="3")
+    parser.add_argument("--sql", default=os.getenv("DRC_SQL_DSN"), metavar="DSN")
+    parser.add_argument("--subject-index", default=None, metavar="PATH")
     parsed = parser.parse_args(args)
 
     project_name = parsed.petmr_project
     mr_projects = string_to_list(parsed.mr_projects)
     to_emails = string_to_list(parsed.email_list)
+    try:
+        phases = sorted({int(phase) for phase in string_to_list(parsed.phases)})
+    except ValueError:
+        raise ValueError(f"Invalid input for phases: {parsed.phases}")
+    phase_list = ", ".join(str(phase) for phase in phases)
+    email_subject = (
+        f"1946 update: Chenies Mews phase {phase_list} data"
+        if len(phases) == 1
+        else f"1946 update: Chenies Mews phases {phase_list} data"
+    )
 
     credentials = XnatContainerCredentials()
 
-    run_email_chenies(
-        credentials=credentials,
-        project_name=project_name,
-        mr_projects=mr_projects,
-        email_subject="1946 update: Chenies Mews phase 3 data",
-        to_emails=to_emails,
-    )
+    metrics = RunMetrics(command="email_chenies", project=project_name)
+    with (
+        profile_run(
+            command="email_chenies",
+            output_path=parsed.profile,
+            cprofile=parsed.profile_cprofile,
+            trace_memory=parsed.profile_memory,
+        ),
+        record_run(
+            metrics=metrics,
+            history_path=parsed.metrics_history,
+            textfile_path=parsed.metrics_textfile,
+        ),
+    ):
+        run_email_chenies(
+            credentials=credentials,
+            project_name=project_name,
+            mr_projects=mr_projects,
+            email_subject=email_subject,
+            to_emails=to_emails,
+            deadline_seconds=parsed.deadline,
+            metrics=metrics,
+            outbox_dir=parsed.outbox,
+            phases=phases,
+            subject_index_path=parsed.subject_index,
+            sql_dsn=parsed.sql,
+        )
 
 
 if __name__ == "__main__":
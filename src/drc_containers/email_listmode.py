@@ -1,24 +1,88 @@
+import asyncio
+import json
+import os
 from argparse import ArgumentParser
+from contextlib import nullcontext, suppress
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from urllib.parse import quote
 
 from pyxnat import Interface
-from pyxnat.core.resources import Experiments
+from pyxnat.core.errors import DatabaseError
 
+from drc_containers.xnat_utils.async_client import AsyncXnatClient, map_concurrently
+from drc_containers.xnat_utils.change_feed import (
+    SessionResultCache,
+    get_changed_items,
+)
+from drc_containers.xnat_utils.checkpoint import Checkpoint
 from drc_containers.xnat_utils.command_line import string_to_list
-from drc_containers.xnat_utils.email import send_email
+from drc_containers.xnat_utils.compact import SessionRow, intern, session_rows
+from drc_containers.xnat_utils.deadline import (
+    Coverage,
+    Deadline,
+    apply_deadline,
+    is_deadline_error,
+)
+from drc_containers.xnat_utils.federation import (
+    ServerResult,
+    federated_summary_html,
+    merge_coverage,
+    run_on_servers,
+)
+from drc_containers.xnat_utils.outbox import send_or_queue_email
+from drc_containers.xnat_utils.planner import BULK, PER_ITEM, QueryPlan, StrategyCost
+from drc_containers.xnat_utils.profiling import (
+    add_profiling_arguments,
+    profile_run,
+    span,
+)
+from drc_containers.xnat_utils.query_backend import (
+    QueryBackend,
+    RestQueryBackend,
+    open_query_backend,
+)
+from drc_containers.xnat_utils.run_metrics import (
+    RunMetrics,
+    add_metrics_arguments,
+    record_run,
+    track_requests,
+)
+from drc_containers.xnat_utils.sharding import (
+    Shard,
+    merge_partial_results,
+    remove_partial_results,
+    write_partial_results,
+)
 from drc_containers.xnat_utils.xnat_credentials import (
-    open_pyxnat_session,
     XnatContainerCredentials,
     XnatCredentials,
+    get_http_session,
+    open_pyxnat_session,
+    read_server_list,
 )
 
 
-@dataclass(frozen=True)
+class ListModeError(Enum):
+    """Listmode problems found in a session. The value is the message shown
+    in the email, in which {} is replaced by the details of the problem"""
+
+    LM_FILE_TOO_SMALL = "LM File is too small {}"
+    LM_MISSING = "LM does not exist"
+    WRONG_LM_COUNT = "Wrong number of LM files {}"
+    NORM_MISSING = "Norm does not exist"
+    WRONG_NORM_COUNT = "Wrong number of Norm files: {}"
+
+
+@dataclass(frozen=True, slots=True)
 class ListModeRecord:
     """Store data from sessions with listmode errors
     The frozen dataclass allows this to be used in a set to ensure no sessions
-    are repeated"""
+    are repeated
+
+    The errors are stored as compact codes (see encode_listmode_errors) and
+    only rendered as HTML when the email is constructed"""
 
     id: str
     label: str
@@ -26,10 +90,77 @@ class ListModeRecord:
     date: str
     errors: str
 
+    def error_html(self) -> str:
+        """Return the description of the errors shown in the email"""
+        messages = decode_listmode_errors(self.errors)
+        if messages is None:
+            # Records saved by earlier versions hold the rendered HTML
+            return self.errors
+        return (
+            f"Subject ID: {self.subject_id}   "
+            f"Scan Date: {self.date}   "
+            f"Errors: {', '.join(messages)}<br>"
+        )
+
 
-def get_recent_sessions(
-    pyxnat_interface: Interface, datatype: str, threshold_days: int, project_name: str
-) -> Experiments:
+def encode_listmode_errors(errors: list[tuple[ListModeError, str]]) -> str:
+    """Return a compact string encoding a list of errors, as a JSON list of
+    [code, details] pairs such as '[["LM_MISSING",""],["WRONG_NORM_COUNT","1"]]'.
+    The string is interned, since most sessions with errors share the same
+    few combinations
+
+    Args:
+        errors: list of (error code, details) tuples
+    """
+    return intern(
+        json.dumps(
+            [[code.name, detail] for code, detail in errors], separators=(",", ":")
+        )
+    )
+
+
+def decode_listmode_errors(errors: str) -> list[str] | None:
+    """Return the messages for errors encoded by encode_listmode_errors, or
+    None if the string is not in that encoding"""
+    try:
+        pairs = json.loads(errors)
+    except ValueError:
+        return None
+    if not isinstance(pairs, list):
+        return None
+    messages = []
+    for pair in pairs:
+        if not isinstance(pair, list) or len(pair) != 2:
+            return None
+        name, detail = pair
+        if name not in ListModeError.__members__:
+            return None
+        messages.append(ListModeError[name].value.format(detail))
+    return messages
+
+
+# Datatypes of the sessions which are checked for listmode data
+SESSION_DATATYPES = [
+    "xnat:crSessionData",
+    "xnat:mrSessionData",
+    "xnat:otherDicomSessionData",
+    "xnat:petSessionData",
+    "xnat:petmrSessionData",
+    "xnat:srSessionData",
+]
+
+# Typical sizes used to estimate the cost of checking the resources of
+# sessions one by one or with a listing for the whole project
+RESOURCES_PER_SESSION = 4
+RESOURCE_LISTING_BYTES = 1200
+FILE_LISTING_BYTES = 600
+RESOURCE_ROW_BYTES = 120
+
+
+def recent_sessions_query(
+    datatype: str, threshold_days: int, project_name: str
+) -> tuple[list[str], list]:
+    """Return the columns and constraints of the search for recent sessions"""
     threshold_date = datetime.now() - timedelta(threshold_days)
     str_threshold_date = threshold_date.strftime("%Y-%m-%d")
     columns = [
@@ -44,117 +175,669 @@ def get_recent_sessions(
         (datatype + "/date", ">=", str_threshold_date),
         "AND",
     ]
-    return pyxnat_interface.select(datatype, columns).where(constraints)
+    return columns, constraints
 
 
+@span("get_recent_sessions")
+def get_recent_sessions(
+    pyxnat_interface: Interface,
+    datatype: str,
+    threshold_days: int,
+    project_name: str,
+    query_backend: QueryBackend = None,
+) -> list[dict]:
+    """Return the rows of the search for recent sessions of a datatype. The
+    search is run by query_backend if given, or else through pyxnat"""
+    columns, constraints = recent_sessions_query(
+        datatype=datatype, threshold_days=threshold_days, project_name=project_name
+    )
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    return backend.search(datatype, columns, constraints)
+
+
+@span("get_sessions_by_id")
+def get_sessions_by_id(
+    query_backend: QueryBackend,
+    datatype: str,
+    project_name: str,
+    session_ids: list[str],
+) -> list[dict]:
+    """Return the rows of the search for the sessions of a datatype with
+    these IDs, with the same columns as get_recent_sessions
+
+    Args:
+        query_backend: QueryBackend used for the search
+        datatype: datatype of the sessions
+        project_name: project containing the sessions
+        session_ids: IDs of the sessions. A few IDs are searched for at a
+            time, so that each search stays small
+    """
+    columns, _ = recent_sessions_query(
+        datatype=datatype, threshold_days=0, project_name=project_name
+    )
+    rows = []
+    for start in range(0, len(session_ids), 100):
+        id_constraints = [
+            (datatype + "/SESSION_ID", "=", session_id)
+            for session_id in session_ids[start : start + 100]
+        ]
+        id_constraints.append("OR")
+        constraints = [
+            (datatype + "/project", "=", project_name),
+            id_constraints,
+            "AND",
+        ]
+        rows.extend(query_backend.search(datatype, columns, constraints))
+    return rows
+
+
+def listmode_errors(
+    lm_files: list[tuple[str, str]] | None, num_norm_files: int | None
+) -> list[tuple[ListModeError, str]]:
+    """Return the listmode errors for a session
+
+    Args:
+        lm_files: (name, size) of each file in the session's LM resources, or
+            None if the session has no LM resource. The size is only needed
+            for .bf files
+        num_norm_files: number of files in the session's Norm resources, or
+            None if the session has no Norm resource
+
+    Returns:
+        list of (error code, details) tuples
+    """
+    errors = []
+    num_lm_files = 0 if lm_files is None else len(lm_files)
+    for file_label, file_size in lm_files or []:
+        # Files whose size is not known are not checked
+        with suppress(TypeError, ValueError):
+            if ".bf" in file_label and int(file_size) < 1000000:
+                errors.append(
+                    (ListModeError.LM_FILE_TOO_SMALL, f"{file_label} - {file_size}")
+                )
+
+    if lm_files is None:
+        errors.append((ListModeError.LM_MISSING, ""))
+    elif num_lm_files != 2:
+        errors.append((ListModeError.WRONG_LM_COUNT, str(num_lm_files)))
+
+    if num_norm_files is None:
+        errors.append((ListModeError.NORM_MISSING, ""))
+    elif num_norm_files != 2:
+        errors.append((ListModeError.WRONG_NORM_COUNT, str(num_lm_files)))
+    return errors
+
+
+@span("check_session")
 def check_session(
     pyxnat_interface: Interface, session_id: str, project_name: str
-) -> [str]:
+) -> list[tuple[ListModeError, str]]:
     resources = (
         pyxnat_interface.select.project(project_name).experiment(session_id).resources()
     )
 
-    num_lm_files = 0
-    num_norm_files = 0
-    lm_found = False
-    norm_found = False
-    errors = []
+    lm_files = None
+    num_norm_files = None
 
     for resource in resources:
         res_label = resource.label()
         if res_label == "LM":
-            lm_found = True
+            lm_files = lm_files or []
             for file in resource.files():
-                num_lm_files += 1
                 file_label = file.label()
-                try:
-                    if ".bf" in file_label:
+                file_size = None
+                if ".bf" in file_label:
+                    try:
                         file_size = file.size()
-                        if int(file_size) < 1000000:
-                            errors.append(
-                                f"LM File is too small {file_label} - {file_size}"
-                            )
-                except:  # noqa: E722
-                    pass
+                    except (DatabaseError, IndexError, KeyError):
+                        # The size is missing from the file listing
+                        file_size = None
+                lm_files.append((file_label, file_size))
         elif res_label == "Norm":
-            norm_found = True
+            num_norm_files = num_norm_files or 0
             for _ in resource.files():
                 num_norm_files += 1
 
-    if not lm_found:
-        errors.append("LM does not exist")
-    elif num_lm_files != 2:
-        errors.append(f"Wrong number of LM files {num_lm_files}")
+    return listmode_errors(lm_files=lm_files, num_norm_files=num_norm_files)
 
-    if not norm_found:
-        errors.append("Norm does not exist")
-    elif num_norm_files != 2:
-        errors.append(f"Wrong number of Norm files: {num_lm_files}")
-    return errors
 
+async def async_check_session(
+    client: AsyncXnatClient, session_id: str, project_name: str
+) -> list[tuple[ListModeError, str]]:
+    """Asynchronous version of check_session"""
+    resources = await client.experiment_resources(project_name, session_id)
+    lm_resources = [r for r in resources if r["label"] == "LM"]
+    norm_resources = [r for r in resources if r["label"] == "Norm"]
+    listings = await asyncio.gather(
+        *(
+            client.resource_files(
+                project_name, session_id, r["xnat_abstractresource_id"]
+            )
+            for r in lm_resources + norm_resources
+        )
+    )
+    lm_listings = listings[: len(lm_resources)]
+    norm_listings = listings[len(lm_resources) :]
+
+    lm_files = None
+    if lm_resources:
+        lm_files = [(f["Name"], f.get("Size")) for files in lm_listings for f in files]
+    num_norm_files = None
+    if norm_resources:
+        num_norm_files = sum(len(files) for files in norm_listings)
+    return listmode_errors(lm_files=lm_files, num_norm_files=num_norm_files)
+
+
+def resource_check_costs(
+    num_sessions: int, num_project_sessions: int
+) -> list[StrategyCost]:
+    """Return the estimated cost of checking the resources of sessions
+
+    Checking each session on its own lists its resources and the files in
+    its LM and Norm resources. Checking in bulk lists the resources of every
+    session of the datatype in the project with a single request, and then
+    only lists the files in the LM resource of each session checked.
+
+    Args:
+        num_sessions: number of sessions to be checked
+        num_project_sessions: number of sessions of the datatype in the
+            project, all of which are included in the bulk listing
+    """
+    return [
+        StrategyCost(
+            strategy=PER_ITEM,
+            requests=3 * num_sessions,
+            bytes=num_sessions * (RESOURCE_LISTING_BYTES + 2 * FILE_LISTING_BYTES),
+        ),
+        StrategyCost(
+            strategy=BULK,
+            requests=1 + num_sessions,
+            bytes=num_project_sessions * RESOURCES_PER_SESSION * RESOURCE_ROW_BYTES
+            + num_sessions * FILE_LISTING_BYTES,
+        ),
+    ]
+
+
+@span("plan_resource_checks")
+def plan_resource_checks(
+    plan: QueryPlan,
+    query_backend: QueryBackend,
+    datatype: str,
+    project_name: str,
+    num_sessions: int,
+) -> str:
+    """Choose whether to check the resources of the sessions of a datatype
+    one by one or in bulk
+
+    The sessions in the project are only counted if a bulk listing could be
+    cheaper, since the project has at least as many sessions as are being
+    checked.
+
+    Args:
+        plan: QueryPlan in which the choice is recorded
+        query_backend: QueryBackend used to count the sessions in the project
+        datatype: datatype of the sessions
+        project_name: project containing the sessions
+        num_sessions: number of sessions to be checked
+
+    Returns:
+        the chosen strategy, PER_ITEM or BULK
+    """
+    phase = f"{datatype} resources"
+    costs = resource_check_costs(num_sessions, num_project_sessions=num_sessions)
+    if costs[0].seconds > costs[1].seconds:
+        num_project_sessions = query_backend.count_sessions(datatype, project_name)
+        plan.estimate_requests += 1
+        costs = resource_check_costs(
+            num_sessions, num_project_sessions=num_project_sessions
+        )
+    return plan.choose(phase=phase, items=num_sessions, options=costs)
+
+
+@span("list_project_resources")
+def list_project_resources(
+    pyxnat_interface: Interface, datatype: str, project_name: str
+) -> dict[str, list[tuple[str, int | None]]]:
+    """Return the resources of every session of a datatype in a project,
+    using a single listing
+
+    Args:
+        pyxnat_interface: current pyxnat session
+        datatype: datatype of the sessions
+        project_name: project containing the sessions
+
+    Returns:
+        dict of session ID to a list of the (label, file count) of each of
+        its resources. The file count is None if XNAT has not recorded it.
+        The dict is empty if the server did not return the resource columns
+    """
+    label_column = f"{datatype}/resources/resource/label"
+    count_column = f"{datatype}/resources/resource/file_count"
+    rows = pyxnat_interface.array.experiments(
+        project_id=project_name,
+        experiment_type=datatype,
+        columns=[label_column, count_column],
+    )
+    resources = {}
+    for row in rows:
+        values = {key.lower(): value for key, value in row.items()}
+        if label_column.lower() not in values:
+            # Without the resource columns every session would appear to
+            # have no resources, so the sessions are checked one by one
+            return {}
+        session_resources = resources.setdefault(values["id"], [])
+        label = values[label_column.lower()]
+        if label:
+            count = values.get(count_column.lower())
+            session_resources.append((label, int(count) if count else None))
+    return resources
 
+
+@span("check_session_from_listing")
+def check_session_from_listing(
+    pyxnat_interface: Interface,
+    session_id: str,
+    project_name: str,
+    resources: list[tuple[str, int | None]],
+) -> list[tuple[ListModeError, str]] | None:
+    """Check a session using its resources from list_project_resources, so
+    that only the files in its LM resource need to be listed
+
+    Args:
+        pyxnat_interface: current pyxnat session
+        session_id: ID of the session
+        project_name: project containing the session
+        resources: (label, file count) of each resource of the session
+
+    Returns:
+        list of (error code, details) tuples, or None if the listing does not
+        hold enough detail and the session must be checked by check_session
+    """
+    lm_resources = [count for label, count in resources if label == "LM"]
+    norm_counts = [count for label, count in resources if label == "Norm"]
+    if len(lm_resources) > 1 or None in norm_counts:
+        return None
+
+    lm_files = None
+    if lm_resources:
+        response = pyxnat_interface.get(
+            f"/data/projects/{quote(project_name, safe='')}/experiments/"
+            f"{quote(session_id, safe='')}/resources/LM/files",
+            params={"format": "json"},
+        )
+        response.raise_for_status()
+        files = response.json()["ResultSet"]["Result"]
+        lm_files = [(f["Name"], f.get("Size")) for f in files]
+    num_norm_files = sum(norm_counts) if norm_counts else None
+    return listmode_errors(lm_files=lm_files, num_norm_files=num_norm_files)
+
+
+def listmode_record(
+    session: SessionRow, errors: list[tuple[ListModeError, str]]
+) -> ListModeRecord | None:
+    """Return a ListModeRecord describing the errors found for a session, or
+    None if there are no errors"""
+    if len(errors) == 0:
+        return None
+    return ListModeRecord(
+        id=session.session_id,
+        label=session.label,
+        subject_id=session.subject_id,
+        date=session.date,
+        errors=encode_listmode_errors(errors),
+    )
+
+
+@span("get_listmode_issues")
 def get_listmode_issues(
-    pyxnat_interface: Interface, threshold_days: int, project_name: str
+    pyxnat_interface: Interface,
+    threshold_days: int,
+    project_name: str,
+    checkpoint: Checkpoint = None,
+    deadline: Deadline = None,
+    coverage: Coverage = None,
+    shard: Shard = None,
+    query_backend: QueryBackend = None,
+    plan: QueryPlan = None,
+    plan_only: bool = False,
+    result_cache: SessionResultCache = None,
 ) -> set[ListModeRecord]:
     """Get list of sessions which have errors in the listmode data
 
+    Sessions are checked newest first, so that if the deadline is reached the
+    most recent sessions have been covered.
+
+    For each datatype, the plan chooses whether the resources of the
+    sessions are listed one session at a time or in a single listing for the
+    whole project (see plan_resource_checks).
+
+    If result_cache is set, only the sessions which XNAT's change history
+    shows have changed since the previous run are checked, and the stored
+    results are reused for the others. Changed sessions older than
+    threshold_days are checked too, so that LM or Norm data uploaded or
+    deleted after a session has left the window is not missed. Stored
+    results are only reported for the sessions found by this run, and the
+    results of other sessions are removed from the cache.
+
     Args:
         pyxnat_interface: current pyxnat session
         threshold_days: check only sessions created within this number of days
         project_name: name of project in which to check sessions
+        checkpoint: optional Checkpoint used to save progress. Sessions which
+            the checkpoint marks as done are not checked again
+        deadline: optional time budget. No further sessions are checked once
+            the deadline has expired
+        coverage: optional Coverage which is updated with the number of
+            sessions found and checked
+        shard: if set, only sessions belonging to this shard are checked
+        query_backend: optional QueryBackend used to search for sessions
+            instead of the XNAT REST API
+        plan: optional QueryPlan in which the strategy for each datatype is
+            recorded
+        plan_only: if True, return once the plan has been made, without
+            checking any sessions
+        result_cache: optional SessionResultCache holding the results of
+            previous runs
 
     Returns:
         set of ListModeRecords, each describing a session with missing listmode
             data
     """
-    session_datatypes = [
-        "xnat:crSessionData",
-        "xnat:mrSessionData",
-        "xnat:otherDicomSessionData",
-        "xnat:petSessionData",
-        "xnat:petmrSessionData",
-        "xnat:srSessionData",
-    ]
-    issue_list = set()
-
-    for datatype in session_datatypes:
-        sessions = get_recent_sessions(
-            pyxnat_interface=pyxnat_interface,
-            datatype=datatype,
-            threshold_days=threshold_days,
-            project_name=project_name,
-        )
-        for session in sessions.data:
-            session_id = session["session_id"]
-            session_label = session["label"]
-            subject_id = session["subject_id"]
-            session_date = session["date"]
+    issue_list = set(checkpoint.records) if checkpoint else set()
+    if coverage is None:
+        coverage = Coverage()
+    if plan is None:
+        plan = QueryPlan()
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
 
-            errors = check_session(
+    started = datetime.now(timezone.utc)
+    changed = None
+    if result_cache:
+        since = result_cache.changed_since()
+        if since:
+            try:
+                changed = get_changed_items(backend, project_name, since)
+            except Exception as ex:
+                if is_deadline_error(ex):
+                    coverage.truncated = True
+                    return issue_list
+                raise
+            print(f"Change feed: {len(changed)} items changed since {since}")
+        else:
+            print("Change feed: checking every session")
+
+    candidates = []
+    bulk_datatypes = []
+    for datatype in SESSION_DATATYPES:
+        try:
+            sessions = get_recent_sessions(
                 pyxnat_interface=pyxnat_interface,
-                session_id=session_id,
+                datatype=datatype,
+                threshold_days=threshold_days,
                 project_name=project_name,
+                query_backend=query_backend,
             )
-            if len(errors) > 0:
-                error_string = ", ".join(errors)
-                message = (
-                    f"Subject ID: {subject_id}   "
-                    f"Scan Date: {session_date}   "
-                    f"Errors: {error_string}<br>"
+            if changed:
+                # Changed sessions which are older than the window
+                found = {s["session_id"] for s in sessions}
+                older_ids = [
+                    item_id
+                    for item_id, item_type in changed.items()
+                    if item_type.lower() == datatype.lower() and item_id not in found
+                ]
+                older = get_sessions_by_id(
+                    query_backend=backend,
+                    datatype=datatype,
+                    project_name=project_name,
+                    session_ids=older_ids,
                 )
-                issue_list.add(
-                    ListModeRecord(
-                        id=session_id,
-                        label=session_label,
-                        subject_id=subject_id,
-                        date=session_date,
-                        errors=message,
-                    )
+                # Sessions which have been deleted or moved to another project
+                result_cache.discard(set(older_ids) - {s["session_id"] for s in older})
+                sessions = list(sessions) + older
+            rows = session_rows(
+                s for s in sessions if not shard or shard.contains(s["session_id"])
+            )
+            candidates.extend(rows)
+            to_check = [
+                row
+                for row in rows
+                if not (checkpoint and checkpoint.is_done(row.session_id))
+                and not (
+                    result_cache and result_cache.is_unchanged(row.session_id, changed)
+                )
+            ]
+            if to_check:
+                strategy = plan_resource_checks(
+                    plan=plan,
+                    query_backend=backend,
+                    datatype=datatype,
+                    project_name=project_name,
+                    num_sessions=len(to_check),
+                )
+                if strategy == BULK:
+                    bulk_datatypes.append(datatype)
+        except Exception as ex:
+            if is_deadline_error(ex):
+                # Not all sessions could be found, so the total is not known
+                coverage.truncated = True
+                break
+            raise
+
+    candidates.sort(key=lambda s: s.date, reverse=True)
+    coverage.total = len(candidates)
+    if plan_only:
+        return issue_list
+    if result_cache and changed is None:
+        result_cache.clear()
+
+    listings = {}
+    try:
+        for datatype in bulk_datatypes:
+            listings.update(
+                list_project_resources(
+                    pyxnat_interface=pyxnat_interface,
+                    datatype=datatype,
+                    project_name=project_name,
+                )
+            )
+    except Exception as ex:
+        if is_deadline_error(ex):
+            print(f"Deadline reached: {coverage.summary()}")
+            return issue_list
+        raise
+
+    num_reused = 0
+    for session in candidates:
+        session_id = session.session_id
+
+        if checkpoint and checkpoint.is_done(session_id):
+            coverage.checked += 1
+            continue
+
+        if result_cache and result_cache.is_unchanged(session_id, changed):
+            record = result_cache.record(session_id)
+            if record:
+                issue_list.add(record)
+            coverage.checked += 1
+            num_reused += 1
+            continue
+
+        if deadline and deadline.expired():
+            print(f"Deadline reached: {coverage.summary()}")
+            break
+
+        try:
+            errors = None
+            if session_id in listings:
+                errors = check_session_from_listing(
+                    pyxnat_interface=pyxnat_interface,
+                    session_id=session_id,
+                    project_name=project_name,
+                    resources=listings[session_id],
                 )
+            if errors is None:
+                errors = check_session(
+                    pyxnat_interface=pyxnat_interface,
+                    session_id=session_id,
+                    project_name=project_name,
+                )
+        except Exception as ex:
+            if is_deadline_error(ex):
+                print(f"Deadline reached: {coverage.summary()}")
+                break
+            raise
+
+        record = listmode_record(session, errors)
+        if record:
+            issue_list.add(record)
+        if result_cache:
+            result_cache.store(session_id, record)
+
+        coverage.checked += 1
+        if checkpoint:
+            checkpoint.mark_done(session_id, record)
+
+    if result_cache:
+        print(
+            f"Change feed: {coverage.checked - num_reused} sessions checked, "
+            f"{num_reused} results reused"
+        )
+        candidate_ids = {s.session_id for s in candidates}
+        if not coverage.truncated:
+            # Sessions which have left the window, or older sessions whose
+            # change has been reported, are no longer checked
+            result_cache.retain(candidate_ids)
+        if coverage.complete:
+            result_cache.update(started=started, full=changed is None)
+        # Include the stored errors of sessions not reached before the deadline
+        issue_list |= result_cache.records(candidate_ids)
 
     return issue_list
 
 
+async def async_get_listmode_issues(
+    client: AsyncXnatClient,
+    threshold_days: int,
+    project_name: str,
+    checkpoint: Checkpoint = None,
+    deadline: Deadline = None,
+    coverage: Coverage = None,
+    shard: Shard = None,
+    concurrency: int = 100,
+    query_backend: QueryBackend = None,
+) -> set[ListModeRecord]:
+    """Asynchronous version of get_listmode_issues, which checks many
+    sessions at once
+
+    The searches for each datatype run concurrently, and then up to
+    concurrency sessions are checked at once, newest first.
+
+    Args:
+        client: open AsyncXnatClient
+        threshold_days: check only sessions created within this number of days
+        project_name: name of project in which to check sessions
+        checkpoint: optional Checkpoint used to save progress. Sessions which
+            the checkpoint marks as done are not checked again
+        deadline: optional time budget. No further sessions are checked once
+            the deadline has expired
+        coverage: optional Coverage which is updated with the number of
+            sessions found and checked
+        shard: if set, only sessions belonging to this shard are checked
+        concurrency: maximum number of sessions checked at once
+        query_backend: optional QueryBackend used to search for sessions
+            instead of the XNAT REST API
+
+    Returns:
+        set of ListModeRecords, each describing a session with missing listmode
+            data
+    """
+    issue_list = set(checkpoint.records) if checkpoint else set()
+    if coverage is None:
+        coverage = Coverage()
+
+    queries = [
+        (
+            datatype,
+            *recent_sessions_query(
+                datatype=datatype,
+                threshold_days=threshold_days,
+                project_name=project_name,
+            ),
+        )
+        for datatype in SESSION_DATATYPES
+    ]
+    if query_backend:
+        # Database searches are quick, so they are run one after the other
+        results = [query_backend.search(*query) for query in queries]
+    else:
+        results = await asyncio.gather(
+            *(client.search(*query) for query in queries), return_exceptions=True
+        )
+    candidates = []
+    for result in results:
+        if isinstance(result, BaseException):
+            if is_deadline_error(result):
+                # Not all sessions could be found, so the total is not known
+                coverage.truncated = True
+                continue
+            raise result
+        candidates.extend(
+            session_rows(
+                s for s in result if not shard or shard.contains(s["session_id"])
+            )
+        )
+
+    candidates.sort(key=lambda s: s.date, reverse=True)
+    coverage.total = len(candidates)
+
+    async def check(session: SessionRow):
+        session_id = session.session_id
+        if checkpoint and checkpoint.is_done(session_id):
+            coverage.checked += 1
+            return
+        if deadline and deadline.expired():
+            return
+        try:
+            errors = await async_check_session(
+                client=client, session_id=session_id, project_name=project_name
+            )
+        except Exception as ex:
+            if is_deadline_error(ex):
+                return
+            raise
+
+        record = listmode_record(session, errors)
+        if record:
+            issue_list.add(record)
+        coverage.checked += 1
+        if checkpoint:
+            checkpoint.mark_done(session_id, record)
+
+    await map_concurrently(check, candidates, concurrency)
+    if not coverage.complete:
+        print(f"Deadline reached: {coverage.summary()}")
+    return issue_list
+
+
+async def _get_listmode_issues_with_async_client(
+    credentials: XnatCredentials,
+    max_in_flight: int,
+    metrics: RunMetrics = None,
+    deadline: Deadline = None,
+    **kwargs,
+) -> set[ListModeRecord]:
+    async with AsyncXnatClient(
+        credentials=credentials,
+        max_in_flight=max_in_flight,
+        deadline=deadline,
+        metrics=metrics,
+    ) as client:
+        return await async_get_listmode_issues(
+            client=client, deadline=deadline, concurrency=max_in_flight, **kwargs
+        )
+
+
+@span("construct_email")
 def construct_email(
     server_url: str, project_name: str, list_mode_records: set[ListModeRecord]
 ) -> str:
@@ -175,10 +858,170 @@ def construct_email(
             f"{server_url}/data/projects/{project_name}/subjects/{session.subject_id}"
         )
 
-        body_html += f'<a href="{link_form}">Subject ID:{session.subject_id}</a> &nbsp; Scan Date:{session.date} Errors:{session.errors}<br>'
+        body_html += f'<a href="{link_form}">Subject ID:{session.subject_id}</a> &nbsp; Scan Date:{session.date} Errors:{session.error_html()}<br>'
     return body_html
 
 
+@span("construct_federated_email")
+def construct_federated_email(project_name: str, results: list[ServerResult]) -> str:
+    """Assemble the email html content for a run across several servers, as
+    a table with a column giving the server of each session
+
+    Args:
+        project_name: ID of the XNAT project on each server
+        results: ServerResult from each server, whose records are
+            ListModeRecords
+
+    Returns:
+        String containing the email body as HTML
+    """
+    body_html = (
+        "<table><tr><th>Server</th><th>Subject ID</th><th>Scan Date</th>"
+        "<th>Errors</th></tr>"
+    )
+    for result in results:
+        server_url = result.credentials.host
+        for session in sorted(result.records, key=lambda r: r.date, reverse=True):
+            link_form = (
+                f"{server_url}/data/projects/{project_name}/subjects/"
+                f"{session.subject_id}"
+            )
+            body_html += (
+                f"<tr><td>{result.name}</td>"
+                f'<td><a href="{link_form}">{session.subject_id}</a></td>'
+                f"<td>{session.date}</td><td>{session.error_html()}</td></tr>"
+            )
+    return body_html + "</table>"
+
+
+def email_listmode_federated(
+    credentials: XnatCredentials,
+    servers: dict[str, XnatCredentials],
+    project_name: str,
+    email_subject: str,
+    to_emails: list[str],
+    threshold_days: int = 90,
+    cc_emails: list[str] | None = None,
+    bcc_emails: list[str] | None = None,
+    debug_output: bool = True,
+    deadline_seconds: float | None = None,
+    metrics: RunMetrics = None,
+    outbox_dir: str | None = None,
+    max_in_flight: int | None = None,
+):
+    """Email a single listmode report covering the same project on several
+    XNAT servers
+
+    The servers are checked at the same time, each with its own session and
+    connection pool. A server which fails is listed as failed in the email
+    and does not stop the others being reported. Set deadline_seconds so
+    that a slow server cannot delay the report: each server stops at the
+    deadline and the email states how many sessions it covered.
+
+    Args:
+        credentials: XNAT server through which the email is sent
+        servers: credentials of each server to be checked, keyed by the
+            server name shown in the email (see read_server_list)
+        project_name: The project to search for sessions on each server
+        email_subject: subject line of email
+        to_emails: list of email addresses. XNAT will only send emails
+            to addresses which already correspond to XNAT users on the server
+        threshold_days: check only sessions created within this number of days
+        cc_emails: list of email addresses for cc
+        bcc_emails: list of email addresses for bcc
+        debug_output: set to True to output debugging data to the console
+        deadline_seconds: time budget for the run in seconds. If None there
+            is no time limit
+        metrics: optional RunMetrics which is filled in with the totals for
+            all servers
+        outbox_dir: local outbox directory in which the email is stored
+            before it is sent. If None, the DRC_OUTBOX environment variable
+            is used
+        max_in_flight: if set, check sessions with the asyncio client,
+            keeping up to this number of requests in flight on each server
+    """
+    deadline = Deadline(seconds=deadline_seconds)
+
+    def check_server(
+        server: XnatCredentials, coverage: Coverage, server_metrics: RunMetrics
+    ) -> set[ListModeRecord]:
+        if max_in_flight:
+            return asyncio.run(
+                _get_listmode_issues_with_async_client(
+                    credentials=server,
+                    threshold_days=threshold_days,
+                    project_name=project_name,
+                    deadline=deadline,
+                    coverage=coverage,
+                    max_in_flight=max_in_flight,
+                    metrics=server_metrics,
+                )
+            )
+        with open_pyxnat_session(credentials=server) as server_session:
+            apply_deadline(get_http_session(server_session), deadline)
+            if server_metrics:
+                track_requests(get_http_session(server_session), server_metrics)
+            return get_listmode_issues(
+                pyxnat_interface=server_session,
+                threshold_days=threshold_days,
+                project_name=project_name,
+                deadline=deadline,
+                coverage=coverage,
+            )
+
+    results = run_on_servers(servers=servers, check=check_server, metrics=metrics)
+    coverage = merge_coverage(results)
+    num_issues = sum(len(result.records) for result in results)
+    complete = all(result.complete for result in results)
+
+    # Allow the time held in reserve to be used for sending the email
+    deadline.use_reserve()
+
+    if debug_output:
+        print("Sessions failing listmode checks:")
+        for result in results:
+            for s in result.records:
+                print(f"{result.name}: {s}")
+        if num_issues == 0:
+            print("None found")
+
+    print(f"Listmode checks {coverage.summary()} on {len(results)} servers")
+    if metrics:
+        metrics.sessions_scanned = coverage.checked
+        metrics.issues_found = num_issues
+        metrics.complete = complete
+
+    if num_issues == 0 and complete:
+        return
+
+    body_html = federated_summary_html(results) + construct_federated_email(
+        project_name=project_name, results=results
+    )
+    if not complete:
+        email_subject += " (partial report)"
+    if metrics:
+        metrics.email_bytes = len(body_html.encode())
+
+    print("Sending email with the following content:")
+    print(f"To: {to_emails}")
+    print(f"cc: {cc_emails}")
+    print(f"bcc: {bcc_emails}")
+    print(f"Subject: {email_subject}")
+    print(body_html)
+
+    with open_pyxnat_session(credentials=credentials) as xnat_session:
+        send_or_queue_email(
+            session=xnat_session,
+            host=credentials.host,
+            subject=email_subject,
+            to=to_emails,
+            cc=cc_emails,
+            bcc=bcc_emails,
+            content_html=body_html,
+            outbox_dir=outbox_dir,
+        )
+
+
 def email_listmode(
     credentials: XnatCredentials,
     project_name: str,
@@ -188,6 +1031,19 @@ def email_listmode(
     cc_emails: list[str] = None,
     bcc_emails: list[str] = None,
     debug_output: bool = True,
+    checkpoint_path: str | None = None,
+    resume: bool = False,
+    checkpoint_interval: int = 50,
+    deadline_seconds: float | None = None,
+    metrics: RunMetrics = None,
+    shard: Shard = None,
+    shard_dir: str | None = None,
+    merge_shards: int | None = None,
+    outbox_dir: str | None = None,
+    max_in_flight: int | None = None,
+    sql_dsn: str | None = None,
+    explain: bool = False,
+    change_cache_path: str | None = None,
 ):
     """Email notification about image sessions with listmode errors
 
@@ -195,6 +1051,38 @@ def email_listmode(
     checked for missing or incorrect listmode data. Any errors found are
     listed in an email sent to the specified email addresses.
 
+    If checkpoint_path is set, progress is saved periodically to this file so
+    that an interrupted run can be continued by calling again with resume set
+    to True. The file is removed once the run has completed.
+
+    If deadline_seconds is set, checks stop when the time budget runs out and
+    a partial email is sent stating how many sessions were checked. The
+    checkpoint file is kept after a partial run, so that the next run with
+    resume set to True continues from where this run stopped.
+
+    For large projects the checks can be split across several container
+    instances. Each instance is run with a different shard and writes its
+    results to the shared directory shard_dir instead of sending an email.
+    A final run with merge_shards set to the number of shards combines the
+    results and sends a single email.
+
+    If max_in_flight is set, the sessions are checked with the asyncio client
+    (see async_get_listmode_issues), which can keep many more requests in
+    flight than the synchronous pyxnat session.
+
+    If sql_dsn is set, the searches for recent sessions are run on a
+    read-only replica of the XNAT database instead of through the REST API
+    (see SqlQueryBackend). The resources of each session are still checked
+    through the REST API.
+
+    If explain is True, the sessions are searched for and the plan for
+    checking them is printed (see QueryPlan), but no sessions are checked and
+    no email is sent.
+
+    If change_cache_path is set, the results of each run are kept in a local
+    cache, and later runs only check the sessions which XNAT's change history
+    shows have changed (see SessionResultCache).
+
     Args:
         credentials: XNAT host name and user login details
         project_name: The project to search for sessions
@@ -207,16 +1095,162 @@ def email_listmode(
         bcc_emails: list of email addresses for bcc. XNAT will only send emails
             to addresses which already correspond to XNAT users on the server
         debug_output: set to True to output debugging data to the console
+        checkpoint_path: local file used to save progress. If None, progress
+            is not saved
+        resume: set to True to skip sessions already processed by a previous
+            interrupted run with the same checkpoint_path
+        checkpoint_interval: save progress after this number of sessions
+        deadline_seconds: time budget for the run in seconds. If None there
+            is no time limit
+        metrics: optional RunMetrics which is filled in with the number of
+            sessions, requests, issues and the email size
+        shard: if set, only check the sessions in this shard and write the
+            results to shard_dir without sending an email
+        shard_dir: directory for sharing results between shards and the
+            merge step
+        merge_shards: if set, do not check any sessions but send an email
+            combining the results written to shard_dir by this number of
+            shards
+        outbox_dir: local outbox directory in which the email is stored
+            before it is sent, so that it can be retried if sending fails. If
+            None, the DRC_OUTBOX environment variable is used
+        max_in_flight: if set, check sessions with the asyncio client,
+            keeping up to this number of requests in flight
+        sql_dsn: if set, connection string of a read-only XNAT database used
+            for the searches (see open_query_backend)
+        explain: if True, print the plan for checking the sessions instead
+            of checking them
+        change_cache_path: local SQLite file used to store the result for
+            each session between runs. If None, the DRC_CHANGE_CACHE
+            environment variable is used. If neither is set, every session
+            in the window is checked on each run
     """
+    if (shard or merge_shards) and not shard_dir:
+        raise ValueError("A shard directory must be specified for sharded runs")
+    shard_key = f"email_listmode-{project_name}-{threshold_days}"
+    change_cache_path = change_cache_path or os.getenv("DRC_CHANGE_CACHE")
+    if change_cache_path and (shard or merge_shards or max_in_flight):
+        raise ValueError(
+            "The change cache cannot be used with shards or the asyncio client"
+        )
+    query_backend = open_query_backend(sql_dsn) if sql_dsn else None
+    result_cache = (
+        SessionResultCache(
+            path=change_cache_path,
+            host=credentials.host,
+            key=f"email_listmode:{project_name}:{threshold_days}",
+            record_type=ListModeRecord,
+        )
+        if change_cache_path
+        else None
+    )
 
-    with open_pyxnat_session(credentials=credentials) as xnat_session:
-        # Get list of ListModeRecords
-        sessions_to_report = get_listmode_issues(
-            pyxnat_interface=xnat_session,
-            threshold_days=threshold_days,
-            project_name=project_name,
+    if explain:
+        plan = QueryPlan()
+        with (
+            result_cache or nullcontext(),
+            query_backend or nullcontext(),
+            open_pyxnat_session(credentials=credentials) as xnat_session,
+        ):
+            get_listmode_issues(
+                pyxnat_interface=xnat_session,
+                threshold_days=threshold_days,
+                project_name=project_name,
+                shard=shard,
+                query_backend=query_backend,
+                plan=plan,
+                plan_only=True,
+                result_cache=result_cache,
+            )
+        print(plan.explain())
+        return
+
+    deadline = Deadline(seconds=deadline_seconds)
+    coverage = Coverage()
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint = Checkpoint(
+            path=checkpoint_path,
+            key=f"email_listmode:{project_name}:{threshold_days}:{shard}",
+            record_type=ListModeRecord,
+            save_interval=checkpoint_interval,
+            resume=resume,
         )
 
+    with (
+        result_cache or nullcontext(),
+        query_backend or nullcontext(),
+        open_pyxnat_session(credentials=credentials) as xnat_session,
+    ):
+        apply_deadline(get_http_session(xnat_session), deadline)
+        if metrics:
+            track_requests(get_http_session(xnat_session), metrics)
+
+        if merge_shards:
+            # The sessions were checked by separate shard runs
+            sessions_to_report = merge_partial_results(
+                shard_dir=shard_dir,
+                key=shard_key,
+                num_shards=merge_shards,
+                record_type=ListModeRecord,
+                coverage=coverage,
+            )
+        else:
+            # Get list of ListModeRecords. The checkpoint saves progress if the
+            # search is interrupted
+            with checkpoint or nullcontext():
+                if max_in_flight:
+                    with span("get_listmode_issues"):
+                        sessions_to_report = asyncio.run(
+                            _get_listmode_issues_with_async_client(
+                                credentials=credentials,
+                                threshold_days=threshold_days,
+                                project_name=project_name,
+                                checkpoint=checkpoint,
+                                deadline=deadline,
+                                coverage=coverage,
+                                shard=shard,
+                                max_in_flight=max_in_flight,
+                                metrics=metrics,
+                                query_backend=query_backend,
+                            )
+                        )
+                else:
+                    sessions_to_report = get_listmode_issues(
+                        pyxnat_interface=xnat_session,
+                        threshold_days=threshold_days,
+                        project_name=project_name,
+                        checkpoint=checkpoint,
+                        deadline=deadline,
+                        coverage=coverage,
+                        shard=shard,
+                        query_backend=query_backend,
+                        result_cache=result_cache,
+                    )
+            if checkpoint:
+                # Save the final results in case sending the email fails
+                checkpoint.save()
+
+        if shard:
+            # The email is sent by the merge step once all shards have run
+            write_partial_results(
+                shard_dir=shard_dir,
+                key=shard_key,
+                shard=shard,
+                records=sessions_to_report,
+                coverage=coverage,
+            )
+            if metrics:
+                metrics.sessions_scanned = coverage.checked
+                metrics.issues_found = len(sessions_to_report)
+                metrics.complete = coverage.complete
+            if checkpoint and coverage.complete:
+                checkpoint.clear()
+            return
+
+        # Allow the time held in reserve to be used for sending the email
+        deadline.use_reserve()
+
         if debug_output:
             print("Sessions failing listmode checks:")
             if len(sessions_to_report) > 0:
@@ -225,13 +1259,25 @@ def email_listmode(
             else:
                 print("None found")
 
-        if len(sessions_to_report) > 0:
+        print(f"Listmode checks {coverage.summary()}")
+        if metrics:
+            metrics.sessions_scanned = coverage.checked
+            metrics.issues_found = len(sessions_to_report)
+            metrics.complete = coverage.complete
+
+        # A partial report is always sent, so that a slow server never means
+        # no report at all
+        if len(sessions_to_report) > 0 or not coverage.complete:
             # Construct email html body
-            body_html = construct_email(
+            body_html = coverage.summary_html() + construct_email(
                 server_url=credentials.host,
                 project_name=project_name,
                 list_mode_records=sessions_to_report,
             )
+            if not coverage.complete:
+                email_subject += " (partial report)"
+            if metrics:
+                metrics.email_bytes = len(body_html.encode())
 
             # Print email content so it is visible in the container log
             print("Sending email with the following content:")
@@ -242,15 +1288,25 @@ def email_listmode(
             print(body_html)
 
             # Send the email via XNAT
-            send_email(
+            send_or_queue_email(
                 session=xnat_session,
+                host=credentials.host,
                 subject=email_subject,
                 to=to_emails,
                 cc=cc_emails,
                 bcc=bcc_emails,
                 content_html=body_html,
+                outbox_dir=outbox_dir,
             )
 
+    if merge_shards:
+        # The report has been sent, so the results must not be merged again
+        remove_partial_results(
+            shard_dir=shard_dir, key=shard_key, num_shards=merge_shards
+        )
+    if checkpoint and coverage.complete:
+        checkpoint.clear()
+
 
 def main(args=None):
     """Entrypoint for email_listmode, as listed in pyproject.toml.
@@ -276,6 +1332,39 @@ def main(args=None):
         For example:
             email_listmode "PROJID" "90" "user1@foo.org,user2@foo.org"
 
+    Optional arguments:
+        --checkpoint PATH: save progress periodically to this local file
+        --resume: continue an interrupted run from the --checkpoint file
+        --checkpoint-interval N: save progress after every N sessions
+        --deadline SECONDS: time budget for the run. When the budget runs
+            out, a partial email is sent
+        --shard I/N --shard-dir DIR: check only shard I (counting from 0) of
+            N and write the results to DIR without sending an email
+        --merge-shards N --shard-dir DIR: send an email combining the results
+            written to DIR by N shards
+        --profile PATH: write per-phase timings to PATH.folded (see
+            profile_run for further options)
+        --metrics-history PATH: append run metrics to this JSON lines file
+        --metrics-textfile PATH: write run metrics in OpenMetrics format
+        --outbox DIR: store the email in this local outbox before sending,
+            so that it can be retried if sending fails (see flush_outbox)
+        --max-in-flight N: check sessions with the asyncio client, keeping
+            up to N requests in flight. Requires the async extra
+        --sql DSN: run the searches on a read-only replica of the XNAT
+            database, for example "postgresql://user@replica/xnat". If not
+            given, the DRC_SQL_DSN environment variable is used
+        --servers PATH: check the project on every server listed in this
+            JSON file (see read_server_list) and send one combined email.
+            If not given, the DRC_SERVERS environment variable is used.
+            Cannot be combined with checkpoints, shards or --sql
+        --explain: print the plan for checking the sessions, with the
+            estimated number of requests and bytes, without checking them
+        --change-cache PATH: keep the result for each session in this local
+            SQLite file, and only check sessions which have changed since
+            the previous run. If not given, the DRC_CHANGE_CACHE
+            environment variable is used. Cannot be combined with shards,
+            --servers or --max-in-flight
+
     For testing, main() can be called with an argument list to simulate
     command-line arguments, eg:
         main(['PROJID', '90', 'user1@foo.org,user2@foo.org'])
@@ -285,7 +1374,32 @@ def main(args=None):
     parser.add_argument("project")
     parser.add_argument("threshold_days")
     parser.add_argument("email_list")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--checkpoint-interval", type=int, default=50)
+    parser.add_argument("--deadline", type=float, default=None)
+    parser.add_argument("--shard", type=Shard.parse, default=None)
+    parser.add_argument("--shard-dir", default=None)
+    parser.add_argument("--merge-shards", type=int, default=None)
+    add_profiling_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument("--outbox", default=None, metavar="DIR")
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--servers", default=os.getenv("DRC_SERVERS"), metavar="PATH")
+    parser.add_argument("--sql", default=os.getenv("DRC_SQL_DSN"), metavar="DSN")
+    parser.add_argument("--explain", action="store_true")
+    parser.add_argument("--change-cache", default=None, metavar="PATH")
     parsed = parser.parse_args(args)
+    if parsed.servers and (parsed.checkpoint or parsed.shard or parsed.merge_shards):
+        parser.error("--servers cannot be combined with checkpoints or shards")
+    if parsed.servers and parsed.sql:
+        parser.error("--servers cannot be combined with --sql or DRC_SQL_DSN")
+    if parsed.servers and (parsed.change_cache or os.getenv("DRC_CHANGE_CACHE")):
+        parser.error(
+            "--servers cannot be combined with --change-cache or DRC_CHANGE_CACHE"
+        )
+    if parsed.explain and (parsed.servers or parsed.merge_shards):
+        parser.error("--explain cannot be combined with --servers or --merge-shards")
 
     project_name = parsed.project
     threshold_days_str = parsed.threshold_days
@@ -298,13 +1412,54 @@ def main(args=None):
 
     credentials = XnatContainerCredentials()
 
-    email_listmode(
-        credentials=credentials,
-        project_name=project_name,
-        threshold_days=threshold_days,
-        email_subject="1946 Weekly Listmode Status Check",
-        to_emails=to_emails,
-    )
+    metrics = RunMetrics(command="email_listmode", project=project_name)
+    with (
+        profile_run(
+            command="email_listmode",
+            output_path=parsed.profile,
+            cprofile=parsed.profile_cprofile,
+            trace_memory=parsed.profile_memory,
+        ),
+        record_run(
+            metrics=metrics,
+            history_path=parsed.metrics_history,
+            textfile_path=parsed.metrics_textfile,
+        ),
+    ):
+        if parsed.servers:
+            email_listmode_federated(
+                credentials=credentials,
+                servers=read_server_list(parsed.servers),
+                project_name=project_name,
+                threshold_days=threshold_days,
+                email_subject="1946 Weekly Listmode Status Check",
+                to_emails=to_emails,
+                deadline_seconds=parsed.deadline,
+                metrics=metrics,
+                outbox_dir=parsed.outbox,
+                max_in_flight=parsed.max_in_flight,
+            )
+        else:
+            email_listmode(
+                credentials=credentials,
+                project_name=project_name,
+                threshold_days=threshold_days,
+                email_subject="1946 Weekly Listmode Status Check",
+                to_emails=to_emails,
+                checkpoint_path=parsed.checkpoint,
+                resume=parsed.resume,
+                checkpoint_interval=parsed.checkpoint_interval,
+                deadline_seconds=parsed.deadline,
+                metrics=metrics,
+                shard=parsed.shard,
+                shard_dir=parsed.shard_dir,
+                merge_shards=parsed.merge_shards,
+                outbox_dir=parsed.outbox,
+                max_in_flight=parsed.max_in_flight,
+                sql_dsn=parsed.sql,
+                explain=parsed.explain,
+                change_cache_path=parsed.change_cache,
+            )
 
 
 if __name__ == "__main__":
@@ -1,18 +1,67 @@
+import asyncio
+import os
 from argparse import ArgumentParser
+from collections.abc import Iterable
+from contextlib import nullcontext
 from dataclasses import dataclass
+from datetime import datetime, timezone
 
 from pyxnat import Interface
 
+from drc_containers.xnat_utils.async_client import AsyncXnatClient, map_concurrently
+from drc_containers.xnat_utils.change_feed import (
+    SessionResultCache,
+    get_changed_items,
+)
+from drc_containers.xnat_utils.checkpoint import Checkpoint
 from drc_containers.xnat_utils.command_line import string_to_list
-from drc_containers.xnat_utils.email import send_email
+from drc_containers.xnat_utils.compact import SessionRow, session_rows
+from drc_containers.xnat_utils.deadline import (
+    Coverage,
+    Deadline,
+    apply_deadline,
+    is_deadline_error,
+)
+from drc_containers.xnat_utils.federation import (
+    ServerResult,
+    federated_summary_html,
+    merge_coverage,
+    run_on_servers,
+)
+from drc_containers.xnat_utils.outbox import send_or_queue_email
+from drc_containers.xnat_utils.planner import BULK, PER_ITEM, QueryPlan, StrategyCost
+from drc_containers.xnat_utils.profiling import (
+    add_profiling_arguments,
+    profile_run,
+    span,
+)
+from drc_containers.xnat_utils.query_backend import (
+    QueryBackend,
+    RestQueryBackend,
+    open_query_backend,
+)
+from drc_containers.xnat_utils.run_metrics import (
+    RunMetrics,
+    add_metrics_arguments,
+    record_run,
+    track_requests,
+)
+from drc_containers.xnat_utils.sharding import (
+    Shard,
+    merge_partial_results,
+    remove_partial_results,
+    write_partial_results,
+)
 from drc_containers.xnat_utils.xnat_credentials import (
     XnatContainerCredentials,
     XnatCredentials,
+    get_http_session,
     open_pyxnat_session,
+    read_server_list,
 )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SessionRecord:
     """Store data from sessions requiring a Radiological Read.
     The frozen dataclass allows this to be used in a set to ensure no sessions
@@ -23,17 +72,179 @@ class SessionRecord:
     subject_id: str
 
 
+# Datatypes of the sessions which may need a radiological read
+SESSION_DATATYPES = [
+    "xnat:mrSessionData",
+    "xnat:petSessionData",
+    "xnat:petmrSessionData",
+]
+
+# Typical sizes used to estimate the cost of listing the scans of sessions
+# one by one or with a listing for the whole project
+SCANS_PER_SESSION = 10
+SCAN_LISTING_ROW_BYTES = 400
+SCAN_TYPE_ROW_BYTES = 80
+
+
 def session_prefix(session_1_label: str) -> str:
     """Return session label excluding _EARLY or _LATE suffixe"""
     return session_1_label.removesuffix("_EARLY").removesuffix("_LATE")
 
 
+def project_sessions_query(datatype: str, project_name: str) -> tuple[list[str], list]:
+    """Return the columns and constraints of the search for the sessions of a
+    datatype in a project"""
+    condition = [(datatype + "/PROJECT", "=", project_name), "AND"]
+    columns = [
+        datatype + "/SESSION_ID",
+        datatype + "/SUBJECT_ID",
+        datatype + "/DATE",
+        datatype + "/LABEL",
+        datatype + "/PROJECT",
+    ]
+    return columns, condition
+
+
+def radread_query(project_name: str) -> tuple[list[str], list]:
+    """Return the columns and constraints of the search for the radiological
+    reads in a project"""
+    constraints = [("nshdni:radRead/project", "=", project_name)]
+    return ["nshdni:radRead/imagesession_id"], constraints
+
+
+def select_candidates(
+    image_sessions: list[dict],
+    exclude_ids: set[str],
+    exclude_session_substrings: list[str],
+    shard: Shard = None,
+) -> list[SessionRow]:
+    """Return the sessions whose scans need to be checked, newest first
+
+    Args:
+        image_sessions: rows of the search for the sessions of one datatype
+        exclude_ids: set of session IDs to exclude. Sessions with the same
+            label apart from an _EARLY or _LATE suffix are also excluded
+        exclude_session_substrings: ignore sessions with labels containing any
+            of these substrings
+        shard: if set, only sessions belonging to this shard are returned
+
+    Returns:
+        list of SessionRows
+    """
+    exclude_labels = set()
+    for session in image_sessions:
+        session_id = session["session_id"]
+        session_label = session["label"]
+        if session_id in exclude_ids:
+            exclude_labels.add(session_prefix(session_label))
+
+    candidates = []
+    for session in image_sessions:
+        session_label = session["label"]
+
+        # Exclude any sessions exactly matching IDs in the exclude_ids list
+        if session_prefix(session_label) not in exclude_labels:
+            # Exclude any sessions whose label contains any of the label
+            # patterns in the exclude_label_patterns list
+            exclude = False
+            for label_pattern in exclude_session_substrings:
+                if label_pattern in session_label:
+                    exclude = True
+            if not exclude and (not shard or shard.contains(session["session_id"])):
+                candidates.append(session)
+
+    candidates = session_rows(candidates)
+    candidates.sort(key=lambda s: s.date, reverse=True)
+    return candidates
+
+
+def has_structural_scan(scan_types: Iterable[str]) -> bool:
+    """Return True if any of the scan types is a T1, T2 or FLAIR scan"""
+    for scan_type in scan_types:
+        scan_type = scan_type or ""
+        if "FLAIR" in scan_type or "T1" in scan_type or "T2" in scan_type:
+            return True
+    return False
+
+
+def scan_check_costs(
+    num_sessions: int, num_project_sessions: int
+) -> list[StrategyCost]:
+    """Return the estimated cost of finding the scan types of sessions
+
+    Checking each session on its own lists its scans. Checking in bulk lists
+    the scan types of every session of the datatype in the project with a
+    single request.
+
+    Args:
+        num_sessions: number of sessions to be checked
+        num_project_sessions: number of sessions of the datatype in the
+            project, all of which are included in the bulk listing
+    """
+    return [
+        StrategyCost(
+            strategy=PER_ITEM,
+            requests=num_sessions,
+            bytes=num_sessions * SCANS_PER_SESSION * SCAN_LISTING_ROW_BYTES,
+        ),
+        StrategyCost(
+            strategy=BULK,
+            requests=1,
+            bytes=num_project_sessions * SCANS_PER_SESSION * SCAN_TYPE_ROW_BYTES,
+        ),
+    ]
+
+
+@span("list_project_scan_types")
+def list_project_scan_types(
+    pyxnat_interface: Interface, datatype: str, project_name: str
+) -> dict[str, list[str]]:
+    """Return the scan types of every session of a datatype in a project,
+    using a single listing
+
+    Args:
+        pyxnat_interface: PyXnat interface
+        datatype: datatype of the sessions
+        project_name: project containing the sessions
+
+    Returns:
+        dict of session ID to the types of its scans. The dict is empty if
+        the server did not return the scan type column
+    """
+    type_column = f"{datatype}/scans/scan/type"
+    rows = pyxnat_interface.array.experiments(
+        project_id=project_name, experiment_type=datatype, columns=[type_column]
+    )
+    scan_types = {}
+    for row in rows:
+        values = {key.lower(): value for key, value in row.items()}
+        if type_column.lower() not in values:
+            # Without the scan type column no session would appear to have
+            # a structural scan, so the sessions are checked one by one
+            return {}
+        session_scan_types = scan_types.setdefault(values["id"], [])
+        if values[type_column.lower()]:
+            session_scan_types.append(values[type_column.lower()])
+    return scan_types
+
+
+@span("filter_sessions")
 def filter_sessions(
     pyxnat_interface: Interface,
     project_name: str,
     datatype: str,
     exclude_ids: set[str],
     exclude_session_substrings: list[str],
+    checkpoint: Checkpoint = None,
+    deadline: Deadline = None,
+    coverage: Coverage = None,
+    shard: Shard = None,
+    query_backend: QueryBackend = None,
+    plan: QueryPlan = None,
+    plan_only: bool = False,
+    result_cache: SessionResultCache = None,
+    changed: dict[str, str] | None = None,
+    candidate_ids: set[str] | None = None,
 ) -> set[SessionRecord]:
     """Return a set of SessionRecords, one for each session of the
     specified datatype which exists in the specified project and contains at
@@ -41,6 +252,13 @@ def filter_sessions(
     scan Type fields. Sessions are excluded from the output list if their ID
     appears in the specified exclude_ids set
 
+    The scans of the newest sessions are checked first, so that if the
+    deadline is reached the most recent sessions have been covered.
+
+    The plan chooses whether the scans are listed one session at a time or
+    in a single listing for the whole project, from the number of sessions
+    to be checked and the number in the project (see scan_check_costs).
+
     Args:
         pyxnat_interface: PyXnat interface
         project_name: Name of project to search
@@ -48,111 +266,387 @@ def filter_sessions(
         exclude_ids: set of session IDs to exclude from output
         exclude_session_substrings: ignore sessions with labels containing any
             of these substrings
+        checkpoint: optional Checkpoint used to save progress. Sessions which
+            the checkpoint marks as done are not checked again
+        deadline: optional time budget. No further sessions are checked once
+            the deadline has expired
+        coverage: optional Coverage which is updated with the number of
+            sessions found and checked
+        shard: if set, only the scans of sessions belonging to this shard are
+            checked
+        query_backend: optional QueryBackend used to search for sessions
+            instead of the XNAT REST API
+        plan: optional QueryPlan in which the chosen strategy is recorded
+        plan_only: if True, return once the plan has been made, without
+            checking any sessions
+        result_cache: optional SessionResultCache holding the results of
+            previous runs, which are reused for sessions that have not
+            changed
+        changed: items changed since the previous run, as returned by
+            get_changed_items, or None if every session is to be checked
+        candidate_ids: optional set which is updated with the IDs of the
+            sessions to be checked, after the exclusions are applied
 
     Returns:
         set of SessionRecords, one for each session
     """
     sessions = set()
-    condition = [(datatype + "/PROJECT", "=", project_name), "AND"]
-    columns = [
-        datatype + "/SESSION_ID",
-        datatype + "/SUBJECT_ID",
-        datatype + "/LABEL",
-        datatype + "/PROJECT",
+    if coverage is None:
+        coverage = Coverage()
+    if plan is None:
+        plan = QueryPlan()
+    columns, condition = project_sessions_query(
+        datatype=datatype, project_name=project_name
+    )
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    with span("get_project_sessions"):
+        image_sessions = backend.search(datatype, columns, condition)
+
+    candidates = select_candidates(
+        image_sessions=image_sessions,
+        exclude_ids=exclude_ids,
+        exclude_session_substrings=exclude_session_substrings,
+        shard=shard,
+    )
+    coverage.total += len(candidates)
+    if candidate_ids is not None:
+        candidate_ids.update(s.session_id for s in candidates)
+
+    to_check = [
+        s
+        for s in candidates
+        if not (checkpoint and checkpoint.is_done(s.session_id))
+        and not (result_cache and result_cache.is_unchanged(s.session_id, changed))
     ]
-    image_sessions = pyxnat_interface.select(datatype, columns).where(condition)
+    strategy = PER_ITEM
+    if to_check:
+        strategy = plan.choose(
+            phase=f"{datatype} scans",
+            items=len(to_check),
+            options=scan_check_costs(
+                num_sessions=len(to_check), num_project_sessions=len(image_sessions)
+            ),
+        )
+    if plan_only:
+        return sessions
 
-    exclude_labels = []
-    for session in image_sessions.data:
-        session_id = session["session_id"]
-        session_label = session["label"]
-        if session_id in exclude_ids:
-            exclude_labels.append(session_prefix(session_label))
+    scan_types = {}
+    if strategy == BULK:
+        try:
+            scan_types = list_project_scan_types(
+                pyxnat_interface=pyxnat_interface,
+                datatype=datatype,
+                project_name=project_name,
+            )
+        except Exception as ex:
+            if is_deadline_error(ex):
+                return sessions
+            raise
 
-    for session in image_sessions.data:
-        session_id = session["session_id"]
-        session_label = session["label"]
-        subject_id = session["subject_id"]
+    for session in candidates:
+        session_id = session.session_id
+        session_label = session.label
+        subject_id = session.subject_id
 
-        # Exclude any sessions exactly matching IDs in the exclude_ids list
-        if session_prefix(session_label) not in exclude_labels:
-            # Exclude any sessions whose label contains any of the label
-            # patterns in the exclude_label_patterns list
-            exclude = False
-            for label_pattern in exclude_session_substrings:
-                if label_pattern in session_label:
-                    exclude = True
-            if not exclude:
-                scans = (
-                    pyxnat_interface.select.project(project_name)
-                    .subject(subject_id)
-                    .experiment(session_id)
-                    .scans()
-                )
-                scan_found = False
-                for scan in scans:
-                    scan_type = scan.attrs.get("type")
-                    if "FLAIR" in scan_type or "T1" in scan_type or "T2" in scan_type:
-                        scan_found = True
-                        break
-
-                if scan_found:
-                    print(f"FLAIR, T1, or T2 found in session {session_id}")
-                    sessions.add(
-                        SessionRecord(
-                            id=session_id, label=session_label, subject_id=subject_id
-                        )
+        if checkpoint and checkpoint.is_done(session_id):
+            coverage.checked += 1
+            continue
+
+        if result_cache and result_cache.is_unchanged(session_id, changed):
+            record = result_cache.record(session_id)
+            if record:
+                sessions.add(record)
+            coverage.checked += 1
+            continue
+
+        if deadline and deadline.expired():
+            break
+
+        try:
+            if session_id in scan_types:
+                scan_found = has_structural_scan(scan_types[session_id])
+            else:
+                with span("check_session"):
+                    scans = (
+                        pyxnat_interface.select.project(project_name)
+                        .subject(subject_id)
+                        .experiment(session_id)
+                        .scans()
+                    )
+                    scan_found = has_structural_scan(
+                        scan.attrs.get("type") for scan in scans
                     )
+        except Exception as ex:
+            if is_deadline_error(ex):
+                break
+            raise
+
+        record = None
+        if scan_found:
+            print(f"FLAIR, T1, or T2 found in session {session_id}")
+            record = SessionRecord(
+                id=session_id, label=session_label, subject_id=subject_id
+            )
+            sessions.add(record)
+        if result_cache:
+            result_cache.store(session_id, record)
+
+        coverage.checked += 1
+        if checkpoint:
+            checkpoint.mark_done(session_id, record)
 
     return sessions
 
 
+@span("get_sessions_needing_radread")
 def get_sessions_needing_radread(
     pyxnat_interface: Interface,
     project_name: str,
     exclude_session_substrings: list[str],
+    checkpoint: Checkpoint = None,
+    deadline: Deadline = None,
+    coverage: Coverage = None,
+    shard: Shard = None,
+    query_backend: QueryBackend = None,
+    plan: QueryPlan = None,
+    plan_only: bool = False,
+    result_cache: SessionResultCache = None,
 ) -> set[SessionRecord]:
     """Return list of sessions which require a Radiological Read
 
+    If result_cache is set, only the sessions which XNAT's change history
+    shows have changed since the previous run have their scans checked, and
+    the stored results are reused for the others. The reads are always
+    searched for in full, so a session drops out of the report as soon as
+    its read is added, and its stored result is removed from the cache.
+
     Args:
         pyxnat_interface: pyxnat interface
         project_name: name of XNAT project to search
         exclude_session_substrings: ignore sessions with labels containing any
             of these substrings
+        checkpoint: optional Checkpoint used to save progress. Records found
+            by a previous interrupted run are included in the output
+        deadline: optional time budget. No further sessions are checked once
+            the deadline has expired
+        coverage: optional Coverage which is updated with the number of
+            sessions found and checked
+        shard: if set, only sessions belonging to this shard are checked
+        query_backend: optional QueryBackend used to search for sessions
+            and reads instead of the XNAT REST API
+        plan: optional QueryPlan in which the strategy for each datatype is
+            recorded
+        plan_only: if True, return once the plan has been made, without
+            checking any sessions
+        result_cache: optional SessionResultCache holding the results of
+            previous runs
 
     Returns:
         set of SessionRecords, one for each session which requires a read
     """
+    backend = query_backend or RestQueryBackend(pyxnat_interface)
+    session_list = set(checkpoint.records) if checkpoint else set()
+    if coverage is None:
+        coverage = Coverage()
 
-    session_datatypes = [
-        "xnat:mrSessionData",
-        "xnat:petSessionData",
-        "xnat:petmrSessionData",
-    ]
-    constraints = [("nshdni:radRead/project", "=", project_name)]
-    rr_sessions = pyxnat_interface.select(
-        "nshdni:radRead", ["nshdni:radRead/imagesession_id"]
-    ).where(constraints)
-    sessions_with_radread = set(
-        r["nshdni_col_radreadimagesession_id"] for r in rr_sessions.data
-    )
+    started = datetime.now(timezone.utc)
+    changed = None
+    if result_cache:
+        since = result_cache.changed_since()
+        if since:
+            try:
+                changed = get_changed_items(backend, project_name, since)
+            except Exception as ex:
+                if is_deadline_error(ex):
+                    coverage.truncated = True
+                    return session_list
+                raise
+            print(f"Change feed: {len(changed)} items changed since {since}")
+        else:
+            print("Change feed: checking every session")
+            if not plan_only:
+                result_cache.clear()
+
+    columns, constraints = radread_query(project_name)
+    with span("get_radread_sessions"):
+        rr_sessions = backend.search("nshdni:radRead", columns, constraints)
+        sessions_with_radread = {
+            r["nshdni_col_radreadimagesession_id"] for r in rr_sessions
+        }
 
     # Iterate through all session datatypes
-    session_list = set()
-    for datatype in session_datatypes:
+    candidate_ids = set()
+    for datatype in SESSION_DATATYPES:
         # Get IDs of sessions which are not in the sessions_with_radread set
-        sessions = filter_sessions(
-            pyxnat_interface=pyxnat_interface,
-            project_name=project_name,
-            datatype=datatype,
-            exclude_ids=sessions_with_radread,
-            exclude_session_substrings=exclude_session_substrings,
-        )
+        try:
+            sessions = filter_sessions(
+                pyxnat_interface=pyxnat_interface,
+                project_name=project_name,
+                datatype=datatype,
+                exclude_ids=sessions_with_radread,
+                exclude_session_substrings=exclude_session_substrings,
+                checkpoint=checkpoint,
+                deadline=deadline,
+                coverage=coverage,
+                shard=shard,
+                query_backend=query_backend,
+                plan=plan,
+                plan_only=plan_only,
+                result_cache=result_cache,
+                changed=changed,
+                candidate_ids=candidate_ids,
+            )
+        except Exception as ex:
+            if is_deadline_error(ex):
+                # The search for this datatype could not be completed, so the
+                # total number of sessions is not known
+                coverage.truncated = True
+                break
+            raise
         session_list |= sessions
 
+    if not coverage.complete and not plan_only:
+        print(f"Deadline reached: {coverage.summary()}")
+    if result_cache and not coverage.truncated and not plan_only:
+        # Sessions which have been given a read, deleted or excluded are no
+        # longer checked
+        result_cache.retain(candidate_ids)
+    if result_cache and coverage.complete and not plan_only:
+        result_cache.update(started=started, full=changed is None)
+
+    return session_list
+
+
+async def async_get_sessions_needing_radread(
+    client: AsyncXnatClient,
+    project_name: str,
+    exclude_session_substrings: list[str],
+    checkpoint: Checkpoint = None,
+    deadline: Deadline = None,
+    coverage: Coverage = None,
+    shard: Shard = None,
+    concurrency: int = 100,
+    query_backend: QueryBackend = None,
+) -> set[SessionRecord]:
+    """Asynchronous version of get_sessions_needing_radread, which checks the
+    scans of many sessions at once
+
+    The searches for each datatype run concurrently, and then the scans of up
+    to concurrency sessions are checked at once, newest first.
+
+    Args:
+        client: open AsyncXnatClient
+        project_name: name of XNAT project to search
+        exclude_session_substrings: ignore sessions with labels containing any
+            of these substrings
+        checkpoint: optional Checkpoint used to save progress. Records found
+            by a previous interrupted run are included in the output
+        deadline: optional time budget. No further sessions are checked once
+            the deadline has expired
+        coverage: optional Coverage which is updated with the number of
+            sessions found and checked
+        shard: if set, only sessions belonging to this shard are checked
+        concurrency: maximum number of sessions checked at once
+        query_backend: optional QueryBackend used to search for sessions
+            and reads instead of the XNAT REST API
+
+    Returns:
+        set of SessionRecords, one for each session which requires a read
+    """
+    session_list = set(checkpoint.records) if checkpoint else set()
+    if coverage is None:
+        coverage = Coverage()
+
+    queries = [("nshdni:radRead", *radread_query(project_name))]
+    queries.extend(
+        (datatype, *project_sessions_query(datatype, project_name))
+        for datatype in SESSION_DATATYPES
+    )
+    if query_backend:
+        # Database searches are quick, so they are run one after the other
+        results = [query_backend.search(*query) for query in queries]
+    else:
+        results = await asyncio.gather(
+            *(client.search(*query) for query in queries), return_exceptions=True
+        )
+    for result in results:
+        if isinstance(result, BaseException) and not is_deadline_error(result):
+            raise result
+    if isinstance(results[0], BaseException):
+        # Without the existing reads no sessions can be checked
+        coverage.truncated = True
+        return session_list
+    sessions_with_radread = {r["nshdni_col_radreadimagesession_id"] for r in results[0]}
+
+    candidates = []
+    for image_sessions in results[1:]:
+        if isinstance(image_sessions, BaseException):
+            # The total number of sessions is not known
+            coverage.truncated = True
+            continue
+        candidates.extend(
+            select_candidates(
+                image_sessions=image_sessions,
+                exclude_ids=sessions_with_radread,
+                exclude_session_substrings=exclude_session_substrings,
+                shard=shard,
+            )
+        )
+    candidates.sort(key=lambda s: s.date, reverse=True)
+    coverage.total += len(candidates)
+
+    async def check(session: SessionRow):
+        session_id = session.session_id
+        if checkpoint and checkpoint.is_done(session_id):
+            coverage.checked += 1
+            return
+        if deadline and deadline.expired():
+            return
+        try:
+            scans = await client.experiment_scans(
+                project_name, session.subject_id, session_id
+            )
+        except Exception as ex:
+            if is_deadline_error(ex):
+                return
+            raise
+
+        record = None
+        if has_structural_scan(scan.get("type") for scan in scans):
+            print(f"FLAIR, T1, or T2 found in session {session_id}")
+            record = SessionRecord(
+                id=session_id, label=session.label, subject_id=session.subject_id
+            )
+            session_list.add(record)
+        coverage.checked += 1
+        if checkpoint:
+            checkpoint.mark_done(session_id, record)
+
+    await map_concurrently(check, candidates, concurrency)
+    if not coverage.complete:
+        print(f"Deadline reached: {coverage.summary()}")
     return session_list
 
 
+async def _get_sessions_needing_radread_with_async_client(
+    credentials: XnatCredentials,
+    max_in_flight: int,
+    metrics: RunMetrics = None,
+    deadline: Deadline = None,
+    **kwargs,
+) -> set[SessionRecord]:
+    async with AsyncXnatClient(
+        credentials=credentials,
+        max_in_flight=max_in_flight,
+        deadline=deadline,
+        metrics=metrics,
+    ) as client:
+        return await async_get_sessions_needing_radread(
+            client=client, deadline=deadline, concurrency=max_in_flight, **kwargs
+        )
+
+
+@span("construct_email_body")
 def construct_email_body(
     server_url: str, project_name: str, session_records: set[SessionRecord]
 ) -> str:
@@ -184,6 +678,160 @@ def construct_email_body(
     return body_html
 
 
+@span("construct_federated_email_body")
+def construct_federated_email_body(
+    project_name: str, results: list[ServerResult]
+) -> str:
+    """Assemble the email html content for a run across several servers, as
+    a table with a column giving the server of each session
+
+    Args:
+        project_name: ID of the XNAT project on each server
+        results: ServerResult from each server, whose records are
+            SessionRecords
+
+    Returns:
+        String containing the email body as HTML
+    """
+    body_html = (
+        "<p>The following sessions in the 1946 XNAT databases require radiology "
+        "reads:</p><table><tr><th>Server</th><th>Session</th><th>Form</th></tr>"
+    )
+    for result in results:
+        server_url = result.credentials.host
+        for session in sorted(result.records, key=lambda r: r.label):
+            link_form = f"{server_url}/app/action/DisplayItemAction/search_value&#47;{session.id}&#47;search_element&#47;xnat:petmrSessionData&#47;search_field&#47;xnat:petmrSessionData.ID&#47;project&#47;{project_name}"
+            body_html += (
+                f"<tr><td>{result.name}</td><td>{session.label}</td>"
+                f'<td><a href="{link_form}">Electronic form for reporting '
+                f"radiology read</a></td></tr>"
+            )
+    return body_html + "</table>"
+
+
+def run_email_radreads_federated(
+    credentials: XnatCredentials,
+    servers: dict[str, XnatCredentials],
+    project_name: str,
+    email_subject: str,
+    to_emails: list[str],
+    cc_emails: list[str] | None = None,
+    bcc_emails: list[str] | None = None,
+    exclude_session_substrings: list[str] | None = None,
+    debug_output: bool = True,
+    deadline_seconds: float | None = None,
+    metrics: RunMetrics = None,
+    outbox_dir: str | None = None,
+    max_in_flight: int | None = None,
+):
+    """Email a single radiology read report covering the same project on
+    several XNAT servers
+
+    The servers are checked at the same time, each with its own session and
+    connection pool. A server which fails is listed as failed in the email
+    and does not stop the others being reported. Set deadline_seconds so
+    that a slow server cannot delay the report: each server stops at the
+    deadline and the email states how many sessions it covered.
+
+    Args:
+        credentials: XNAT server through which the email is sent
+        servers: credentials of each server to be checked, keyed by the
+            server name shown in the email (see read_server_list)
+        project_name: The project to search for sessions on each server
+        email_subject: subject line of email
+        to_emails: list of email addresses. XNAT will only send emails
+            to addresses which already correspond to XNAT users on the server
+        cc_emails: list of email addresses for cc
+        bcc_emails: list of email addresses for bcc
+        exclude_session_substrings: ignore sessions with labels containing any
+            of these substrings
+        debug_output: set to True to output debugging data to the console
+        deadline_seconds: time budget for the run in seconds. If None there
+            is no time limit
+        metrics: optional RunMetrics which is filled in with the totals for
+            all servers
+        outbox_dir: local outbox directory in which the email is stored
+            before it is sent. If None, the DRC_OUTBOX environment variable
+            is used
+        max_in_flight: if set, check sessions with the asyncio client,
+            keeping up to this number of requests in flight on each server
+    """
+    exclude_session_substrings = exclude_session_substrings or []
+    deadline = Deadline(seconds=deadline_seconds)
+
+    def check_server(
+        server: XnatCredentials, coverage: Coverage, server_metrics: RunMetrics
+    ) -> set[SessionRecord]:
+        if max_in_flight:
+            return asyncio.run(
+                _get_sessions_needing_radread_with_async_client(
+                    credentials=server,
+                    project_name=project_name,
+                    exclude_session_substrings=exclude_session_substrings,
+                    deadline=deadline,
+                    coverage=coverage,
+                    max_in_flight=max_in_flight,
+                    metrics=server_metrics,
+                )
+            )
+        with open_pyxnat_session(credentials=server) as server_session:
+            apply_deadline(get_http_session(server_session), deadline)
+            if server_metrics:
+                track_requests(get_http_session(server_session), server_metrics)
+            return get_sessions_needing_radread(
+                pyxnat_interface=server_session,
+                project_name=project_name,
+                exclude_session_substrings=exclude_session_substrings,
+                deadline=deadline,
+                coverage=coverage,
+            )
+
+    results = run_on_servers(servers=servers, check=check_server, metrics=metrics)
+    coverage = merge_coverage(results)
+    num_sessions = sum(len(result.records) for result in results)
+    complete = all(result.complete for result in results)
+
+    # Allow the time held in reserve to be used for sending the email
+    deadline.use_reserve()
+    if debug_output:
+        print("Sessions requiring radread:")
+        for result in results:
+            for s in result.records:
+                print(f"{result.name}: {s}")
+        if num_sessions == 0:
+            print("None found")
+
+    print(f"Radread checks {coverage.summary()} on {len(results)} servers")
+    if metrics:
+        metrics.sessions_scanned = coverage.checked
+        metrics.issues_found = num_sessions
+        metrics.complete = complete
+
+    if num_sessions == 0 and complete:
+        return
+
+    body_html = federated_summary_html(results) + construct_federated_email_body(
+        project_name=project_name, results=results
+    )
+    if not complete:
+        email_subject += " (partial report)"
+    if metrics:
+        metrics.email_bytes = len(body_html.encode())
+
+    with open_pyxnat_session(credentials=credentials) as xnat_session:
+        send_or_queue_email(
+            session=xnat_session,
+            host=credentials.host,
+            subject=email_subject,
+            to=to_emails,
+            cc=cc_emails,
+            bcc=bcc_emails,
+            content_html=body_html,
+            debug_output=debug_output,
+            outbox_dir=outbox_dir,
+        )
+
+
 def run_email_radreads(
     credentials: XnatCredentials,
     project_name: str,
@@ -193,6 +841,19 @@ def run_email_radreads(
     bcc_emails: list[str] = None,
     exclude_session_substrings: list[str] = [],
     debug_output: bool = True,
+    checkpoint_path: str | None = None,
+    resume: bool = False,
+    checkpoint_interval: int = 50,
+    deadline_seconds: float | None = None,
+    metrics: RunMetrics = None,
+    shard: Shard = None,
+    shard_dir: str | None = None,
+    merge_shards: int | None = None,
+    outbox_dir: str | None = None,
+    max_in_flight: int | None = None,
+    sql_dsn: str | None = None,
+    explain: bool = False,
+    change_cache_path: str | None = None,
 ):
     """Email notification about image sessions without radreads
 
@@ -201,6 +862,34 @@ def run_email_radreads(
     in an email sent to the email addresses. Email addresses must
     correspond to registered XNAT users.
 
+    If checkpoint_path is set, progress is saved periodically to this file so
+    that an interrupted run can be continued by calling again with resume set
+    to True. The file is removed once the run has completed.
+
+    If deadline_seconds is set, checks stop when the time budget runs out and
+    a partial email is sent stating how many sessions were checked. The
+    checkpoint file is kept after a partial run, so that the next run with
+    resume set to True continues from where this run stopped.
+
+    For large projects the checks can be split across several container
+    instances. Each instance is run with a different shard and writes its
+    results to the shared directory shard_dir instead of sending an email.
+    A final run with merge_shards set to the number of shards combines the
+    results and sends a single email.
+
+    If sql_dsn is set, the searches for sessions and reads are run on a
+    read-only replica of the XNAT database instead of through the REST API
+    (see SqlQueryBackend). The scans of each session are still checked
+    through the REST API.
+
+    If explain is True, the sessions are searched for and the plan for
+    checking them is printed (see QueryPlan), but no sessions are checked and
+    no email is sent.
+
+    If change_cache_path is set, the results of each run are kept in a local
+    cache, and later runs only check the scans of sessions which XNAT's
+    change history shows have changed (see SessionResultCache).
+
     Args:
         credentials: XNAT host name and user login details
         project_name: The project to search for sessions
@@ -214,15 +903,163 @@ def run_email_radreads(
         exclude_session_substrings: ignore sessions with labels containing any
             of these substrings
         debug_output: set to True to output debugging data to the console
+        checkpoint_path: local file used to save progress. If None, progress
+            is not saved
+        resume: set to True to skip sessions already processed by a previous
+            interrupted run with the same checkpoint_path
+        checkpoint_interval: save progress after this number of sessions
+        deadline_seconds: time budget for the run in seconds. If None there
+            is no time limit
+        metrics: optional RunMetrics which is filled in with the number of
+            sessions, requests, issues and the email size
+        shard: if set, only check the sessions in this shard and write the
+            results to shard_dir without sending an email
+        shard_dir: directory for sharing results between shards and the
+            merge step
+        merge_shards: if set, do not check any sessions but send an email
+            combining the results written to shard_dir by this number of
+            shards
+        outbox_dir: local outbox directory in which the email is stored
+            before it is sent, so that it can be retried if sending fails. If
+            None, the DRC_OUTBOX environment variable is used
+        max_in_flight: if set, check sessions with the asyncio client,
+            keeping up to this number of requests in flight
+        sql_dsn: if set, connection string of a read-only XNAT database used
+            for the searches (see open_query_backend)
+        explain: if True, print the plan for checking the sessions instead
+            of checking them
+        change_cache_path: local SQLite file used to store the result for
+            each session between runs. If None, the DRC_CHANGE_CACHE
+            environment variable is used. If neither is set, the scans of
+            every session are checked on each run
     """
+    if (shard or merge_shards) and not shard_dir:
+        raise ValueError("A shard directory must be specified for sharded runs")
+    shard_key = f"email_radreads-{project_name}"
+    change_cache_path = change_cache_path or os.getenv("DRC_CHANGE_CACHE")
+    if change_cache_path and (shard or merge_shards or max_in_flight):
+        raise ValueError(
+            "The change cache cannot be used with shards or the asyncio client"
+        )
+    query_backend = open_query_backend(sql_dsn) if sql_dsn else None
+    result_cache = (
+        SessionResultCache(
+            path=change_cache_path,
+            host=credentials.host,
+            key=f"email_radreads:{project_name}:{','.join(exclude_session_substrings)}",
+            record_type=SessionRecord,
+        )
+        if change_cache_path
+        else None
+    )
 
-    with open_pyxnat_session(credentials=credentials) as xnat_session:
-        # Get list of SessionRecords describing sessions which require radread
-        sessions_needing_radread = get_sessions_needing_radread(
-            pyxnat_interface=xnat_session,
-            project_name=project_name,
-            exclude_session_substrings=exclude_session_substrings,
+    if explain:
+        plan = QueryPlan()
+        with (
+            result_cache or nullcontext(),
+            query_backend or nullcontext(),
+            open_pyxnat_session(credentials=credentials) as xnat_session,
+        ):
+            get_sessions_needing_radread(
+                pyxnat_interface=xnat_session,
+                project_name=project_name,
+                exclude_session_substrings=exclude_session_substrings,
+                shard=shard,
+                query_backend=query_backend,
+                plan=plan,
+                plan_only=True,
+                result_cache=result_cache,
+            )
+        print(plan.explain())
+        return
+
+    deadline = Deadline(seconds=deadline_seconds)
+    coverage = Coverage()
+    checkpoint = None
+    if checkpoint_path:
+        exclude_key = ",".join(exclude_session_substrings)
+        checkpoint = Checkpoint(
+            path=checkpoint_path,
+            key=f"email_radreads:{project_name}:{exclude_key}:{shard}",
+            record_type=SessionRecord,
+            save_interval=checkpoint_interval,
+            resume=resume,
         )
+
+    with (
+        result_cache or nullcontext(),
+        query_backend or nullcontext(),
+        open_pyxnat_session(credentials=credentials) as xnat_session,
+    ):
+        apply_deadline(get_http_session(xnat_session), deadline)
+        if metrics:
+            track_requests(get_http_session(xnat_session), metrics)
+
+        if merge_shards:
+            # The sessions were checked by separate shard runs
+            sessions_needing_radread = merge_partial_results(
+                shard_dir=shard_dir,
+                key=shard_key,
+                num_shards=merge_shards,
+                record_type=SessionRecord,
+                coverage=coverage,
+            )
+        else:
+            # Get list of SessionRecords describing sessions which require
+            # radread. The checkpoint saves progress if the search is
+            # interrupted
+            with checkpoint or nullcontext():
+                if max_in_flight:
+                    with span("get_sessions_needing_radread"):
+                        sessions_needing_radread = asyncio.run(
+                            _get_sessions_needing_radread_with_async_client(
+                                credentials=credentials,
+                                project_name=project_name,
+                                exclude_session_substrings=exclude_session_substrings,
+                                checkpoint=checkpoint,
+                                deadline=deadline,
+                                coverage=coverage,
+                                shard=shard,
+                                max_in_flight=max_in_flight,
+                                metrics=metrics,
+                                query_backend=query_backend,
+                            )
+                        )
+                else:
+                    sessions_needing_radread = get_sessions_needing_radread(
+                        pyxnat_interface=xnat_session,
+                        project_name=project_name,
+                        exclude_session_substrings=exclude_session_substrings,
+                        checkpoint=checkpoint,
+                        deadline=deadline,
+                        coverage=coverage,
+                        shard=shard,
+                        query_backend=query_backend,
+                        result_cache=result_cache,
+                    )
+            if checkpoint:
+                # Save the final results in case sending the email fails
+                checkpoint.save()
+
+        if shard:
+            # The email is sent by the merge step once all shards have run
+            write_partial_results(
+                shard_dir=shard_dir,
+                key=shard_key,
+                shard=shard,
+                records=sessions_needing_radread,
+                coverage=coverage,
+            )
+            if metrics:
+                metrics.sessions_scanned = coverage.checked
+                metrics.issues_found = len(sessions_needing_radread)
+                metrics.complete = coverage.complete
+            if checkpoint and coverage.complete:
+                checkpoint.clear()
+            return
+
+        # Allow the time held in reserve to be used for sending the email
+        deadline.use_reserve()
         if debug_output:
             print("Sessions requiring radread:")
             if len(sessions_needing_radread) > 0:
@@ -231,25 +1068,47 @@ def run_email_radreads(
             else:
                 print("None found")
 
-        if len(sessions_needing_radread) > 0:
+        print(f"Radread checks {coverage.summary()}")
+        if metrics:
+            metrics.sessions_scanned = coverage.checked
+            metrics.issues_found = len(sessions_needing_radread)
+            metrics.complete = coverage.complete
+
+        # A partial report is always sent, so that a slow server never means
+        # no report at all
+        if len(sessions_needing_radread) > 0 or not coverage.complete:
             # Construct email html body
-            body_html = construct_email_body(
+            body_html = coverage.summary_html() + construct_email_body(
                 server_url=credentials.host,
                 project_name=project_name,
                 session_records=sessions_needing_radread,
             )
+            if not coverage.complete:
+                email_subject += " (partial report)"
+            if metrics:
+                metrics.email_bytes = len(body_html.encode())
 
             # Send the email via XNAT
-            send_email(
+            send_or_queue_email(
                 session=xnat_session,
+                host=credentials.host,
                 subject=email_subject,
                 to=to_emails,
                 cc=cc_emails,
                 bcc=bcc_emails,
                 content_html=body_html,
                 debug_output=debug_output,
+                outbox_dir=outbox_dir,
             )
 
+    if merge_shards:
+        # The report has been sent, so the results must not be merged again
+        remove_partial_results(
+            shard_dir=shard_dir, key=shard_key, num_shards=merge_shards
+        )
+    if checkpoint and coverage.complete:
+        checkpoint.clear()
+
 
 def main(args=None):
     """Entrypoint for email_radreads, as listed in pyproject.toml.
@@ -275,6 +1134,39 @@ def main(args=None):
         For example:
             email_radreads "PROJ" "user1@foo.org,user2@foo.org"
 
+    Optional arguments:
+        --checkpoint PATH: save progress periodically to this local file
+        --resume: continue an interrupted run from the --checkpoint file
+        --checkpoint-interval N: save progress after every N sessions
+        --deadline SECONDS: time budget for the run. When the budget runs
+            out, a partial email is sent
+        --shard I/N --shard-dir DIR: check only shard I (counting from 0) of
+            N and write the results to DIR without sending an email
+        --merge-shards N --shard-dir DIR: send an email combining the results
+            written to DIR by N shards
+        --profile PATH: write per-phase timings to PATH.folded (see
+            profile_run for further options)
+        --metrics-history PATH: append run metrics to this JSON lines file
+        --metrics-textfile PATH: write run metrics in OpenMetrics format
+        --outbox DIR: store the email in this local outbox before sending,
+            so that it can be retried if sending fails (see flush_outbox)
+        --max-in-flight N: check sessions with the asyncio client, keeping
+            up to N requests in flight. Requires the async extra
+        --sql DSN: run the searches on a read-only replica of the XNAT
+            database, for example "postgresql://user@replica/xnat". If not
+            given, the DRC_SQL_DSN environment variable is used
+        --servers PATH: check the project on every server listed in this
+            JSON file (see read_server_list) and send one combined email.
+            If not given, the DRC_SERVERS environment variable is used.
+            Cannot be combined with checkpoints, shards or --sql
+        --explain: print the plan for checking the sessions, with the
+            estimated number of requests and bytes, without checking them
+        --change-cache PATH: keep the result for each session in this local
+            SQLite file, and only check the scans of sessions which have
+            changed since the previous run. If not given, the
+            DRC_CHANGE_CACHE environment variable is used. Cannot be
+            combined with shards, --servers or --max-in-flight
+
     For testing, main() can be called with an argument list to simulate
     command-line arguments, eg:
         main(['PROJ', 'user1@foo.org,user2@foo.org'])
@@ -284,7 +1176,32 @@ def main(args=None):
     parser.add_argument("project")
     parser.add_argument("exclude_sessions")
     parser.add_argument("email_list")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--checkpoint-interval", type=int, default=50)
+    parser.add_argument("--deadline", type=float, default=None)
+    parser.add_argument("--shard", type=Shard.parse, default=None)
+    parser.add_argument("--shard-dir", default=None)
+    parser.add_argument("--merge-shards", type=int, default=None)
+    add_profiling_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument("--outbox", default=None, metavar="DIR")
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--servers", default=os.getenv("DRC_SERVERS"), metavar="PATH")
+    parser.add_argument("--sql", default=os.getenv("DRC_SQL_DSN"), metavar="DSN")
+    parser.add_argument("--explain", action="store_true")
+    parser.add_argument("--change-cache", default=None, metavar="PATH")
     parsed = parser.parse_args(args)
+    if parsed.servers and (parsed.checkpoint or parsed.shard or parsed.merge_shards):
+        parser.error("--servers cannot be combined with checkpoints or shards")
+    if parsed.servers and parsed.sql:
+        parser.error("--servers cannot be combined with --sql or DRC_SQL_DSN")
+    if parsed.servers and (parsed.change_cache or os.getenv("DRC_CHANGE_CACHE")):
+        parser.error(
+            "--servers cannot be combined with --change-cache or DRC_CHANGE_CACHE"
+        )
+    if parsed.explain and (parsed.servers or parsed.merge_shards):
+        parser.error("--explain cannot be combined with --servers or --merge-shards")
 
     project_name = parsed.project
     exclude_sessions = string_to_list(parsed.exclude_sessions)
@@ -292,13 +1209,54 @@ def main(args=None):
 
     credentials = XnatContainerCredentials()
 
-    run_email_radreads(
-        credentials=credentials,
-        project_name=project_name,
-        email_subject="1946 update: Weekly Radiology Reads Email",
-        to_emails=to_emails,
-        exclude_session_substrings=exclude_sessions,
-    )
+    metrics = RunMetrics(command="email_radreads", project=project_name)
+    with (
+        profile_run(
+            command="email_radreads",
+            output_path=parsed.profile,
+            cprofile=parsed.profile_cprofile,
+            trace_memory=parsed.profile_memory,
+        ),
+        record_run(
+            metrics=metrics,
+            history_path=parsed.metrics_history,
+            textfile_path=parsed.metrics_textfile,
+        ),
+    ):
+        if parsed.servers:
+            run_email_radreads_federated(
+                credentials=credentials,
+                servers=read_server_list(parsed.servers),
+                project_name=project_name,
+                email_subject="1946 update: Weekly Radiology Reads Email",
+                to_emails=to_emails,
+                exclude_session_substrings=exclude_sessions,
+                deadline_seconds=parsed.deadline,
+                metrics=metrics,
+                outbox_dir=parsed.outbox,
+                max_in_flight=parsed.max_in_flight,
+            )
+        else:
+            run_email_radreads(
+                credentials=credentials,
+                project_name=project_name,
+                email_subject="1946 update: Weekly Radiology Reads Email",
+                to_emails=to_emails,
+                exclude_session_substrings=exclude_sessions,
+                checkpoint_path=parsed.checkpoint,
+                resume=parsed.resume,
+                checkpoint_interval=parsed.checkpoint_interval,
+                deadline_seconds=parsed.deadline,
+                metrics=metrics,
+                shard=parsed.shard,
+                shard_dir=parsed.shard_dir,
+                merge_shards=parsed.merge_shards,
+                outbox_dir=parsed.outbox,
+                max_in_flight=parsed.max_in_flight,
+                sql_dsn=parsed.sql,
+                explain=parsed.explain,
+                change_cache_path=parsed.change_cache,
+            )
 
 
 if __name__ == "__main__":
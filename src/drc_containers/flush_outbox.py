@@ -0,0 +1,71 @@
+import os
+import sys
+from argparse import ArgumentParser
+
+from drc_containers.xnat_utils.outbox import Outbox
+from drc_containers.xnat_utils.xnat_credentials import (
+    XnatContainerCredentials,
+    XnatCredentials,
+    open_pyxnat_session,
+)
+
+
+def flush_outbox(
+    credentials: XnatCredentials, outbox_dir: str, ignore_schedule: bool = False
+) -> bool:
+    """Send the emails waiting in an outbox, without running any searches or
+    checks
+
+    Args:
+        credentials: XNAT host name and user login details
+        outbox_dir: outbox directory used by the email commands
+        ignore_schedule: set to True to retry all messages now, even if their
+            next retry is not yet due
+
+    Returns:
+        True if all messages for this server have been sent
+    """
+    outbox = Outbox(outbox_dir)
+    with open_pyxnat_session(credentials=credentials) as xnat_session:
+        result = outbox.flush(
+            session=xnat_session,
+            host=credentials.host,
+            ignore_schedule=ignore_schedule,
+        )
+    return result.pending == 0 and result.failed == 0
+
+
+def main(args=None):
+    """Entrypoint for flush_outbox, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        flush_outbox [--all] [outbox]
+
+        where outbox is the directory passed to the email commands with
+        --outbox. If not given, the DRC_OUTBOX environment variable is used.
+        With --all, messages are retried now even if their next retry is not
+        yet due.
+
+    The exit code is 1 if any messages could not be sent.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("outbox", nargs="?", default=os.getenv("DRC_OUTBOX"))
+    parser.add_argument("--all", action="store_true")
+    parsed = parser.parse_args(args)
+    if not parsed.outbox:
+        parser.error("No outbox directory given and DRC_OUTBOX is not set")
+
+    if not flush_outbox(
+        credentials=XnatContainerCredentials(),
+        outbox_dir=parsed.outbox,
+        ignore_schedule=parsed.all,
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
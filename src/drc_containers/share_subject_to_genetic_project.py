@@ -1,13 +1,21 @@
 import re
-import sys
+from argparse import ArgumentParser
 
+from drc_containers.xnat_utils.deadline import apply_deadline, Deadline
+from drc_containers.xnat_utils.profiling import (
+    add_profiling_arguments,
+    profile_run,
+    span,
+)
 from drc_containers.xnat_utils.xnat_credentials import (
+    get_http_session,
     open_xnat_session,
     XnatContainerCredentials,
     XnatCredentials,
 )
 
 
+@span("share_to_project")
 def share_to_project(subject, other_project_id, debug=False):
     try:
         shared_to_project = [
@@ -27,16 +35,25 @@ def share_to_project(subject, other_project_id, debug=False):
         )
 
 
-def share_subject_to_genetic_project(credentials: XnatCredentials, subject_id: str):
+def share_subject_to_genetic_project(
+    credentials: XnatCredentials, subject_id: str, deadline_seconds: float | None = None
+):
     """Share the specified subject to the corresponding genetic project
 
     Args:
         credentials: XNAT host name and user login details
         subject_id: ID of the subject to share
+        deadline_seconds: time budget in seconds. Requests which are still in
+            flight when the budget runs out are cancelled. If None there is no
+            time limit
     """
     site_pattern = re.compile("^GENFI_\d\d$")
 
     with open_xnat_session(credentials) as xnat_session:
+        apply_deadline(
+            get_http_session(xnat_session),
+            Deadline(seconds=deadline_seconds, reserve=0),
+        )
         if subject_id not in xnat_session.subjects:
             raise ValueError(f"Subject {subject_id} not found")
         subject = xnat_session.subjects[subject_id]
@@ -60,11 +77,36 @@ def share_subject_to_genetic_project(credentials: XnatCredentials, subject_id: s
             )
 
 
-def main():
-    if len(sys.argv) < 2:
-        raise ValueError("No subject label specified")
+def main(args=None):
+    """Entrypoint for share_subject_to_genetic_project, as listed in
+    pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        share_subject_to_genetic_project subject_id [--deadline SECONDS]
+            [--profile PATH]
+    """
+    parser = ArgumentParser()
+    parser.add_argument("subject_id")
+    parser.add_argument("--deadline", type=float, default=None)
+    add_profiling_arguments(parser)
+    parsed = parser.parse_args(args)
+
     credentials = XnatContainerCredentials()
-    share_subject_to_genetic_project(credentials=credentials, subject_id=sys.argv[1])
+    with profile_run(
+        command="share_subject_to_genetic_project",
+        output_path=parsed.profile,
+        cprofile=parsed.profile_cprofile,
+        trace_memory=parsed.profile_memory,
+    ):
+        share_subject_to_genetic_project(
+            credentials=credentials,
+            subject_id=parsed.subject_id,
+            deadline_seconds=parsed.deadline,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+import json
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from drc_containers.commands import COMMAND_MODULES
+from drc_containers.xnat_utils.dedup import RequestDeduplicator
+from drc_containers.xnat_worker import XnatWorker
+
+
+def read_manifest(manifest_path: str) -> list[dict]:
+    """Read the jobs listed in a batch manifest
+
+    The manifest is a JSON file of the form:
+        {
+            "jobs": [
+                {"command": "email_listmode", "args": ["PROJ", "90", "a@b.org"]},
+                {"command": "email_radreads", "args": ["PROJ", "", "a@b.org"]}
+            ]
+        }
+
+    Returns:
+        list of dicts, each with a command name and a list of args
+    """
+    with open(manifest_path) as f:
+        jobs = json.load(f)["jobs"]
+    for job in jobs:
+        if job.get("command") not in COMMAND_MODULES:
+            raise ValueError(f"Unknown command {job.get('command')} in manifest")
+        job["args"] = [str(arg) for arg in job.get("args", [])]
+    return jobs
+
+
+def xnat_batch(
+    manifest_path: str, concurrency: int = 1, memo_seconds: float = 300
+) -> list[dict]:
+    """Run several commands in one process, sharing their XNAT requests
+
+    Identical searches and GET requests made by different commands are sent
+    once (see RequestDeduplicator), and XNAT sessions are reused between
+    commands (see SessionPool). The output of each command is printed when
+    it finishes, followed by the number of requests saved.
+
+    Args:
+        manifest_path: JSON file listing the commands to run (see
+            read_manifest)
+        concurrency: number of commands run at once. Commands running at the
+            same time share requests in flight; commands run one after the
+            other share responses from the memo
+        memo_seconds: number of seconds for which a response is reused
+
+    Returns:
+        list of dicts, one for each job in the manifest, with the exit_code
+        of the command, its output and the number of seconds it took
+    """
+    jobs = read_manifest(manifest_path)
+    worker = XnatWorker(max_jobs=concurrency)
+    start = time.perf_counter()
+    with RequestDeduplicator(memo_seconds=memo_seconds) as deduplicator:
+        worker.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                results = list(
+                    executor.map(
+                        lambda job: worker.run_job(job["command"], job["args"]), jobs
+                    )
+                )
+        finally:
+            worker.stop()
+
+    for job, result in zip(jobs, results):
+        print(f"=== {job['command']} {' '.join(job['args'])}")
+        print(result["output"], end="")
+        print(
+            f"=== {job['command']} exited with {result['exit_code']} after "
+            f"{result['seconds']:.2f}s"
+        )
+    print(
+        f"Batch of {len(jobs)} commands in {time.perf_counter() - start:.2f}s, "
+        f"{worker.pool.opened} XNAT sessions opened, "
+        f"{worker.pool.reused} reused"
+    )
+    print(deduplicator.summary())
+    return results
+
+
+def main(args=None):
+    """Entrypoint for xnat_batch, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        xnat_batch [--concurrency N] [--memo-seconds S] manifest
+
+    The exit code is 1 if any command fails.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("manifest")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--memo-seconds", type=float, default=300)
+    parsed = parser.parse_args(args)
+
+    results = xnat_batch(
+        manifest_path=parsed.manifest,
+        concurrency=parsed.concurrency,
+        memo_seconds=parsed.memo_seconds,
+    )
+    if any(result["exit_code"] != 0 for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import time
+from argparse import REMAINDER, ArgumentParser
+
+from drc_containers.commands import get_command
+from drc_containers.xnat_utils.cassette import install_cassette_from_environment
+
+
+def xnat_replay(
+    cassette_path: str, command: str, command_args: list[str], time_scale: float
+):
+    """Run a command offline, serving its XNAT requests from a cassette
+    recorded during a previous run
+
+    A summary is printed comparing the requests made by this run with the
+    recorded run, which can be used to compare request counts and wall time
+    between versions of a command.
+
+    Args:
+        cassette_path: cassette recorded by running the command with the
+            DRC_CASSETTE environment variable set
+        command: name of the command to run
+        command_args: command-line arguments for the command
+        time_scale: recorded latencies are multiplied by this factor. Set to
+            0 to replay without delays
+    """
+    os.environ["DRC_CASSETTE"] = cassette_path
+    os.environ["DRC_CASSETTE_MODE"] = "replay"
+    os.environ["DRC_CASSETTE_TIME_SCALE"] = str(time_scale)
+
+    # Credentials are not needed for replay, but the commands expect them
+    os.environ.setdefault("XNAT_HOST", "https://xnat-replay.invalid")
+    os.environ.setdefault("XNAT_USER", "replay")
+    os.environ.setdefault("XNAT_PASS", "replay")
+
+    cassette = install_cassette_from_environment()
+    main = get_command(command)
+    start = time.perf_counter()
+    try:
+        main(command_args)
+    finally:
+        wall_time = time.perf_counter() - start
+        cassette.uninstall()
+        print(cassette.summary())
+        print(
+            f"Replay of {command}: {cassette.stats.requests} requests in "
+            f"{wall_time:.2f}s (recorded run: {cassette.stats.recorded} requests, "
+            f"{cassette.stats.recorded_latency_seconds:.2f}s total latency)"
+        )
+
+
+def main(args=None):
+    """Entrypoint for xnat_replay, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        xnat_replay [--time-scale S] cassette command [command arguments]
+
+    For example, to record a run and then replay it without delays:
+        DRC_CASSETTE=radreads.jsonl email_radreads "PROJ" "" "user1@foo.org"
+        xnat_replay --time-scale 0 radreads.jsonl email_radreads "PROJ" "" "user1@foo.org"
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("cassette")
+    parser.add_argument("command")
+    parser.add_argument("command_args", nargs=REMAINDER)
+    parsed = parser.parse_args(args)
+
+    xnat_replay(
+        cassette_path=parsed.cassette,
+        command=parsed.command,
+        command_args=parsed.command_args,
+        time_scale=parsed.time_scale,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from argparse import REMAINDER, ArgumentParser
+
+# Only the standard library is imported, so that submitting a job does not
+# pay for importing pyxnat and xnat
+
+DEFAULT_WORKER_URL = "http://127.0.0.1:8765"
+
+
+def xnat_submit(
+    worker_url: str,
+    command: str,
+    command_args: list[str],
+    timeout: float | None = None,
+    token: str | None = None,
+) -> dict:
+    """Run a command in an xnat_worker and wait for it to finish
+
+    Args:
+        worker_url: URL of the worker
+        command: name of the command to run
+        command_args: command-line arguments for the command
+        timeout: maximum number of seconds to wait for the job. If None there
+            is no time limit
+        token: token expected by the worker, if it requires one
+
+    Returns:
+        dict with the exit_code of the command, its output and the number of
+        seconds it took
+    """
+    request = urllib.request.Request(
+        worker_url.rstrip("/") + "/jobs",
+        data=json.dumps({"command": command, "args": command_args}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as ex:
+        error = json.load(ex).get("error", ex.reason)
+        raise RuntimeError(f"Worker rejected the job: {error}")
+
+
+def main(args=None):
+    """Entrypoint for xnat_submit, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        xnat_submit [--worker URL] [--timeout S] command [command arguments]
+
+    For example:
+        xnat_submit share_subject_to_genetic_project XNAT_S00001
+
+    The worker URL defaults to the DRC_WORKER_URL environment variable, or
+    http://127.0.0.1:8765. The output of the command is printed and the exit
+    code is that of the command.
+    """
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--worker", default=os.getenv("DRC_WORKER_URL", DEFAULT_WORKER_URL)
+    )
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("command")
+    parser.add_argument("command_args", nargs=REMAINDER)
+    parsed = parser.parse_args(args)
+
+    result = xnat_submit(
+        worker_url=parsed.worker,
+        command=parsed.command,
+        command_args=parsed.command_args,
+        timeout=parsed.timeout,
+        token=os.getenv("DRC_WORKER_TOKEN"),
+    )
+    print(result["output"], end="")
+    sys.exit(result["exit_code"])
+
+
+if __name__ == "__main__":
+    main()
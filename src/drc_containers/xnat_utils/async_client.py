@@ -0,0 +1,268 @@
+import asyncio
+import csv
+import difflib
+import json
+from collections.abc import Awaitable, Callable, Iterable
+from io import StringIO
+from urllib.parse import quote
+
+from pyxnat.core.search import build_search_document
+
+from drc_containers.xnat_utils.deadline import Deadline, DeadlineExpired
+from drc_containers.xnat_utils.run_metrics import RunMetrics
+from drc_containers.xnat_utils.xnat_credentials import XnatCredentials
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+class AsyncXnatClient:
+    """An asyncio XNAT client for workloads which make many small requests,
+    such as checking the resources or scans of every session in a project
+
+    Requests share a small pool of keep-alive connections (multiplexed over
+    HTTP/2 if the h2 package is installed), so hundreds of requests can be in
+    flight at once without a thread for each. The number of requests in
+    flight is limited by max_in_flight.
+
+    Requires the optional httpx dependency:
+        pip install "drc-containers[async]"
+
+    Use as an async context manager, which opens and closes an XNAT session:
+
+        async with AsyncXnatClient(credentials) as client:
+            scans = await client.experiment_scans(project, subject, session)
+    """
+
+    def __init__(
+        self,
+        credentials: XnatCredentials,
+        max_in_flight: int = 100,
+        max_connections: int = 20,
+        timeout: float = 300,
+        deadline: Deadline = None,
+        metrics: RunMetrics = None,
+    ):
+        """
+        Args:
+            credentials: XNAT host name and user login details
+            max_in_flight: maximum number of requests in flight at once
+            max_connections: maximum number of connections to the server
+            timeout: timeout in seconds for each request
+            deadline: optional time budget. Request timeouts are limited to
+                the time remaining, and DeadlineExpired is raised once it has
+                run out
+            metrics: optional RunMetrics to which the number of requests and
+                bytes received are added
+        """
+        if httpx is None:
+            raise ImportError(
+                "The async XNAT client requires httpx. "
+                'Install it with: pip install "drc-containers[async]"'
+            )
+        self.credentials = credentials
+        self.timeout = timeout
+        self.deadline = deadline
+        self.metrics = metrics
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._client = httpx.AsyncClient(
+            base_url=credentials.host.rstrip("/"),
+            auth=(credentials.username, credentials.password),
+            verify=credentials.verify_ssl,
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        # Open an XNAT session so that later requests are authenticated by
+        # the session cookie rather than by checking the password each time
+        await self._request("GET", "/data/JSESSION")
+        self._client.auth = None
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await self._request("DELETE", "/data/JSESSION")
+        except (httpx.HTTPError, DeadlineExpired) as ex:
+            # The server will expire the session if it cannot be closed
+            print(f"Could not close the XNAT session: {ex}")
+        finally:
+            await self._client.aclose()
+
+    async def _request(self, method: str, path: str, **kwargs) -> bytes:
+        async with self._semaphore:
+            timeout = self.timeout
+            if self.deadline:
+                remaining = self.deadline.remaining()
+                if remaining is not None:
+                    if remaining <= 0:
+                        raise DeadlineExpired(f"Deadline expired before {path}")
+                    timeout = min(timeout, remaining)
+            try:
+                response = await self._client.request(
+                    method, path, timeout=timeout, **kwargs
+                )
+            except httpx.TimeoutException:
+                if self.deadline and self.deadline.expired():
+                    raise DeadlineExpired(f"Deadline expired during {path}")
+                raise
+        response.raise_for_status()
+        if self.metrics:
+            self.metrics.requests += 1
+            self.metrics.bytes_received += len(response.content)
+        return response.content
+
+    async def get_json(self, path: str) -> list[dict]:
+        """Return the results of a REST listing
+
+        Args:
+            path: path of the listing, for example /data/projects
+
+        Returns:
+            list of dicts, one for each row of the listing
+        """
+        content = await self._request("GET", path, params={"format": "json"})
+        return json.loads(content)["ResultSet"]["Result"]
+
+    async def search(
+        self, root_element: str, columns: list[str], constraints: list
+    ) -> list[dict]:
+        """Run an XNAT search, in the same way as pyxnat's
+        interface.select(root_element, columns).where(constraints)
+
+        Args:
+            root_element: datatype returned by the search, for example
+                xnat:mrSessionData
+            columns: columns to return
+            constraints: constraints in pyxnat format
+
+        Returns:
+            list of dicts, one for each row, with the same keys as the rows of
+            the pyxnat search results
+        """
+        document = build_search_document(root_element, columns, constraints)
+        content = await self._request(
+            "POST",
+            "/data/search",
+            params={"format": "csv"},
+            content=document,
+            headers={"Content-Type": "text/xml"},
+        )
+        rows = csv.reader(StringIO(content.decode("utf-8")))
+        headers = next(rows)
+        # Match the requested columns to the returned headers as pyxnat does
+        keys = []
+        for column in columns:
+            field = column.split(root_element + "/")
+            match = difflib.get_close_matches(
+                field[0].lower() or field[1].lower(), headers
+            )
+            keys.append(match[0] if match else "unknown")
+        results = []
+        for row in rows:
+            values = dict(zip(headers, row))
+            results.append({key: values.get(key) for key in keys})
+        return results
+
+    async def experiment_resources(self, project: str, session_id: str) -> list[dict]:
+        """Return the resources of a session, each a dict with a label key"""
+        return await self.get_json(
+            f"/data/projects/{_quote(project)}/experiments/{_quote(session_id)}"
+            f"/resources"
+        )
+
+    async def resource_files(
+        self, project: str, session_id: str, resource: str
+    ) -> list[dict]:
+        """Return the files in a session resource, each a dict with Name and
+        Size keys. The resource may be given by its ID or label"""
+        return await self.get_json(
+            f"/data/projects/{_quote(project)}/experiments/{_quote(session_id)}"
+            f"/resources/{_quote(resource)}/files"
+        )
+
+    async def experiment_scans(
+        self, project: str, subject_id: str, session_id: str
+    ) -> list[dict]:
+        """Return the scans of a session, each a dict with ID and type keys"""
+        return await self.get_json(
+            f"/data/projects/{_quote(project)}/subjects/{_quote(subject_id)}"
+            f"/experiments/{_quote(session_id)}/scans"
+        )
+
+    async def subject_projects(self, subject_id: str) -> list[str]:
+        """Return the IDs of the projects a subject is shared into"""
+        content = await self._request(
+            "GET", f"/data/subjects/{_quote(subject_id)}", params={"format": "json"}
+        )
+        item = json.loads(content)["items"][0]
+        projects = []
+        for child in item.get("children", []):
+            if child.get("field") == "sharing/share":
+                projects.extend(
+                    share["data_fields"]["project"] for share in child["items"]
+                )
+        return projects
+
+    async def share_subject(self, subject_id: str, project: str, label: str):
+        """Share a subject into another project
+
+        Args:
+            subject_id: ID of the subject
+            project: ID of the project to share into
+            label: label of the subject in the other project
+        """
+        await self._request(
+            "PUT",
+            f"/data/subjects/{_quote(subject_id)}/projects/{_quote(project)}",
+            params={"label": label},
+        )
+
+
+async def map_concurrently(
+    func: Callable[..., Awaitable], items: Iterable, concurrency: int
+):
+    """Call the coroutine function func for each item, with at most
+    concurrency calls running at once
+
+    Items are started in order, and only concurrency coroutines exist at any
+    time, so memory use does not grow with the number of items. If any call
+    raises an exception, the remaining calls are cancelled and the exception
+    is raised.
+
+    Args:
+        func: coroutine function taking one item
+        items: items to process
+        concurrency: maximum number of calls running at once
+    """
+    iterator = iter(items)
+
+    async def worker():
+        for item in iterator:
+            await func(item)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+
+def _quote(value: str) -> str:
+    return quote(value, safe="")
@@ -0,0 +1,269 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Headers which may contain credentials and are never written to a cassette
+_SENSITIVE_HEADERS = {"authorization", "cookie", "set-cookie"}
+
+# Responses whose body is a session token, which is replaced in the cassette
+_SESSION_TOKEN_PATHS = ("/data/JSESSION",)
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Raised in replay mode when a request has no recorded response"""
+
+
+@dataclass
+class CassetteStats:
+    """Counts of requests handled by a Cassette"""
+
+    requests: int = 0
+    recorded: int = 0
+    hits: int = 0
+    misses: int = 0
+    recorded_latency_seconds: float = 0.0
+
+
+class Cassette:
+    """Record XNAT requests and responses to a local file, or replay them
+    without a network connection
+
+    In "record" mode, each request sent by the requests library is passed to
+    the server as normal, and the response is appended to the cassette file
+    together with its latency. Credentials and session tokens are removed.
+
+    In "replay" mode, responses are served from the cassette file, optionally
+    sleeping for the recorded latency multiplied by time_scale. Requests are
+    matched on their method, path, query and body. If the body differs (for
+    example a search containing today's date) the request is matched on
+    method, path and query only. Repeated identical requests are served in
+    the order they were recorded.
+
+    The cassette works by replacing the send method of the requests
+    HTTPAdapter, so it applies to both pyxnat and xnat sessions, including
+    the login requests made when an xnat session is opened.
+    """
+
+    def __init__(self, path: str, mode: str, time_scale: float = 1.0):
+        """
+        Args:
+            path: cassette file, in JSON lines format
+            mode: "record" or "replay"
+            time_scale: in replay mode, recorded latencies are multiplied by
+                this factor. Set to 0 to replay without delays
+        """
+        if mode not in ["record", "replay"]:
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.stats = CassetteStats()
+        self._lock = threading.Lock()
+        self._original_send = None
+        self._exact: dict[tuple, deque] = {}
+        self._loose: dict[tuple, deque] = {}
+        if mode == "replay":
+            self._load()
+
+    def install(self):
+        """Start recording or replaying all requests"""
+        if self._original_send is not None:
+            return
+        self._original_send = HTTPAdapter.send
+        cassette = self
+
+        def send(adapter, request, **kwargs):
+            if cassette.mode == "record":
+                return cassette._record(adapter, request, **kwargs)
+            return cassette._replay(adapter, request)
+
+        HTTPAdapter.send = send
+
+    def uninstall(self):
+        """Restore normal network access"""
+        if self._original_send is not None:
+            HTTPAdapter.send = self._original_send
+            self._original_send = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    def summary(self) -> str:
+        """Return a one-line summary of the requests handled"""
+        if self.mode == "record":
+            return (
+                f"Cassette {self.path}: recorded {self.stats.recorded} requests, "
+                f"{self.stats.recorded_latency_seconds:.2f}s total latency"
+            )
+        return (
+            f"Cassette {self.path}: replayed {self.stats.requests} requests "
+            f"({self.stats.hits} hits, {self.stats.misses} misses) of "
+            f"{self.stats.recorded} recorded"
+        )
+
+    def _record(self, adapter, request, **kwargs):
+        start = time.perf_counter()
+        response = self._original_send(adapter, request, **kwargs)
+        # Reading the content here keeps it available for the caller
+        content = response.content
+        latency = time.perf_counter() - start
+
+        path = _path_and_query(request.url)
+        if urlsplit(request.url).path.endswith(_SESSION_TOKEN_PATHS):
+            content = b"00000000000000000000000000000000"
+        entry = {
+            "method": request.method,
+            "url": path,
+            "body_sha256": _body_hash(request.body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() not in _SENSITIVE_HEADERS
+            },
+            "body": base64.b64encode(content).decode("ascii"),
+            "latency": latency,
+        }
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.stats.requests += 1
+            self.stats.recorded += 1
+            self.stats.recorded_latency_seconds += latency
+        return response
+
+    def find_response(self, method: str, path: str, body) -> dict | None:
+        """Return the next recorded response matching a request
+
+        Args:
+            method: HTTP method of the request
+            path: path and query string of the request
+            body: request body as bytes or str, or None
+
+        Returns:
+            dict describing the recorded response, with keys status, reason,
+            headers, body (base64-encoded) and latency (seconds). None if
+            there is no matching response
+        """
+        exact_key = (method, path, _body_hash(body))
+        loose_key = (method, path)
+        with self._lock:
+            self.stats.requests += 1
+            entry = _next_entry(self._exact.get(exact_key))
+            if entry is None:
+                entry = _next_entry(self._loose.get(loose_key))
+            if entry is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return entry
+
+    def _replay(self, adapter, request):
+        path = _path_and_query(request.url)
+        entry = self.find_response(request.method, path, request.body)
+        if entry is None:
+            raise CassetteMiss(f"No recorded response for {request.method} {path}")
+
+        if self.time_scale > 0:
+            time.sleep(entry["latency"] * self.time_scale)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(entry["body"])
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        response.elapsed = timedelta(seconds=entry["latency"])
+        return response
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                exact_key = (entry["method"], entry["url"], entry["body_sha256"])
+                loose_key = (entry["method"], entry["url"])
+                self._exact.setdefault(exact_key, deque()).append(entry)
+                self._loose.setdefault(loose_key, deque()).append(entry)
+                self.stats.recorded += 1
+                self.stats.recorded_latency_seconds += entry["latency"]
+
+
+_active_cassette: Cassette | None = None
+
+
+def install_cassette_from_environment() -> Cassette | None:
+    """Record or replay requests if the DRC_CASSETTE environment variable is
+    set. This is called when an XNAT session is opened.
+
+    Environment variables:
+        DRC_CASSETTE: path of the cassette file
+        DRC_CASSETTE_MODE: "record" (default) or "replay"
+        DRC_CASSETTE_TIME_SCALE: multiplier for recorded latencies in replay
+            mode (default 1)
+
+    Returns:
+        the installed Cassette, or None if DRC_CASSETTE is not set
+    """
+    global _active_cassette
+
+    path = os.getenv("DRC_CASSETTE")
+    if not path:
+        return None
+    if _active_cassette is None or _active_cassette.path != path:
+        if _active_cassette is not None:
+            _active_cassette.uninstall()
+        _active_cassette = Cassette(
+            path=path,
+            mode=os.getenv("DRC_CASSETTE_MODE", default="record"),
+            time_scale=float(os.getenv("DRC_CASSETTE_TIME_SCALE", default="1")),
+        )
+        _active_cassette.install()
+    return _active_cassette
+
+
+def _next_entry(entries: deque | None) -> dict | None:
+    """Return the next recorded entry. The last entry for a request is kept,
+    so that further repeats of the request can still be served"""
+    if not entries:
+        return None
+    if len(entries) > 1:
+        return entries.popleft()
+    return entries[0]
+
+
+def _path_and_query(url: str) -> str:
+    parts = urlsplit(url)
+    return parts.path + ("?" + parts.query if parts.query else "")
+
+
+def _body_hash(body) -> str:
+    if body is None:
+        return ""
+    if isinstance(body, str):
+        body = body.encode()
+    if not isinstance(body, bytes):
+        # Streamed uploads cannot be hashed without consuming them
+        return ""
+    return hashlib.sha256(body).hexdigest()
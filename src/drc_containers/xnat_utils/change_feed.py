@@ -0,0 +1,243 @@
+import json
+import sqlite3
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+
+from drc_containers.xnat_utils.query_backend import QueryBackend
+
+# XNAT records a workflow entry for each change made to an item, such as
+# creating a session or uploading or deleting one of its resources
+WORKFLOW_DATATYPE = "wrk:workflowData"
+
+
+def changes_query(project_name: str, since: str) -> tuple[list[str], list]:
+    """Return the columns and constraints of the search for the workflow
+    entries of a project launched on or after a date"""
+    columns = [
+        WORKFLOW_DATATYPE + "/ID",
+        WORKFLOW_DATATYPE + "/DATA_TYPE",
+        WORKFLOW_DATATYPE + "/LAUNCH_TIME",
+    ]
+    constraints = [
+        (WORKFLOW_DATATYPE + "/ExternalID", "=", project_name),
+        (WORKFLOW_DATATYPE + "/launch_time", ">=", since),
+        "AND",
+    ]
+    return columns, constraints
+
+
+def get_changed_items(
+    query_backend: QueryBackend, project_name: str, since: str
+) -> dict[str, str]:
+    """Return the items in a project which have changed since a date
+
+    Args:
+        query_backend: QueryBackend used for the search
+        project_name: project to search in
+        since: date as YYYY-MM-DD
+
+    Returns:
+        dict of the ID of each changed item to its datatype
+    """
+    rows = query_backend.search(WORKFLOW_DATATYPE, *changes_query(project_name, since))
+    return {row["id"]: row["data_type"] for row in rows if row["id"]}
+
+
+class SessionResultCache:
+    """A persistent local cache of the result of checking each session,
+    stored in an SQLite database, with a high-water mark for XNAT's change
+    history
+
+    Once a project has been checked in full, later runs only check the
+    sessions with workflow entries since the high-water mark (see
+    get_changed_items), and reuse the stored results for every other
+    session. The work done by each run then depends on the number of
+    sessions changed rather than the size of the project. Since a change
+    which does not create a workflow entry would never be seen, every
+    session is checked again when the last full check is older than
+    full_refresh_days.
+
+    Results are stored per XNAT server and per key, which identifies the
+    command and its arguments. Records must be frozen dataclasses of type
+    record_type, and a session with no record is stored as having no
+    problems.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        host: str,
+        key: str,
+        record_type: type,
+        full_refresh_days: float = 28,
+    ):
+        """
+        Args:
+            path: location of the SQLite database file
+            host: XNAT server whose sessions are checked
+            key: string identifying the command and its arguments
+            record_type: dataclass type of the stored records
+            full_refresh_days: every session is checked again if the last
+                full check is older than this number of days
+        """
+        self.path = path
+        self.host = host
+        self.key = key
+        self.record_type = record_type
+        self.full_refresh_days = full_refresh_days
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS session_results ("
+                "host TEXT, key TEXT, session_id TEXT, record TEXT, "
+                "PRIMARY KEY (host, key, session_id)) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS change_marks ("
+                "host TEXT, key TEXT, refreshed TEXT, full_refreshed TEXT, "
+                "PRIMARY KEY (host, key))"
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def changed_since(self) -> str | None:
+        """Return the date from which changes must be fetched to bring the
+        stored results up to date
+
+        Returns:
+            date as YYYY-MM-DD, or None if every session must be checked
+        """
+        row = self._connection.execute(
+            "SELECT refreshed, full_refreshed FROM change_marks "
+            "WHERE host = ? AND key = ?",
+            (self.host, self.key),
+        ).fetchone()
+        if row is None:
+            return None
+        refreshed, full_refreshed = (datetime.fromisoformat(r) for r in row)
+        now = datetime.now(timezone.utc)
+        if now - full_refreshed > timedelta(days=self.full_refresh_days):
+            return None
+        # Go back a day so that differences between the time zones of the
+        # server and the container cannot cause changes to be missed
+        return (refreshed.date() - timedelta(days=1)).isoformat()
+
+    def contains(self, session_id: str) -> bool:
+        """Return True if a result is stored for this session"""
+        row = self._connection.execute(
+            "SELECT 1 FROM session_results "
+            "WHERE host = ? AND key = ? AND session_id = ?",
+            (self.host, self.key, session_id),
+        ).fetchone()
+        return row is not None
+
+    def record(self, session_id: str):
+        """Return the stored record for a session, or None if the session
+        had no problems or has no stored result"""
+        row = self._connection.execute(
+            "SELECT record FROM session_results "
+            "WHERE host = ? AND key = ? AND session_id = ?",
+            (self.host, self.key, session_id),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return self.record_type(**json.loads(row[0]))
+
+    def records(self, session_ids: set[str] | None = None) -> set:
+        """Return the stored records
+
+        Args:
+            session_ids: if set, only the records of these sessions are
+                returned
+        """
+        rows = self._connection.execute(
+            "SELECT session_id, record FROM session_results "
+            "WHERE host = ? AND key = ? AND record IS NOT NULL",
+            (self.host, self.key),
+        )
+        return {
+            self.record_type(**json.loads(record))
+            for session_id, record in rows
+            if session_ids is None or session_id in session_ids
+        }
+
+    def store(self, session_id: str, record):
+        """Store the result of checking a session
+
+        Args:
+            session_id: ID of the session
+            record: record describing the problems found, or None if there
+                were none
+        """
+        value = None if record is None else json.dumps(asdict(record))
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO session_results VALUES (?, ?, ?, ?)",
+                (self.host, self.key, session_id, value),
+            )
+
+    def discard(self, session_ids: set[str]):
+        """Remove the stored results of sessions which no longer exist"""
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM session_results "
+                "WHERE host = ? AND key = ? AND session_id = ?",
+                ((self.host, self.key, session_id) for session_id in session_ids),
+            )
+
+    def retain(self, session_ids: set[str]):
+        """Remove the stored results of all sessions except these, such as
+        sessions which have left the date window"""
+        rows = self._connection.execute(
+            "SELECT session_id FROM session_results WHERE host = ? AND key = ?",
+            (self.host, self.key),
+        )
+        self.discard({session_id for (session_id,) in rows} - session_ids)
+
+    def is_unchanged(self, session_id: str, changed: dict[str, str] | None) -> bool:
+        """Return True if the stored result for a session can be reused
+
+        Args:
+            session_id: ID of the session
+            changed: items changed since the high-water mark, as returned by
+                get_changed_items, or None if every session is being checked
+        """
+        return (
+            changed is not None
+            and session_id not in changed
+            and self.contains(session_id)
+        )
+
+    def clear(self):
+        """Remove all the stored results, before every session is checked"""
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM session_results WHERE host = ? AND key = ?",
+                (self.host, self.key),
+            )
+
+    def update(self, started: datetime, full: bool):
+        """Move the high-water mark forward after a complete run
+
+        Args:
+            started: UTC time at which the search for changes started
+            full: True if every session was checked
+        """
+        with self._connection:
+            if full:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO change_marks VALUES (?, ?, ?, ?)",
+                    (self.host, self.key, started.isoformat(), started.isoformat()),
+                )
+            else:
+                self._connection.execute(
+                    "UPDATE change_marks SET refreshed = ? WHERE host = ? AND key = ?",
+                    (started.isoformat(), self.host, self.key),
+                )
@@ -0,0 +1,113 @@
+import json
+import os
+from dataclasses import asdict
+
+
+class Checkpoint:
+    """Save the progress of a long-running scan to a local state file, so that
+    a run which is killed or times out can be resumed without repeating work
+
+    The state file records the IDs of the sessions which have been processed
+    and the records found so far. Records must be frozen dataclasses of type
+    record_type so they can be stored in a set and serialised to JSON.
+
+    The key identifies the run (for example the command and its arguments).
+    A state file written with a different key is ignored when resuming, so
+    progress from one project is never mixed into the report for another.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        key: str,
+        record_type: type,
+        save_interval: int = 50,
+        resume: bool = False,
+    ):
+        """
+        Args:
+            path: location of the state file
+            key: string identifying the run which owns the state file
+            record_type: dataclass type of the stored records
+            save_interval: the state file is written after this number of
+                sessions have been processed since the last save
+            resume: set to True to load progress from an existing state file
+        """
+        self.path = path
+        self.key = key
+        self.record_type = record_type
+        self.save_interval = save_interval
+        self.processed: set[str] = set()
+        self.records: set = set()
+        self._unsaved = 0
+
+        if resume:
+            self.load()
+
+    def load(self):
+        """Load progress from the state file, if one exists for this run"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("key") != self.key:
+            print(
+                f"Ignoring checkpoint {self.path} because it was written by a "
+                f"different run: {state.get('key')}"
+            )
+            return
+        self.processed = set(state["processed"])
+        self.records = {self.record_type(**r) for r in state["records"]}
+        print(
+            f"Resuming from checkpoint {self.path}: {len(self.processed)} "
+            f"sessions already processed"
+        )
+
+    def save(self):
+        """Write the current progress to the state file.
+
+        The file is replaced atomically so that a run killed during a save
+        never leaves a truncated state file
+        """
+        state = {
+            "key": self.key,
+            "processed": sorted(self.processed),
+            "records": [asdict(r) for r in self.records],
+        }
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
+
+    def clear(self):
+        """Remove the state file once the run has completed"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_done(self, session_id: str) -> bool:
+        """Return True if this session was processed by a previous run"""
+        return session_id in self.processed
+
+    def mark_done(self, session_id: str, record=None):
+        """Record that a session has been processed
+
+        Args:
+            session_id: ID of the processed session
+            record: record found for this session, or None if the session
+                had nothing to report
+        """
+        self.processed.add(session_id)
+        if record is not None:
+            self.records.add(record)
+        self._unsaved += 1
+        if self._unsaved >= self.save_interval:
+            self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Keep the progress made so far if the run is interrupted
+        if exc_type is not None:
+            self.save()
@@ -0,0 +1,47 @@
+import sys
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class SessionRow:
+    """Compact copy of one row of a session search
+
+    The rows returned by pyxnat are dicts with a string for every column,
+    which take several times the memory of the values they hold. Projects
+    with hundreds of thousands of sessions are held as SessionRows instead,
+    with the values that repeat across sessions (subject IDs and dates)
+    interned so that each distinct value is stored once.
+    """
+
+    session_id: str
+    subject_id: str
+    date: str
+    label: str
+
+
+def session_rows(rows: Iterable[dict]) -> list[SessionRow]:
+    """Convert the rows of a session search into SessionRows
+
+    Args:
+        rows: search results with session_id, subject_id, date and label
+            columns
+
+    Returns:
+        list of SessionRows in the same order
+    """
+    return [
+        SessionRow(
+            session_id=row["session_id"],
+            subject_id=intern(row["subject_id"]),
+            date=intern(row["date"]),
+            label=row["label"],
+        )
+        for row in rows
+    ]
+
+
+def intern(value: str | None) -> str | None:
+    """Return the interned copy of a string, so that equal values share one
+    object. None is returned unchanged"""
+    return None if value is None else sys.intern(value)
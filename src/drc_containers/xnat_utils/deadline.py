@@ -0,0 +1,144 @@
+import time
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds kept back at the end of a time budget for sending the report
+DEFAULT_RESERVE = 30
+
+
+class DeadlineExpired(Exception):
+    """Raised when a request cannot be made because the time budget has run
+    out"""
+
+
+class Deadline:
+    """Wall-clock time budget for a run
+
+    The XNAT container service and cron scheduler kill containers which run
+    for too long. A Deadline allows long searches to stop early, leaving
+    enough time in the budget to send a partial report.
+    """
+
+    def __init__(self, seconds: float | None = None, reserve: float | None = None):
+        """
+        Args:
+            seconds: total time budget in seconds, measured from now. If None
+                there is no time limit
+            reserve: number of seconds at the end of the budget which are kept
+                back for sending the report. expired() returns True once
+                only this much time remains. If None, 30 seconds are kept
+                back, or a tenth of the budget if that is shorter, so that a
+                short budget still leaves time for the searches
+        """
+        if reserve is None:
+            reserve = DEFAULT_RESERVE
+            if seconds is not None:
+                reserve = min(reserve, seconds * 0.1)
+        self.seconds = seconds
+        self.reserve = reserve
+        self._end = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float | None:
+        """Return seconds remaining before the budget (excluding the reserve)
+        runs out, or None if there is no time limit"""
+        if self._end is None:
+            return None
+        return max(0.0, self._end - self.reserve - time.monotonic())
+
+    def use_reserve(self):
+        """Make the reserved time available, once the main work has finished
+        and the report is ready to be sent"""
+        self.reserve = 0
+
+    def expired(self) -> bool:
+        """Return True if no time remains for further work"""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def limit_timeout(self, timeout):
+        """Return a requests timeout, a number of seconds or a (connect, read)
+        tuple, limited to the time remaining"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if isinstance(timeout, tuple):
+            return tuple(min(t or remaining, remaining) for t in timeout)
+        return min(timeout or remaining, remaining)
+
+
+class DeadlineAdapter(HTTPAdapter):
+    """Requests transport adapter which limits the timeout of each request to
+    the time remaining in a Deadline, so that slow requests in flight are
+    cancelled when the budget runs out"""
+
+    def __init__(self, deadline: Deadline, **kwargs):
+        self.deadline = deadline
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if self.deadline.expired():
+            raise DeadlineExpired(f"No time remaining for {request.url}")
+        timeout = self.deadline.limit_timeout(timeout)
+        try:
+            return super().send(request, timeout=timeout, **kwargs)
+        except requests.exceptions.Timeout as ex:
+            # Only a timeout which ran into the end of the budget is a
+            # deadline error; a server which is slow within the budget is not
+            if self.deadline.expired():
+                raise DeadlineExpired(f"Deadline expired during {request.url}") from ex
+            raise
+
+
+def apply_deadline(http_session: requests.Session, deadline: Deadline):
+    """Make all requests sent by this requests Session respect the deadline
+
+    Args:
+        http_session: the requests Session used by a pyxnat or xnat session
+        deadline: time budget for the run
+    """
+    if deadline is None or deadline.seconds is None:
+        return
+    adapter = DeadlineAdapter(deadline)
+    http_session.mount("http://", adapter)
+    http_session.mount("https://", adapter)
+
+
+def is_deadline_error(ex: Exception) -> bool:
+    """Return True if this exception was caused by the time budget running
+    out. Timeouts of requests made while time remained are not deadline
+    errors, and should be raised as usual"""
+    return isinstance(ex, DeadlineExpired)
+
+
+@dataclass
+class Coverage:
+    """Record how much of the planned work was completed, so that partial
+    reports can state their coverage"""
+
+    checked: int = 0
+    total: int = 0
+    items: str = "sessions"
+
+    # Set to True if the deadline was reached before all the items to be
+    # checked had been found, so the total is an underestimate
+    truncated: bool = False
+
+    @property
+    def complete(self) -> bool:
+        return not self.truncated and self.checked >= self.total
+
+    def summary(self) -> str:
+        """Return a sentence describing the coverage, for example
+        "checked 8,210 of 9,000 sessions" """
+        at_least = "at least " if self.truncated else ""
+        return f"checked {self.checked:,} of {at_least}{self.total:,} {self.items}"
+
+    def summary_html(self) -> str:
+        """Return a warning paragraph for the email if the work is incomplete
+        (for example because the run reached its time limit), or an empty
+        string if all the work was completed"""
+        if self.complete:
+            return ""
+        return f"<p><b>This report is incomplete: {self.summary()}.</b></p>"
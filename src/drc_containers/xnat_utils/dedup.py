@@ -0,0 +1,256 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from drc_containers.xnat_utils.deadline import DeadlineAdapter, DeadlineExpired
+
+# Requests which may change what later reads return
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+@dataclass
+class DedupStats:
+    """Counts of requests handled by a RequestDeduplicator"""
+
+    requests: int = 0
+    sent: int = 0
+    shared: int = 0
+    memo_hits: int = 0
+    bytes_saved: int = 0
+
+    def summary(self) -> str:
+        saved = self.shared + self.memo_hits
+        return (
+            f"Deduplication: {self.requests} requests, {self.sent} sent, "
+            f"{saved} saved ({self.shared} shared in flight, {self.memo_hits} "
+            f"from memo, {self.bytes_saved:,} bytes)"
+        )
+
+
+@dataclass
+class _Snapshot:
+    status_code: int
+    headers: dict
+    content: bytes
+    reason: str
+    encoding: str
+
+
+class _Flight:
+    """A request in flight, which identical requests wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.snapshot: _Snapshot = None
+
+
+class RequestDeduplicator:
+    """Share the responses to identical read-only requests made by several
+    commands running in the same process
+
+    If a request is identical to one already in flight, it waits for that
+    request and receives a copy of its response instead of being sent again
+    (single-flight). Successful responses are also kept for memo_seconds, so
+    that identical requests made shortly afterwards are served from memory.
+
+    Only GET requests and searches are shared, and only between requests
+    made with the same credentials. Login requests and streamed downloads
+    are always sent. A request which may change data, such as a PUT which
+    shares a subject, clears the memo so that later reads see the change.
+
+    A request waits for an identical request in flight for no longer than
+    its own timeout, which DeadlineAdapter limits to the time left before
+    the deadline. If the first request has not finished by then, the
+    request is sent in its own right, or raises DeadlineExpired if no time
+    remains.
+
+    Like the Cassette, this works by replacing the send method of the
+    requests HTTPAdapter, so it applies to both pyxnat and xnat sessions.
+    """
+
+    def __init__(self, memo_seconds: float = 300, max_entries: int = 1000):
+        """
+        Args:
+            memo_seconds: number of seconds for which a completed response is
+                reused. Set to 0 to share only requests in flight
+            max_entries: maximum number of responses kept in the memo. The
+                least recently used responses are dropped first
+        """
+        self.memo_seconds = memo_seconds
+        self.max_entries = max_entries
+        self.stats = DedupStats()
+        self._lock = threading.Lock()
+        self._original_send = None
+        self._in_flight: dict[tuple, _Flight] = {}
+        self._memo: OrderedDict[tuple, tuple[float, _Snapshot]] = OrderedDict()
+
+    def install(self):
+        """Start deduplicating requests"""
+        if self._original_send is not None:
+            return
+        self._original_send = HTTPAdapter.send
+        deduplicator = self
+
+        def send(adapter, request, **kwargs):
+            return deduplicator._send(adapter, request, **kwargs)
+
+        HTTPAdapter.send = send
+
+    def uninstall(self):
+        """Send every request normally again"""
+        if self._original_send is not None:
+            HTTPAdapter.send = self._original_send
+            self._original_send = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    def summary(self) -> str:
+        """Return a one-line summary of the requests saved"""
+        return self.stats.summary()
+
+    def _send(self, adapter, request, **kwargs):
+        key = _request_key(request, kwargs)
+        with self._lock:
+            self.stats.requests += 1
+            if key is None:
+                self.stats.sent += 1
+                is_write = request.method in _WRITE_METHODS
+                if is_write and not _is_session_request(request):
+                    # The request may change what later reads return
+                    self._memo.clear()
+            else:
+                snapshot = self._memo_lookup(key)
+                if snapshot is not None:
+                    self.stats.memo_hits += 1
+                    self.stats.bytes_saved += len(snapshot.content)
+                    return _response(snapshot, request)
+                flight = self._in_flight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._in_flight[key] = flight
+                    self.stats.sent += 1
+        if key is None:
+            return self._original_send(adapter, request, **kwargs)
+
+        if not leader:
+            finished = flight.done.wait(_wait_seconds(kwargs.get("timeout")))
+            if finished and flight.snapshot is not None:
+                with self._lock:
+                    self.stats.shared += 1
+                    self.stats.bytes_saved += len(flight.snapshot.content)
+                return _response(flight.snapshot, request)
+            # The first request failed or is taking too long, so this one is
+            # sent in its own right with the time left after waiting
+            if isinstance(adapter, DeadlineAdapter):
+                if adapter.deadline.expired():
+                    raise DeadlineExpired(f"No time remaining for {request.url}")
+                kwargs["timeout"] = adapter.deadline.limit_timeout(
+                    kwargs.get("timeout")
+                )
+            with self._lock:
+                self.stats.sent += 1
+            return self._original_send(adapter, request, **kwargs)
+
+        snapshot = None
+        try:
+            response = self._original_send(adapter, request, **kwargs)
+            if 200 <= response.status_code < 300:
+                snapshot = _Snapshot(
+                    status_code=response.status_code,
+                    headers={
+                        k: v
+                        for k, v in response.headers.items()
+                        if k.lower() != "set-cookie"
+                    },
+                    content=response.content,
+                    reason=response.reason,
+                    encoding=response.encoding,
+                )
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if snapshot is not None and self.memo_seconds > 0:
+                    self._memo[key] = (time.monotonic() + self.memo_seconds, snapshot)
+                    self._memo.move_to_end(key)
+                    while len(self._memo) > self.max_entries:
+                        self._memo.popitem(last=False)
+            flight.snapshot = snapshot
+            flight.done.set()
+
+    def _memo_lookup(self, key: tuple) -> _Snapshot | None:
+        entry = self._memo.get(key)
+        if entry is None:
+            return None
+        expires, snapshot = entry
+        if time.monotonic() > expires:
+            del self._memo[key]
+            return None
+        self._memo.move_to_end(key)
+        return snapshot
+
+
+def _request_key(request: requests.PreparedRequest, kwargs: dict) -> tuple | None:
+    """Return the key identifying identical requests, or None if the request
+    must always be sent"""
+    if kwargs.get("stream") or _is_session_request(request):
+        return None
+    path = urlsplit(request.url).path.rstrip("/")
+    is_search = request.method == "POST" and path.endswith("/search")
+    if request.method != "GET" and not is_search:
+        return None
+    # Requests are only shared between sessions with the same credentials
+    identity = request.headers.get("Authorization") or request.headers.get("Cookie", "")
+    return (request.method, request.url, _sha256(request.body), _sha256(identity))
+
+
+def _wait_seconds(timeout) -> float | None:
+    """Return the number of seconds to wait for an identical request, from a
+    requests timeout which may be a (connect, read) tuple"""
+    if isinstance(timeout, tuple):
+        # A request with no read timeout may take any length of time
+        return None if None in timeout else max(timeout)
+    return timeout
+
+
+def _is_session_request(request: requests.PreparedRequest) -> bool:
+    return urlsplit(request.url).path.rstrip("/").endswith("/JSESSION")
+
+
+def _response(snapshot: _Snapshot, request: requests.PreparedRequest):
+    """Return a new Response with the content of a snapshot"""
+    response = requests.Response()
+    response.status_code = snapshot.status_code
+    response.headers = CaseInsensitiveDict(snapshot.headers)
+    response._content = snapshot.content
+    response.reason = snapshot.reason
+    response.encoding = snapshot.encoding
+    response.url = request.url
+    response.request = request
+    response.elapsed = timedelta(0)
+    return response
+
+
+def _sha256(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        value = value.encode()
+    if not isinstance(value, bytes):
+        # Streamed uploads cannot be hashed without consuming them
+        return repr(id(value))
+    return hashlib.sha256(value).hexdigest()
@@ -1,6 +1,9 @@
 from pyxnat import Interface
 
+from drc_containers.xnat_utils.profiling import span
 
+
+@span("send_email")
 def send_email(
     session: Interface,
     subject: str,
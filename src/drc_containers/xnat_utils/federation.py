@@ -0,0 +1,109 @@
+import html
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from drc_containers.xnat_utils.deadline import Coverage
+from drc_containers.xnat_utils.run_metrics import RunMetrics
+from drc_containers.xnat_utils.xnat_credentials import XnatCredentials
+
+
+@dataclass
+class ServerResult:
+    """Records found on one server of a federated run"""
+
+    name: str
+    credentials: XnatCredentials
+    records: set = field(default_factory=set)
+    coverage: Coverage = field(default_factory=Coverage)
+
+    # Description of the error which stopped the checks on this server, or
+    # None if they ran to completion or to the deadline
+    error: str = None
+
+    @property
+    def complete(self) -> bool:
+        return self.error is None and self.coverage.complete
+
+    def summary(self) -> str:
+        if self.error is not None:
+            return f"{self.name}: failed ({self.error})"
+        return f"{self.name}: {self.coverage.summary()}"
+
+
+def run_on_servers(
+    servers: dict[str, XnatCredentials],
+    check: Callable[[XnatCredentials, Coverage, RunMetrics], set],
+    metrics: RunMetrics = None,
+) -> list[ServerResult]:
+    """Run the same checks against several XNAT servers at once
+
+    Each server is checked in its own thread, which must open its own session
+    so that every server has a separate connection pool. An error on one
+    server is recorded in its ServerResult and does not affect the others.
+    To stop a slow server from delaying the report, check should stop at a
+    Deadline shared by all the servers.
+
+    Args:
+        servers: credentials of each server, keyed by server name
+        check: function called with the credentials of a server, a Coverage
+            to be updated and a RunMetrics for the server's requests (or None
+            if metrics is None). It returns the set of records found
+        metrics: optional RunMetrics to which the requests and bytes received
+            from all servers are added
+
+    Returns:
+        list of ServerResults in the order the servers were given
+    """
+    results = [
+        ServerResult(name=name, credentials=credentials)
+        for name, credentials in servers.items()
+    ]
+    server_metrics = [
+        RunMetrics(command=metrics.command, project=metrics.project)
+        if metrics
+        else None
+        for _ in results
+    ]
+
+    def run(index: int):
+        result = results[index]
+        try:
+            result.records = check(
+                result.credentials, result.coverage, server_metrics[index]
+            )
+        except Exception as ex:  # noqa: BLE001
+            # Any failure is reported for this server alone, so that one
+            # broken server never stops the others being reported
+            result.error = f"{type(ex).__name__}: {ex}"
+        print(result.summary())
+
+    with ThreadPoolExecutor(max_workers=max(1, len(results))) as executor:
+        list(executor.map(run, range(len(results))))
+
+    if metrics:
+        for server in server_metrics:
+            metrics.requests += server.requests
+            metrics.bytes_received += server.bytes_received
+    return results
+
+
+def merge_coverage(results: list[ServerResult]) -> Coverage:
+    """Return the combined coverage of all servers. Servers which failed
+    count as truncated, since their sessions are not known"""
+    coverage = Coverage()
+    for result in results:
+        coverage.checked += result.coverage.checked
+        coverage.total += result.coverage.total
+        coverage.truncated |= result.coverage.truncated or result.error is not None
+    return coverage
+
+
+def federated_summary_html(results: list[ServerResult]) -> str:
+    """Return a warning paragraph for the email listing the coverage of each
+    server if any server is incomplete, or an empty string if all the
+    servers were checked completely"""
+    if all(result.complete for result in results):
+        return ""
+    lines = "".join(f"<li>{html.escape(result.summary())}</li>" for result in results)
+    return f"<p><b>This report is incomplete:</b></p><ul>{lines}</ul>"
@@ -0,0 +1,268 @@
+import fcntl
+import glob
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import requests
+from pyxnat import Interface
+from pyxnat.core.errors import DatabaseError
+
+from drc_containers.xnat_utils.deadline import DeadlineExpired
+from drc_containers.xnat_utils.email import send_email
+
+
+@dataclass
+class FlushResult:
+    """Outcome of delivering the messages in an Outbox"""
+
+    sent: int = 0
+    pending: int = 0
+    failed: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"Outbox: {self.sent} sent, {self.pending} waiting to be retried, "
+            f"{self.failed} given up"
+        )
+
+
+class Outbox:
+    """A local spool of rendered emails waiting to be sent through XNAT
+
+    Each message is written to its own JSON file before it is sent, so that
+    the results of a long scan are never lost if the XNAT mail service is
+    unavailable. Messages which cannot be sent are retried with exponential
+    backoff, by the same run and by later runs which flush the outbox.
+    Messages which still fail after max_attempts are moved to the "failed"
+    subdirectory for inspection.
+
+    A lock file ensures that messages are not sent twice when several
+    commands flush the same outbox at once.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_attempts: int = 10,
+        base_delay: float = 60,
+        max_delay: float = 6 * 3600,
+    ):
+        """
+        Args:
+            directory: local directory in which messages are stored
+            max_attempts: number of failed attempts after which a message is
+                given up
+            base_delay: delay in seconds before the first retry. The delay
+                doubles after each failed attempt
+            max_delay: maximum delay in seconds between retries
+        """
+        self.directory = directory
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        os.makedirs(os.path.join(directory, "failed"), exist_ok=True)
+
+    def enqueue(
+        self,
+        host: str,
+        subject: str,
+        content_html: str,
+        to: list[str],
+        cc: list[str] | None = None,
+        bcc: list[str] | None = None,
+    ) -> str:
+        """Store a message in the outbox
+
+        Args:
+            host: XNAT server through which the message is sent
+            subject: email subject
+            content_html: string containing HTML email body text
+            to: list of email addresses
+            cc: list of email addresses for cc
+            bcc: list of email addresses for bcc
+
+        Returns:
+            path of the stored message
+        """
+        created = datetime.now(timezone.utc)
+        message = {
+            "host": host,
+            "created": created.isoformat(),
+            "subject": subject,
+            "html": content_html,
+            "to": to,
+            "cc": cc,
+            "bcc": bcc,
+            "attempts": 0,
+            "next_attempt": 0.0,
+            "last_error": None,
+        }
+        # File names sort in the order the messages were created
+        name = f"{created.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}.json"
+        path = os.path.join(self.directory, name)
+        self._write(path, message)
+        return path
+
+    def flush(
+        self,
+        session: Interface,
+        host: str,
+        retries: int = 0,
+        retry_delay: float = 5,
+        ignore_schedule: bool = False,
+        debug_output: bool = False,
+    ) -> FlushResult:
+        """Send the messages in the outbox which are due to be sent
+
+        Args:
+            session: pyXnat session used to send the messages
+            host: XNAT server of the session. Messages stored for other
+                servers are left in the outbox
+            retries: number of further attempts made by this call for
+                messages which fail, before leaving them for a later run
+            retry_delay: delay in seconds before the first of these retries,
+                doubling for each further retry
+            ignore_schedule: set to True to send all messages now, even if
+                their next retry is not yet due
+            debug_output: set to True to output the email text of each
+                message to the console
+
+        Returns:
+            FlushResult counting the messages sent, pending and given up
+        """
+        result = FlushResult()
+        with self._lock():
+            paths = sorted(glob.glob(os.path.join(self.directory, "*.json")))
+            for path in paths:
+                with open(path) as f:
+                    message = json.load(f)
+                if message["host"] != host:
+                    continue
+                if not ignore_schedule and message["next_attempt"] > time.time():
+                    result.pending += 1
+                    continue
+                for attempt in range(retries + 1):
+                    if attempt > 0:
+                        time.sleep(retry_delay * 2 ** (attempt - 1))
+                    if self._try_send(session, path, message, debug_output):
+                        break
+                if not os.path.exists(path):
+                    result.sent += 1
+                elif message["attempts"] >= self.max_attempts:
+                    failed_path = os.path.join(
+                        self.directory, "failed", os.path.basename(path)
+                    )
+                    os.replace(path, failed_path)
+                    print(f"Giving up on message {failed_path}")
+                    result.failed += 1
+                else:
+                    result.pending += 1
+        print(result.summary())
+        return result
+
+    def _try_send(
+        self, session: Interface, path: str, message: dict, debug_output: bool
+    ) -> bool:
+        try:
+            send_email(
+                session=session,
+                subject=message["subject"],
+                content_html=message["html"],
+                to=message["to"],
+                cc=message["cc"],
+                bcc=message["bcc"],
+                debug_output=debug_output,
+            )
+        except (
+            DatabaseError,
+            DeadlineExpired,
+            requests.exceptions.RequestException,
+        ) as ex:
+            message["attempts"] += 1
+            message["last_error"] = str(ex)
+            delay = min(
+                self.max_delay, self.base_delay * 2 ** (message["attempts"] - 1)
+            )
+            message["next_attempt"] = time.time() + delay
+            self._write(path, message)
+            print(
+                f"Failed to send message {path} (attempt {message['attempts']}): {ex}"
+            )
+            return False
+        os.remove(path)
+        print(f"Sent message {path}: {message['subject']}")
+        return True
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write(path: str, message: dict):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(message, f)
+        os.replace(temp_path, path)
+
+
+def send_or_queue_email(
+    session: Interface,
+    host: str,
+    subject: str,
+    content_html: str,
+    to: list[str],
+    cc: list[str] | None = None,
+    bcc: list[str] | None = None,
+    debug_output: bool = True,
+    outbox_dir: str | None = None,
+):
+    """Send an email through XNAT, storing it in an outbox first if one is
+    configured
+
+    With an outbox, the message is stored before it is sent and, if the mail
+    service is unavailable, retried a few times before being left in the
+    outbox for a later run. Any earlier messages still waiting in the outbox
+    are sent first. Without an outbox, the email is sent once and any error
+    is raised.
+
+    Args:
+        session: pyXnat session
+        host: XNAT server of the session
+        subject: email subject
+        content_html: string containing HTML email body text
+        to: list of email addresses
+        cc: list of email addresses for cc
+        bcc: list of email addresses for bcc
+        debug_output: set to True to output the email text to the console
+        outbox_dir: outbox directory. If None, the DRC_OUTBOX environment
+            variable is used. If neither is set the email is sent directly
+    """
+    outbox_dir = outbox_dir or os.getenv("DRC_OUTBOX")
+    if not outbox_dir:
+        send_email(
+            session=session,
+            subject=subject,
+            content_html=content_html,
+            to=to,
+            cc=cc,
+            bcc=bcc,
+            debug_output=debug_output,
+        )
+        return
+
+    outbox = Outbox(outbox_dir)
+    path = outbox.enqueue(
+        host=host, subject=subject, content_html=content_html, to=to, cc=cc, bcc=bcc
+    )
+    print(f"Stored email in outbox {path}")
+    outbox.flush(session=session, host=host, retries=2, debug_output=debug_output)
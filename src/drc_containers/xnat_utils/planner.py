@@ -0,0 +1,102 @@
+from dataclasses import dataclass, field
+
+# Strategies for fetching the details of many sessions
+PER_ITEM = "per-item"
+BULK = "bulk"
+
+# Rough cost of a request to XNAT, and the rate at which a response is
+# received, used to compare strategies which make different numbers of
+# requests of different sizes
+REQUEST_SECONDS = 0.05
+BYTES_PER_SECOND = 5_000_000
+
+
+@dataclass
+class StrategyCost:
+    """Estimated cost of fetching the data for a phase with one strategy"""
+
+    strategy: str
+    requests: int
+    bytes: int
+
+    @property
+    def seconds(self) -> float:
+        return self.requests * REQUEST_SECONDS + self.bytes / BYTES_PER_SECOND
+
+    def summary(self) -> str:
+        return (
+            f"{self.strategy} ~{self.requests:,} requests, ~{self.bytes:,} bytes, "
+            f"~{self.seconds:.1f}s"
+        )
+
+
+@dataclass
+class PlanStep:
+    """The strategy chosen for one phase of a run"""
+
+    phase: str
+    items: int
+    chosen: StrategyCost
+    rejected: list[StrategyCost]
+
+
+@dataclass
+class QueryPlan:
+    """Choose between fetching the details of each session with its own
+    requests, or with one listing for the whole project
+
+    Which is cheaper depends on how many sessions need to be checked: a few
+    recent sessions are best fetched one by one, while checking most of a
+    large project is far quicker with a single listing. The commands give
+    the plan a cardinality estimate and the cost of each strategy for each
+    phase, and the plan chooses the strategy with the lowest estimated time.
+    """
+
+    steps: list[PlanStep] = field(default_factory=list)
+    estimate_requests: int = 0
+
+    def choose(self, phase: str, items: int, options: list[StrategyCost]) -> str:
+        """Choose the cheapest strategy for a phase
+
+        Args:
+            phase: name of the phase, for example "xnat:mrSessionData scans"
+            items: number of sessions to be checked in this phase
+            options: estimated cost of each strategy
+
+        Returns:
+            name of the chosen strategy
+        """
+        ranked = sorted(options, key=lambda option: option.seconds)
+        self.steps.append(
+            PlanStep(phase=phase, items=items, chosen=ranked[0], rejected=ranked[1:])
+        )
+        return ranked[0].strategy
+
+    def strategy(self, phase: str) -> str | None:
+        """Return the strategy chosen for a phase, or None if the phase has
+        not been planned"""
+        for step in self.steps:
+            if step.phase == phase:
+                return step.chosen.strategy
+        return None
+
+    def explain(self) -> str:
+        """Return a description of the plan, with the estimated requests,
+        bytes and time of the chosen and rejected strategies"""
+        lines = [
+            (
+                f"Plan: {len(self.steps)} phases, {self.estimate_requests} "
+                f"requests made to estimate sizes"
+            )
+        ]
+        requests = 0
+        num_bytes = 0
+        for step in self.steps:
+            lines.append(f"  {step.phase}: {step.items:,} sessions")
+            lines.append(f"    chosen:   {step.chosen.summary()}")
+            for option in step.rejected:
+                lines.append(f"    rejected: {option.summary()}")
+            requests += step.chosen.requests
+            num_bytes += step.chosen.bytes
+        lines.append(f"Estimated total: ~{requests:,} requests, ~{num_bytes:,} bytes")
+        return "\n".join(lines)
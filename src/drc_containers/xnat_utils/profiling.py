@@ -0,0 +1,218 @@
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass
+class SpanStats:
+    """Accumulated timings for all spans with the same call stack"""
+
+    calls: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    child_wall_seconds: float = 0.0
+    peak_memory_bytes: int = 0
+
+
+class Profiler:
+    """Collect timings for named spans covering the phases of a command
+
+    Spans may be nested. Timings are accumulated for each distinct stack of
+    span names, and can be written in the "folded stack" format used by flame
+    graph tools such as flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, name: str, trace_memory: bool = False):
+        """
+        Args:
+            name: name of the root span, usually the command name
+            trace_memory: set to True to record peak memory use of each span
+                with tracemalloc. This slows down the command considerably
+        """
+        self.name = name
+        self.trace_memory = trace_memory
+        self.stats: dict[tuple[str, ...], SpanStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, name: str):
+        stack = self._stack()
+        if self.trace_memory:
+            # Fold the peak so far into the parent span, then measure this
+            # span's peak from its own starting point
+            _, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+        parent_names = stack[-1]["names"] if stack else ()
+        stack.append(
+            {
+                "names": parent_names + (name,),
+                "wall": time.perf_counter(),
+                "cpu": time.thread_time(),
+                "children": 0.0,
+                "peak": 0,
+            }
+        )
+
+    def exit(self):
+        stack = self._stack()
+        frame = stack.pop()
+        wall = time.perf_counter() - frame["wall"]
+        cpu = time.thread_time() - frame["cpu"]
+        peak = frame["peak"]
+        if self.trace_memory:
+            _, current_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, current_peak)
+            tracemalloc.reset_peak()
+        if stack:
+            stack[-1]["children"] += wall
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+
+        with self._lock:
+            stats = self.stats.setdefault(frame["names"], SpanStats())
+            stats.calls += 1
+            stats.wall_seconds += wall
+            stats.cpu_seconds += cpu
+            stats.child_wall_seconds += frame["children"]
+            stats.peak_memory_bytes = max(stats.peak_memory_bytes, peak)
+
+    def folded_stacks(self) -> list[str]:
+        """Return lines in folded stack format, "root;child;grandchild N",
+        where N is the self time of the innermost span in microseconds"""
+        lines = []
+        for names, stats in sorted(self.stats.items()):
+            self_time = stats.wall_seconds - stats.child_wall_seconds
+            lines.append(f"{';'.join(names)} {max(0, round(self_time * 1e6))}")
+        return lines
+
+    def summary(self) -> str:
+        """Return a one-line summary of the time spent in each span"""
+        totals: dict[str, SpanStats] = {}
+        for names, stats in self.stats.items():
+            total = totals.setdefault(names[-1], SpanStats())
+            total.calls += stats.calls
+            total.wall_seconds += stats.wall_seconds
+            total.cpu_seconds += stats.cpu_seconds
+            total.peak_memory_bytes = max(
+                total.peak_memory_bytes, stats.peak_memory_bytes
+            )
+
+        parts = []
+        for name, total in totals.items():
+            part = (
+                f"{name} {total.calls}x {total.wall_seconds:.2f}s "
+                f"(cpu {total.cpu_seconds:.2f}s"
+            )
+            if self.trace_memory:
+                part += f", peak {total.peak_memory_bytes / 1e6:.1f}MB"
+            parts.append(part + ")")
+        return f"Profile {self.name}: " + "; ".join(parts)
+
+
+_active_profiler: Profiler | None = None
+
+
+@contextmanager
+def span(name: str):
+    """Time a phase of a command. Can be used as a context manager or as a
+    function decorator:
+
+        with span("construct_email"):
+            ...
+
+        @span("check_session")
+        def check_session(...):
+
+    Spans have negligible cost when profiling is not enabled.
+    """
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit()
+
+
+@contextmanager
+def profile_run(
+    command: str,
+    output_path: str | None = None,
+    cprofile: bool = False,
+    trace_memory: bool = False,
+):
+    """Enable profiling for the duration of a command.
+
+    Profiling can also be enabled with environment variables, which is
+    convenient when running in the XNAT container service:
+        DRC_PROFILE: equivalent to output_path
+        DRC_PROFILE_CPROFILE: set to 1 for cprofile=True
+        DRC_PROFILE_MEMORY: set to 1 for trace_memory=True
+
+    When enabled, a one-line summary is printed to the container log and the
+    following files are written:
+        <output_path>.folded: span timings in folded stack format, which can
+            be rendered as a flame graph
+        <output_path>.prof: cProfile statistics, if cprofile is True
+
+    Args:
+        command: name of the command being profiled
+        output_path: path prefix for the output files. If None and the
+            DRC_PROFILE environment variable is not set, profiling is disabled
+        cprofile: set to True to also capture function-level statistics
+            with cProfile
+        trace_memory: set to True to report peak memory use for each span
+    """
+    global _active_profiler
+
+    output_path = output_path or os.getenv("DRC_PROFILE")
+    if not output_path:
+        yield None
+        return
+    cprofile = cprofile or _env_flag("DRC_PROFILE_CPROFILE")
+    trace_memory = trace_memory or _env_flag("DRC_PROFILE_MEMORY")
+
+    profiler = Profiler(name=command, trace_memory=trace_memory)
+    c_profiler = cProfile.Profile() if cprofile else None
+    if trace_memory:
+        tracemalloc.start()
+    if c_profiler:
+        c_profiler.enable()
+    _active_profiler = profiler
+    try:
+        with span(command):
+            yield profiler
+    finally:
+        _active_profiler = None
+        if c_profiler:
+            c_profiler.disable()
+            c_profiler.dump_stats(output_path + ".prof")
+        if trace_memory:
+            tracemalloc.stop()
+        with open(output_path + ".folded", "w") as f:
+            f.write("\n".join(profiler.folded_stacks()) + "\n")
+        print(profiler.summary())
+
+
+def add_profiling_arguments(parser: ArgumentParser):
+    """Add the optional --profile arguments to a command-line parser"""
+    parser.add_argument("--profile", default=None, metavar="PATH")
+    parser.add_argument("--profile-cprofile", action="store_true")
+    parser.add_argument("--profile-memory", action="store_true")
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, default="").lower() in ["y", "yes", "true", "t", "1"]
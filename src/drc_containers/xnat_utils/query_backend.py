@@ -0,0 +1,446 @@
+import sqlite3
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+from pyxnat import Interface
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+
+class QueryBackend(ABC):
+    """Runs the searches made by the reporting commands
+
+    Searches are given in the same form as pyxnat's
+    interface.select(root_element, columns).where(constraints), and return
+    the rows as dicts with the same keys as pyxnat's search results, so that
+    the commands work unchanged whichever backend is used.
+    """
+
+    @abstractmethod
+    def search(
+        self, root_element: str, columns: list[str], constraints: list
+    ) -> list[dict]:
+        """Run a search
+
+        Args:
+            root_element: datatype returned by the search, for example
+                xnat:mrSessionData
+            columns: columns to return
+            constraints: constraints in pyxnat format
+
+        Returns:
+            list of dicts, one for each row
+        """
+
+    def count_sessions(self, datatype: str, project_name: str) -> int:
+        """Return the number of sessions of a datatype in a project,
+        including sessions shared into the project
+
+        Backends override this with a cheaper query than the search used
+        here, which returns a row for every session.
+
+        Args:
+            datatype: datatype of the sessions, for example xnat:petSessionData
+            project_name: project containing the sessions
+        """
+        return len(
+            self.search(
+                datatype,
+                [datatype + "/SESSION_ID"],
+                [(datatype + "/project", "=", project_name), "AND"],
+            )
+        )
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RestQueryBackend(QueryBackend):
+    """Runs searches through the XNAT REST search API"""
+
+    def __init__(self, pyxnat_interface: Interface):
+        """
+        Args:
+            pyxnat_interface: open pyxnat session
+        """
+        self.pyxnat_interface = pyxnat_interface
+
+    def search(
+        self, root_element: str, columns: list[str], constraints: list
+    ) -> list[dict]:
+        return (
+            self.pyxnat_interface.select(root_element, columns).where(constraints).data
+        )
+
+    def count_sessions(self, datatype: str, project_name: str) -> int:
+        # The project's experiment listing, with only the ID column, is far
+        # lighter for XNAT than a search
+        response = self.pyxnat_interface.get(
+            f"/data/projects/{quote(project_name, safe='')}/experiments",
+            params={"xsiType": datatype, "columns": "ID", "format": "json"},
+        )
+        response.raise_for_status()
+        return len(response.json()["ResultSet"]["Result"])
+
+
+# Columns of the XNAT tables which the searches use, keyed by the lower case
+# search field name. Columns of the root element use the aliases in the FROM
+# clauses below
+_SESSION_FIELDS = {
+    "id": "e.id",
+    "session_id": "e.id",
+    "label": "e.label",
+    "date": "e.date",
+    "project": "e.project",
+    "subject_id": "sa.subject_id",
+    "subject_label": "s.label",
+    "meta/insert_date": "m.insert_date",
+}
+_SUBJECT_FIELDS = {
+    "id": "s.id",
+    "subject_id": "s.id",
+    "label": "s.label",
+    "subject_label": "s.label",
+    "project": "s.project",
+}
+_RADREAD_FIELDS = {
+    "id": "e.id",
+    "label": "e.label",
+    "date": "e.date",
+    "project": "e.project",
+    "imagesession_id": "r.imagesession_id",
+}
+_WORKFLOW_FIELDS = {
+    "id": "w.id",
+    "externalid": "w.externalid",
+    "data_type": "w.data_type",
+    "launch_time": "w.launch_time",
+}
+
+_SESSION_FROM = (
+    "xnat_experimentdata e "
+    "JOIN xdat_meta_element x ON x.xdat_meta_element_id = e.extension "
+    "JOIN xnat_subjectassessordata sa ON sa.id = e.id "
+    "JOIN xnat_subjectdata s ON s.id = sa.subject_id "
+    "LEFT JOIN xnat_experimentdata_meta_data m "
+    "ON m.meta_data_id = e.experimentdata_info"
+)
+_SUBJECT_FROM = "xnat_subjectdata s"
+_RADREAD_FROM = "xnat_experimentdata e JOIN nshdni_radread r ON r.id = e.id"
+_WORKFLOW_FROM = "wrk_workflowdata w"
+
+# Experiments shared into a project are included in searches of the project,
+# as they are by the REST search
+_EXPERIMENT_IN_PROJECT = (
+    "({column} = ? OR EXISTS (SELECT 1 FROM xnat_experimentdata_share sh "
+    "WHERE sh.sharing_share_xnat_experimentda_id = {id} AND sh.project = ?))"
+)
+_SUBJECT_IN_PROJECT = (
+    "({column} = ? OR EXISTS (SELECT 1 FROM xnat_projectparticipant pp "
+    "WHERE pp.subject_id = s.id AND pp.project = ?))"
+)
+
+_OPERATORS = {"=", "!=", "<>", "<", "<=", ">", ">=", "LIKE"}
+
+# Minimal definitions of the XNAT tables read by SqlQueryBackend, for
+# loading a local SQLite or PostgreSQL fixture. The real tables have many
+# more columns
+REPORTING_TABLES = [
+    (
+        "CREATE TABLE xdat_meta_element ("
+        "xdat_meta_element_id INTEGER PRIMARY KEY, element_name VARCHAR(250))"
+    ),
+    (
+        "CREATE TABLE xnat_experimentdata_meta_data ("
+        "meta_data_id INTEGER PRIMARY KEY, insert_date TIMESTAMP)"
+    ),
+    (
+        "CREATE TABLE xnat_experimentdata ("
+        "id VARCHAR(255) PRIMARY KEY, label VARCHAR(255), date DATE, "
+        "project VARCHAR(255), extension INTEGER, experimentdata_info INTEGER)"
+    ),
+    (
+        "CREATE TABLE xnat_experimentdata_share ("
+        "sharing_share_xnat_experimentda_id VARCHAR(255), project VARCHAR(255), "
+        "label VARCHAR(255))"
+    ),
+    (
+        "CREATE TABLE xnat_subjectdata ("
+        "id VARCHAR(255) PRIMARY KEY, label VARCHAR(255), project VARCHAR(255))"
+    ),
+    (
+        "CREATE TABLE xnat_projectparticipant ("
+        "subject_id VARCHAR(255), project VARCHAR(255), label VARCHAR(255))"
+    ),
+    (
+        "CREATE TABLE xnat_subjectassessordata ("
+        "id VARCHAR(255) PRIMARY KEY, subject_id VARCHAR(255))"
+    ),
+    (
+        "CREATE TABLE nshdni_radread ("
+        "id VARCHAR(255) PRIMARY KEY, imagesession_id VARCHAR(255))"
+    ),
+    (
+        "CREATE TABLE wrk_workflowdata ("
+        "wrk_workflowdata_id INTEGER PRIMARY KEY, id VARCHAR(255), "
+        "externalid VARCHAR(255), data_type VARCHAR(255), launch_time TIMESTAMP)"
+    ),
+]
+
+
+class SqlQueryBackend(QueryBackend):
+    """Runs searches as SQL queries on a read-only replica of the XNAT
+    PostgreSQL database, without loading the XNAT application server
+
+    Supports the searches made by the reporting commands: sessions of any
+    image session datatype, subjects, radiological reads and workflow
+    entries, with constraints on their ID, label, date, project, subject and
+    insert date, or the project and launch time of a workflow entry.
+    Subjects can also be constrained by the project of their sessions, as in
+    a search for subjects with MR sessions in any of several projects. As in
+    the REST search, a project constraint includes experiments and subjects
+    shared into the project, but the rows give their original labels.
+
+    Any DB-API connection to PostgreSQL or SQLite may be used, so the
+    backend can be tested against a local fixture containing the tables in
+    REPORTING_TABLES.
+    """
+
+    def __init__(self, connection, paramstyle: str | None = None):
+        """
+        Args:
+            connection: DB-API connection to the XNAT database
+            paramstyle: DB-API parameter style of the connection, "qmark" or
+                "format". If None, "qmark" is used for sqlite3 connections
+                and "format" otherwise
+        """
+        self.connection = connection
+        if paramstyle is None:
+            paramstyle = (
+                "qmark" if isinstance(connection, sqlite3.Connection) else "format"
+            )
+        self.paramstyle = paramstyle
+
+    def close(self):
+        self.connection.close()
+
+    def search(
+        self, root_element: str, columns: list[str], constraints: list
+    ) -> list[dict]:
+        sql, params, keys = self.build_query(root_element, columns, constraints)
+        rows = self._execute(sql, params)
+        return [
+            {
+                key: None if value is None else str(value)
+                for key, value in zip(keys, row)
+            }
+            for row in rows
+        ]
+
+    def count_sessions(self, datatype: str, project_name: str) -> int:
+        sql, params, _ = self.build_query(
+            datatype,
+            [datatype + "/SESSION_ID"],
+            [(datatype + "/project", "=", project_name), "AND"],
+        )
+        rows = self._execute(f"SELECT COUNT(*) FROM ({sql}) sessions", params)
+        return int(rows[0][0])
+
+    def _execute(self, sql: str, params: list) -> list[tuple]:
+        if self.paramstyle != "qmark":
+            sql = sql.replace("?", "%s")
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def build_query(
+        self, root_element: str, columns: list[str], constraints: list
+    ) -> tuple[str, list, list[str]]:
+        """Translate a search into SQL
+
+        Returns:
+            the SQL with ? placeholders, the parameter values, and the keys
+            of the returned columns
+        """
+        fields, from_clause = _root_tables(root_element)
+        select = []
+        keys = []
+        for column in columns:
+            element, field = _split_column(column)
+            if element != root_element.lower():
+                raise ValueError(f"Column {column} is not in {root_element}")
+            select.append(_field_sql(fields, column, field))
+            keys.append(_result_key(element, field))
+
+        where = []
+        params = []
+        if fields is _SESSION_FIELDS:
+            where.append("x.element_name = ?")
+            params.append(root_element)
+        if constraints:
+            condition, condition_params = self._condition(
+                root_element, fields, constraints
+            )
+            where.append(condition)
+            params.extend(condition_params)
+
+        sql = f"SELECT {', '.join(select)} FROM {from_clause}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return sql, params, keys
+
+    def _condition(
+        self, root_element: str, fields: dict, constraints: list
+    ) -> tuple[str, list]:
+        operator = "AND"
+        items = list(constraints)
+        if items and isinstance(items[-1], str):
+            operator = items.pop().upper()
+            if operator not in ["AND", "OR"]:
+                raise ValueError(f"Unsupported operator {operator}")
+        parts = []
+        params = []
+        for item in items:
+            if isinstance(item, list):
+                part, part_params = self._condition(root_element, fields, item)
+            else:
+                part, part_params = _constraint_sql(root_element, fields, *item)
+            parts.append(part)
+            params.extend(part_params)
+        return "(" + f" {operator} ".join(parts) + ")", params
+
+
+def open_query_backend(dsn: str) -> SqlQueryBackend:
+    """Open a read-only connection to an XNAT database
+
+    Args:
+        dsn: "sqlite:///path/to/file.db" for a local SQLite fixture, or a
+            PostgreSQL connection string such as
+            "postgresql://user@replica.example.org/xnat". PostgreSQL requires
+            the optional psycopg dependency:
+                pip install "drc-containers[sql]"
+    """
+    if dsn.startswith("sqlite:///"):
+        path = dsn.removeprefix("sqlite:///")
+        return SqlQueryBackend(sqlite3.connect(f"file:{path}?mode=ro", uri=True))
+    if psycopg is None:
+        raise ImportError(
+            "The SQL query backend requires psycopg. "
+            'Install it with: pip install "drc-containers[sql]"'
+        )
+    connection = psycopg.connect(dsn, autocommit=True)
+    connection.execute("SET default_transaction_read_only = on")
+    return SqlQueryBackend(connection, paramstyle="format")
+
+
+def _root_tables(root_element: str) -> tuple[dict, str]:
+    kind = _element_kind(root_element)
+    if kind == "session":
+        return _SESSION_FIELDS, _SESSION_FROM
+    if kind == "subject":
+        return _SUBJECT_FIELDS, _SUBJECT_FROM
+    if kind == "workflow":
+        return _WORKFLOW_FIELDS, _WORKFLOW_FROM
+    return _RADREAD_FIELDS, _RADREAD_FROM
+
+
+def _element_kind(element: str) -> str:
+    element = element.lower()
+    if element == "xnat:subjectdata":
+        return "subject"
+    if element == "nshdni:radread":
+        return "radread"
+    if element == "wrk:workflowdata":
+        return "workflow"
+    if element.endswith("sessiondata"):
+        return "session"
+    raise ValueError(f"Datatype {element} is not supported by the SQL backend")
+
+
+def _split_column(column: str) -> tuple[str, str]:
+    element, _, field = column.partition("/")
+    return element.lower(), field.lower()
+
+
+def _field_sql(fields: dict, column: str, field: str) -> str:
+    if field not in fields:
+        raise ValueError(f"Field {column} is not supported by the SQL backend")
+    return fields[field]
+
+
+def _result_key(element: str, field: str) -> str:
+    """Return the key used for a column in the REST search results"""
+    if element.startswith(("xnat:", "wrk:")):
+        return field
+    # Fields of other datatypes are returned with the element name as a
+    # prefix, for example nshdni_col_radreadimagesession_id
+    prefix, _, name = element.partition(":")
+    return f"{prefix}_col_{name}{field.replace('/', '')}"
+
+
+def _constraint_sql(
+    root_element: str, fields: dict, column: str, operator: str, value
+) -> tuple[str, list]:
+    operator = operator.upper()
+    if operator not in _OPERATORS:
+        raise ValueError(f"Unsupported operator {operator}")
+    element, field = _split_column(column)
+    if element != root_element.lower():
+        return _related_session_sql(root_element, column, operator, value)
+
+    sql_column = _field_sql(fields, column, field)
+    if field == "project" and operator == "=":
+        if fields is _SUBJECT_FIELDS:
+            return _SUBJECT_IN_PROJECT.format(column=sql_column), [value, value]
+        return _EXPERIMENT_IN_PROJECT.format(column=sql_column, id="e.id"), [
+            value,
+            value,
+        ]
+    return _comparison(sql_column, operator), [value]
+
+
+def _related_session_sql(
+    root_element: str, column: str, operator: str, value
+) -> tuple[str, list]:
+    """Translate a constraint on the sessions of a subject, in a search for
+    subjects"""
+    element, field = _split_column(column)
+    if _element_kind(root_element) != "subject" or _element_kind(element) != "session":
+        raise ValueError(
+            f"Constraint on {column} is not supported in a search for {root_element}"
+        )
+    related_fields = {"id": "e2.id", "label": "e2.label", "date": "e2.date"}
+    if field == "project" and operator == "=":
+        condition = _EXPERIMENT_IN_PROJECT.format(column="e2.project", id="e2.id")
+        params = [value, value]
+    elif field in related_fields or field == "project":
+        condition = _comparison(related_fields.get(field, "e2.project"), operator)
+        params = [value]
+    else:
+        raise ValueError(f"Field {column} is not supported by the SQL backend")
+    sql = (
+        "s.id IN (SELECT sa2.subject_id FROM xnat_subjectassessordata sa2 "
+        "JOIN xnat_experimentdata e2 ON e2.id = sa2.id "
+        "JOIN xdat_meta_element x2 ON x2.xdat_meta_element_id = e2.extension "
+        f"WHERE x2.element_name = ? AND {condition})"
+    )
+    return sql, [column.partition("/")[0]] + params
+
+
+def _comparison(sql_column: str, operator: str) -> str:
+    if operator == "LIKE":
+        # Patterns escape _ and % with a backslash, as in the REST search
+        return f"{sql_column} LIKE ? ESCAPE '\\'"
+    return f"{sql_column} {operator} ?"
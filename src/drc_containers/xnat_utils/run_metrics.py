@@ -0,0 +1,214 @@
+import json
+import os
+import statistics
+import threading
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime, timezone
+
+import requests
+
+
+@dataclass
+class RunMetrics:
+    """Structured metrics describing one run of a command"""
+
+    command: str
+    project: str
+    started: str = ""
+    duration_seconds: float = 0.0
+    sessions_scanned: int = 0
+    requests: int = 0
+    bytes_received: int = 0
+    issues_found: int = 0
+    email_bytes: int = 0
+    complete: bool = True
+    status: str = "ok"
+
+
+# Numeric RunMetrics fields exported as OpenMetrics gauges, with their help text
+_EXPORTED_METRICS = {
+    "duration_seconds": "Wall-clock duration of the run",
+    "sessions_scanned": "Number of sessions checked by the run",
+    "requests": "Number of HTTP requests sent to XNAT",
+    "bytes_received": "Number of bytes received from XNAT",
+    "issues_found": "Number of issues reported in the email",
+    "email_bytes": "Size of the email body",
+    "complete": "1 if the run checked all sessions before its deadline",
+}
+
+
+def track_requests(http_session: requests.Session, metrics: RunMetrics):
+    """Count the requests sent and bytes received by this requests Session,
+    adding them to the metrics
+
+    Args:
+        http_session: the requests Session used by a pyxnat or xnat session
+        metrics: RunMetrics to be updated after each response
+    """
+    lock = threading.Lock()
+
+    def count_response(response, *args, **kwargs):
+        if kwargs.get("stream"):
+            # Reading the content would consume a streamed download
+            size = int(response.headers.get("Content-Length", 0))
+        else:
+            size = len(response.content)
+        with lock:
+            metrics.requests += 1
+            metrics.bytes_received += size
+
+    http_session.hooks["response"].append(count_response)
+
+
+def read_history(history_path: str) -> list[RunMetrics]:
+    """Read all runs from a metrics history file
+
+    Args:
+        history_path: JSON lines file written by record_run
+
+    Returns:
+        list of RunMetrics in the order the runs were recorded
+    """
+    if not os.path.exists(history_path):
+        return []
+    names = {f.name for f in fields(RunMetrics)}
+    runs = []
+    with open(history_path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                runs.append(RunMetrics(**{k: entry[k] for k in entry if k in names}))
+    return runs
+
+
+def append_history(history_path: str, metrics: RunMetrics):
+    """Append the metrics for one run to a JSON lines history file"""
+    with open(history_path, "a") as f:
+        f.write(json.dumps(asdict(metrics)) + "\n")
+
+
+def write_openmetrics(textfile_path: str, metrics: RunMetrics):
+    """Write the metrics for a run in the OpenMetrics text format, for
+    collection by the node_exporter textfile collector
+
+    The file is replaced atomically so that the collector never reads a
+    partially written file.
+
+    Args:
+        textfile_path: output file. The node_exporter textfile collector only
+            reads files with a .prom extension
+        metrics: metrics for the run
+    """
+    labels = (
+        f'command="{_escape_label(metrics.command)}",'
+        f'project="{_escape_label(metrics.project)}"'
+    )
+    lines = []
+    for name, help_text in _EXPORTED_METRICS.items():
+        metric_name = f"drc_run_{name}"
+        lines.append(f"# HELP {metric_name} {help_text}")
+        lines.append(f"# TYPE {metric_name} gauge")
+        lines.append(f"{metric_name}{{{labels}}} {float(getattr(metrics, name))}")
+
+    started = datetime.fromisoformat(metrics.started).timestamp()
+    lines.append("# HELP drc_run_started_timestamp_seconds Start time of the run")
+    lines.append("# TYPE drc_run_started_timestamp_seconds gauge")
+    lines.append(f"drc_run_started_timestamp_seconds{{{labels}}} {started}")
+    lines.append("# EOF")
+
+    temp_path = textfile_path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, textfile_path)
+
+
+@contextmanager
+def record_run(
+    metrics: RunMetrics,
+    history_path: str | None = None,
+    textfile_path: str | None = None,
+):
+    """Time a run and save its metrics when it finishes
+
+    The history and textfile locations can also be set with the environment
+    variables DRC_METRICS_HISTORY and DRC_METRICS_TEXTFILE. If neither is set,
+    no metrics are saved.
+
+    Args:
+        metrics: RunMetrics to be filled in by the run
+        history_path: JSON lines file to which the metrics are appended
+        textfile_path: file to which the metrics are written in OpenMetrics
+            format
+    """
+    history_path = history_path or os.getenv("DRC_METRICS_HISTORY")
+    textfile_path = textfile_path or os.getenv("DRC_METRICS_TEXTFILE")
+
+    metrics.started = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except BaseException:
+        metrics.status = "error"
+        raise
+    finally:
+        metrics.duration_seconds = time.perf_counter() - start
+        if history_path:
+            append_history(history_path, metrics)
+        if textfile_path:
+            write_openmetrics(textfile_path, metrics)
+
+
+def add_metrics_arguments(parser: ArgumentParser):
+    """Add the optional run metrics arguments to a command-line parser"""
+    parser.add_argument("--metrics-history", default=None, metavar="PATH")
+    parser.add_argument("--metrics-textfile", default=None, metavar="PATH")
+
+
+def find_regressions(
+    runs: list[RunMetrics],
+    window: int = 8,
+    min_runs: int = 3,
+    ratio: float = 1.5,
+) -> list[tuple[RunMetrics, float]]:
+    """Find runs which were significantly slower than the rolling baseline of
+    previous successful runs of the same command on the same project
+
+    The baseline is the median duration of up to `window` previous runs. A run
+    is flagged if its duration exceeds the baseline by the given ratio and by
+    more than three times the median absolute deviation of the baseline runs,
+    so that commands with naturally variable run times are not flagged.
+
+    Args:
+        runs: runs in the order they were recorded
+        window: number of previous runs used for the baseline
+        min_runs: minimum number of previous runs needed to form a baseline
+        ratio: a run is flagged if it took longer than ratio times the
+            baseline
+
+    Returns:
+        list of (RunMetrics, baseline duration) for each flagged run
+    """
+    previous: dict[tuple[str, str], list[float]] = {}
+    regressions = []
+    for run in runs:
+        key = (run.command, run.project)
+        durations = previous.setdefault(key, [])
+        baseline_runs = durations[-window:]
+        if len(baseline_runs) >= min_runs:
+            baseline = statistics.median(baseline_runs)
+            deviation = statistics.median(abs(d - baseline) for d in baseline_runs)
+            if (
+                run.duration_seconds > baseline * ratio
+                and run.duration_seconds > baseline + 3 * deviation
+            ):
+                regressions.append((run, baseline))
+        if run.status == "ok":
+            durations.append(run.duration_seconds)
+    return regressions
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import requests
+
+
+@dataclass
+class _PoolEntry:
+    session: object
+    http_session: requests.Session
+    response_hooks: list
+    adapters: dict
+    last_used: float
+    cache_cleared: float
+
+
+class SessionPool:
+    """Authenticated XNAT sessions kept open between the jobs of a long-lived
+    worker process
+
+    When a pool is installed with install_session_pool, open_pyxnat_session
+    and open_xnat_session take a session from the pool instead of logging in
+    again, and return it to the pool at the end of the with block. Each
+    session is used by one job at a time. Before a session is reused, any
+    hooks and transport adapters added by the previous job (for example by
+    track_requests or apply_deadline) are removed, so that jobs cannot see
+    each other's state.
+
+    Listings cached by an xnat session, such as session.projects, are kept
+    between jobs, so that a burst of jobs does not list the same items again.
+    They are cleared once they are older than max_cache_age, so that a
+    session which is kept busy cannot report items deleted long ago.
+
+    A session which raised an exception, or which has not been used for
+    max_idle seconds, is closed rather than reused.
+    """
+
+    def __init__(self, max_idle: float = 600, max_cache_age: float = 600):
+        """
+        Args:
+            max_idle: sessions idle for longer than this number of seconds are
+                closed instead of being reused, since the server may have
+                expired them
+            max_cache_age: listings cached by a session are cleared before it
+                is reused if they were cached more than this number of
+                seconds ago
+        """
+        self.max_idle = max_idle
+        self.max_cache_age = max_cache_age
+        self.opened = 0
+        self.reused = 0
+        self._idle: dict[tuple, list[_PoolEntry]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(
+        self,
+        key: tuple,
+        factory: Callable[[], object],
+        http_session: Callable[[object], requests.Session],
+    ):
+        """Context manager which takes a session from the pool, or opens a new
+        one if none is idle, and returns it to the pool on exit
+
+        Args:
+            key: identifies the server and user. Only sessions with the same
+                key are reused
+            factory: function which opens a new session
+            http_session: function returning the requests Session used by a
+                session
+        """
+        entry = self._take(key)
+        if entry is None:
+            session = factory()
+            http = http_session(session)
+            entry = _PoolEntry(
+                session=session,
+                http_session=http,
+                response_hooks=list(http.hooks["response"]),
+                adapters=dict(http.adapters),
+                last_used=time.monotonic(),
+                cache_cleared=time.monotonic(),
+            )
+            with self._lock:
+                self.opened += 1
+        else:
+            with self._lock:
+                self.reused += 1
+        try:
+            yield entry.session
+        except BaseException:
+            _close(entry.session)
+            raise
+        self._reset(entry)
+        with self._lock:
+            self._idle.setdefault(key, []).append(entry)
+
+    def close(self):
+        """Close all idle sessions"""
+        with self._lock:
+            entries = [entry for entries in self._idle.values() for entry in entries]
+            self._idle.clear()
+        for entry in entries:
+            _close(entry.session)
+
+    def _take(self, key: tuple) -> _PoolEntry | None:
+        expired = []
+        entry = None
+        with self._lock:
+            entries = self._idle.get(key, [])
+            while entries:
+                candidate = entries.pop()
+                if time.monotonic() - candidate.last_used > self.max_idle:
+                    expired.append(candidate)
+                else:
+                    entry = candidate
+                    break
+        for candidate in expired:
+            _close(candidate.session)
+        return entry
+
+    def _reset(self, entry: _PoolEntry):
+        entry.http_session.hooks["response"] = list(entry.response_hooks)
+        entry.http_session.adapters.clear()
+        entry.http_session.adapters.update(entry.adapters)
+        now = time.monotonic()
+        if (
+            hasattr(entry.session, "clearcache")
+            and now - entry.cache_cleared > self.max_cache_age
+        ):
+            # xnat sessions cache listings such as session.subjects
+            entry.session.clearcache()
+            entry.cache_cleared = now
+        entry.last_used = now
+
+
+_active_pool: SessionPool = None
+
+
+def install_session_pool(pool: SessionPool | None):
+    """Make open_pyxnat_session and open_xnat_session take sessions from this
+    pool. Set to None to open a new session each time"""
+    global _active_pool
+    _active_pool = pool
+
+
+def get_session_pool() -> SessionPool | None:
+    """Return the installed SessionPool, or None if there is none"""
+    return _active_pool
+
+
+def _close(session):
+    try:
+        session.__exit__(None, None, None)
+    except Exception as ex:  # noqa: BLE001
+        # The server will expire the session if it cannot be closed
+        print(f"Could not close the XNAT session: {ex}")
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+
+from drc_containers.xnat_utils.deadline import Coverage
+
+# Partial results written longer ago than this are left over from an earlier
+# run, so are not merged
+MAX_PARTIAL_AGE_HOURS = 24
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of a number of deterministic partitions of the sessions in a
+    project, so that the per-session checks can be split across several
+    container instances"""
+
+    index: int
+    count: int
+
+    def __post_init__(self):
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError(f"Invalid shard {self.index} of {self.count}")
+
+    @staticmethod
+    def parse(arg: str) -> "Shard":
+        """Create a Shard from a string of the form "index/count", where
+        index counts from 0, for example "2/8" for the third of eight
+        shards"""
+        try:
+            index, count = arg.split("/")
+            return Shard(index=int(index), count=int(count))
+        except ValueError:
+            raise ValueError(f"Invalid shard {arg}. Expected format: index/count")
+
+    def contains(self, session_id: str) -> bool:
+        """Return True if the session belongs to this shard.
+
+        A stable hash of the session ID is used (rather than Python's hash(),
+        which differs between processes) so that every container instance
+        assigns each session to the same shard.
+        """
+        digest = hashlib.sha1(session_id.encode()).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+
+def _partial_path(shard_dir: str, key: str, index: int, count: int) -> str:
+    safe_key = re.sub(r"[^\w.-]", "_", key)
+    return os.path.join(shard_dir, f"{safe_key}.shard-{index}-of-{count}.json")
+
+
+def write_partial_results(
+    shard_dir: str, key: str, shard: Shard, records: set, coverage: Coverage
+):
+    """Write the records found by one shard to the shared results directory
+
+    Args:
+        shard_dir: directory shared by all shards and the merge step
+        key: string identifying the run, for example the command and project
+        shard: the shard which was processed
+        records: set of frozen dataclass records found by the shard
+        coverage: number of sessions in the shard which were checked
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    path = _partial_path(shard_dir, key, shard.index, shard.count)
+    partial = {
+        "key": key,
+        "shard": str(shard),
+        "written": datetime.now(timezone.utc).isoformat(),
+        "coverage": asdict(coverage),
+        "records": [asdict(r) for r in records],
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(partial, f)
+    os.replace(temp_path, path)
+    print(f"Wrote {len(records)} records for shard {shard} to {path}")
+
+
+def merge_partial_results(
+    shard_dir: str,
+    key: str,
+    num_shards: int,
+    record_type: type,
+    coverage: Coverage,
+    max_age_hours: float = MAX_PARTIAL_AGE_HOURS,
+) -> set:
+    """Merge the records written by all the shards of a run.
+
+    Records are frozen dataclasses, so any records reported by more than one
+    shard are deduplicated by the set union. If the results of a shard are
+    missing, or were written more than max_age_hours ago by an earlier run,
+    the coverage is marked as truncated so that a partial report is sent.
+
+    Args:
+        shard_dir: directory shared by all shards and the merge step
+        key: string identifying the run, for example the command and project
+        num_shards: number of shards the run was split into
+        record_type: dataclass type of the stored records
+        coverage: Coverage which is updated with the combined coverage of the
+            shards
+        max_age_hours: results written longer ago than this are ignored
+
+    Returns:
+        set of records from all shards
+    """
+    oldest = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+    records = set()
+    for index in range(num_shards):
+        path = _partial_path(shard_dir, key, index, num_shards)
+        if not os.path.exists(path):
+            print(f"Results for shard {index}/{num_shards} not found: {path}")
+            coverage.truncated = True
+            continue
+        with open(path) as f:
+            partial = json.load(f)
+        written = partial.get("written")
+        if written is None or datetime.fromisoformat(written) < oldest:
+            print(
+                f"Ignoring results for shard {index}/{num_shards} written by an "
+                f"earlier run at {written}: {path}"
+            )
+            coverage.truncated = True
+            continue
+        records |= {record_type(**r) for r in partial["records"]}
+        coverage.checked += partial["coverage"]["checked"]
+        coverage.total += partial["coverage"]["total"]
+        coverage.truncated |= partial["coverage"]["truncated"]
+    return records
+
+
+def remove_partial_results(shard_dir: str, key: str, num_shards: int):
+    """Delete the results written by the shards of a run once the merged
+    report has been sent, so that they cannot be merged into a later report
+
+    Args:
+        shard_dir: directory shared by all shards and the merge step
+        key: string identifying the run, for example the command and project
+        num_shards: number of shards the run was split into
+    """
+    for index in range(num_shards):
+        path = _partial_path(shard_dir, key, index, num_shards)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,220 @@
+import base64
+import re
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from drc_containers.xnat_utils.cassette import Cassette
+
+# Response headers which describe the recorded transfer rather than the
+# decoded body stored in a cassette
+_TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+@dataclass
+class ServerLoad:
+    """Requests handled by a StandinServer"""
+
+    requests: int = 0
+    errors: int = 0
+    max_in_flight: int = 0
+    endpoints: dict[str, int] = field(default_factory=dict)
+    latencies: list[float] = field(default_factory=list)
+
+    def summary(self, wall_seconds: float) -> str:
+        """Return a multi-line summary of the server load
+
+        Args:
+            wall_seconds: duration over which the requests were received
+        """
+        rate = self.requests / wall_seconds if wall_seconds > 0 else 0.0
+        lines = [
+            (
+                f"Server: {self.requests} requests ({rate:.1f}/s), "
+                f"{self.errors} unmatched, max {self.max_in_flight} in flight"
+            )
+        ]
+        if self.latencies:
+            lines.append(
+                f"Server latency: p50 {percentile(self.latencies, 50) * 1000:.1f}ms, "
+                f"p95 {percentile(self.latencies, 95) * 1000:.1f}ms, "
+                f"p99 {percentile(self.latencies, 99) * 1000:.1f}ms"
+            )
+        for endpoint, count in sorted(
+            self.endpoints.items(), key=lambda item: item[1], reverse=True
+        ):
+            lines.append(f"  {count:6d}  {endpoint}")
+        return "\n".join(lines)
+
+
+class StandinServer:
+    """A local HTTP server standing in for XNAT, used to run the commands
+    under load without touching a production server
+
+    Responses are served from a cassette if one is given. Otherwise minimal
+    generic responses are returned: an empty result table for searches and
+    listings, and an empty success response for other requests. The generic
+    responses are sufficient for the pyxnat-based commands to run to
+    completion. Commands which use xnatpy need a cassette, since xnatpy reads
+    the server version and schemas when it connects.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        cassette_path: str | None = None,
+        time_scale: float = 1.0,
+        latency: float = 0.0,
+    ):
+        """
+        Args:
+            port: port to listen on. 0 picks a free port
+            cassette_path: optional cassette recorded against a real server,
+                from which responses are served
+            time_scale: recorded latencies in the cassette are multiplied by
+                this factor
+            latency: extra delay in seconds added to every response
+        """
+        self.cassette = (
+            Cassette(cassette_path, mode="replay", time_scale=time_scale)
+            if cassette_path
+            else None
+        )
+        self.time_scale = time_scale
+        self.latency = latency
+        self.load = ServerLoad()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._thread = None
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(self))
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving requests in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def respond(self, method: str, path: str, body: bytes) -> tuple[int, dict, bytes]:
+        """Return the status, headers and body of the response to a request"""
+        if self.cassette:
+            entry = self.cassette.find_response(method, path, body or None)
+            if entry is None:
+                return 404, {"Content-Type": "text/plain"}, b"No recorded response"
+            if self.time_scale > 0:
+                time.sleep(entry["latency"] * self.time_scale)
+            headers = {
+                k: v
+                for k, v in entry["headers"].items()
+                if k.lower() not in _TRANSFER_HEADERS
+            }
+            return entry["status"], headers, base64.b64decode(entry["body"])
+
+        url_path = urlsplit(path).path
+        if url_path.endswith("/JSESSION"):
+            content = b"" if method == "DELETE" else b"0" * 32
+            return 200, {"Content-Type": "text/plain"}, content
+        if method == "POST" and url_path.endswith("/data/search"):
+            return 200, {"Content-Type": "text/csv"}, _empty_search_result(body)
+        if method == "GET" and url_path.startswith("/data/"):
+            return 200, {"Content-Type": "text/csv"}, b'"ID","label","URI"\n'
+        return 200, {"Content-Type": "text/plain"}, b""
+
+    def _begin(self):
+        with self._lock:
+            self._in_flight += 1
+            self.load.max_in_flight = max(self.load.max_in_flight, self._in_flight)
+
+    def _end(self, method: str, path: str, status: int, latency: float):
+        endpoint = f"{method} {_endpoint(path)}"
+        with self._lock:
+            self._in_flight -= 1
+            self.load.requests += 1
+            self.load.errors += status >= 400
+            self.load.endpoints[endpoint] = self.load.endpoints.get(endpoint, 0) + 1
+            self.load.latencies.append(latency)
+
+
+def _make_handler(server: StandinServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _handle(self):
+            start = time.perf_counter()
+            server._begin()
+            status = 500
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                status, headers, content = server.respond(self.command, self.path, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            finally:
+                server._end(
+                    self.command, self.path, status, time.perf_counter() - start
+                )
+
+        do_GET = _handle
+        do_POST = _handle
+        do_PUT = _handle
+        do_DELETE = _handle
+
+    return Handler
+
+
+def _empty_search_result(body: bytes) -> bytes:
+    """Return a CSV table with the columns requested by a search document and
+    no rows"""
+    fields = re.findall(rb"<xdat:field_ID>([^<]+)</xdat:field_ID>", body)
+    columns = [re.sub(r"\W", "_", f.decode()).lower() for f in fields] or ["id"]
+    return (",".join(f'"{c}"' for c in columns) + "\n").encode()
+
+
+def _endpoint(path: str) -> str:
+    """Return the path with resource identifiers replaced by *, so that
+    requests for different sessions are counted together"""
+    segments = urlsplit(path).path.strip("/").split("/")
+    if segments[:1] != ["data"]:
+        return "/" + "/".join(segments)
+    # Below /data, paths alternate between collection names and identifiers,
+    # for example /data/experiments/{id}/resources/{id}/files
+    return "/data/" + "/".join(
+        "*" if index % 2 else segment for index, segment in enumerate(segments[1:])
+    )
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Return the given percentile (0-100) of a non-empty list of values"""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[
+        min(98, max(0, round(percent) - 1))
+    ]
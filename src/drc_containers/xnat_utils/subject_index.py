@@ -0,0 +1,112 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+
+class SubjectLabelIndex:
+    """A persistent local index of the subject label prefixes in each project,
+    stored in an SQLite database
+
+    Projects which change mostly by adding new sessions can then be kept up
+    to date with a search for sessions inserted since the last refresh,
+    instead of listing every session on every run. Since such a search does
+    not see sessions which were deleted or relabelled, each project is
+    rebuilt from a full listing when its last full refresh is older than
+    full_refresh_days.
+
+    Entries are stored per XNAT server, so one index file can be shared by
+    runs against different servers.
+    """
+
+    def __init__(self, path: str, host: str, full_refresh_days: float = 7):
+        """
+        Args:
+            path: location of the SQLite database file
+            host: XNAT server whose projects are indexed
+            full_refresh_days: a project is rebuilt from a full listing if its
+                last full refresh is older than this number of days
+        """
+        self.path = path
+        self.host = host
+        self.full_refresh_days = full_refresh_days
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS subject_prefixes ("
+                "host TEXT, project TEXT, prefix TEXT, "
+                "PRIMARY KEY (host, project, prefix)) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS refreshes ("
+                "host TEXT, project TEXT, refreshed TEXT, full_refreshed TEXT, "
+                "PRIMARY KEY (host, project))"
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def inserted_since(self, project: str) -> str | None:
+        """Return the date from which new sessions must be fetched to bring a
+        project up to date
+
+        Returns:
+            date as YYYY-MM-DD, or None if the project needs a full refresh
+        """
+        row = self._connection.execute(
+            "SELECT refreshed, full_refreshed FROM refreshes "
+            "WHERE host = ? AND project = ?",
+            (self.host, project),
+        ).fetchone()
+        if row is None:
+            return None
+        refreshed, full_refreshed = (datetime.fromisoformat(r) for r in row)
+        now = datetime.now(timezone.utc)
+        if now - full_refreshed > timedelta(days=self.full_refresh_days):
+            return None
+        # Go back a day so that differences between the time zones of the
+        # server and the container cannot cause sessions to be missed
+        return (refreshed.date() - timedelta(days=1)).isoformat()
+
+    def update(self, project: str, prefixes: set[str], started: datetime, full: bool):
+        """Store the subject label prefixes found by a refresh
+
+        Args:
+            project: project which was searched
+            prefixes: subject label prefixes found by the search
+            started: UTC time at which the search started
+            full: True if the search listed every session in the project, in
+                which case any prefixes not found are removed from the index
+        """
+        with self._connection:
+            if full:
+                self._connection.execute(
+                    "DELETE FROM subject_prefixes WHERE host = ? AND project = ?",
+                    (self.host, project),
+                )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO subject_prefixes VALUES (?, ?, ?)",
+                ((self.host, project, prefix) for prefix in prefixes),
+            )
+            if full:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?)",
+                    (self.host, project, started.isoformat(), started.isoformat()),
+                )
+            else:
+                self._connection.execute(
+                    "UPDATE refreshes SET refreshed = ? WHERE host = ? AND project = ?",
+                    (started.isoformat(), self.host, project),
+                )
+
+    def prefixes(self, project: str) -> set[str]:
+        """Return all the subject label prefixes stored for a project"""
+        rows = self._connection.execute(
+            "SELECT prefix FROM subject_prefixes WHERE host = ? AND project = ?",
+            (self.host, project),
+        )
+        return {prefix for (prefix,) in rows}
@@ -1,9 +1,15 @@
+import json
 import os
 from dataclasses import dataclass
+from urllib.parse import urlsplit
 
+import requests
 import xnat
 from pyxnat import Interface
 
+from drc_containers.xnat_utils.cassette import install_cassette_from_environment
+from drc_containers.xnat_utils.session_pool import get_session_pool
+
 
 @dataclass
 class XnatCredentials:
@@ -39,6 +45,60 @@ class XnatContainerCredentials(XnatCredentials):
         )
 
 
+def read_server_list(path: str) -> dict[str, XnatCredentials]:
+    """Read the credentials of several XNAT servers from a JSON file, for
+    commands which report across all the servers of a consortium
+
+    The file has the form:
+        {
+            "servers": [
+                {
+                    "name": "site-a",
+                    "host": "https://xnat.site-a.org",
+                    "username": "drc",
+                    "password_env": "SITE_A_XNAT_PASS",
+                    "verify_ssl": true
+                }
+            ]
+        }
+
+    name is optional and defaults to the host name. The password may be given
+    directly with "password", or with "password_env" as the name of an
+    environment variable containing it, so that the file need not contain
+    secrets. verify_ssl is optional and defaults to true.
+
+    Args:
+        path: location of the JSON file
+
+    Returns:
+        dict of XnatCredentials keyed by server name, in the order listed
+    """
+    with open(path) as f:
+        entries = json.load(f)["servers"]
+    servers = {}
+    for entry in entries:
+        host = entry.get("host")
+        if not host:
+            raise ValueError(f"No host for server entry in {path}")
+        name = entry.get("name") or urlsplit(host).hostname or host
+        if name in servers:
+            raise ValueError(f"Server {name} is listed more than once in {path}")
+        password = entry.get("password")
+        if password is None and entry.get("password_env"):
+            password = os.getenv(entry["password_env"])
+        if not password:
+            raise ValueError(f"No password for server {name} in {path}")
+        servers[name] = XnatCredentials(
+            username=entry["username"],
+            password=password,
+            host=host,
+            verify_ssl=entry.get("verify_ssl", True),
+        )
+    if not servers:
+        raise ValueError(f"No servers listed in {path}")
+    return servers
+
+
 def open_xnat_session(credentials: XnatCredentials):
     """Initiate XNAT session using credentials set by XNAT container service
 
@@ -46,13 +106,22 @@ def open_xnat_session(credentials: XnatCredentials):
         credentials: server credentials. Use XnatContainerCredentials if running
             using XNAT container service
 
+    If the DRC_CASSETTE environment variable is set, requests are recorded to
+    or replayed from a cassette file (see install_cassette_from_environment)
+
+    If a SessionPool is installed, an open session is reused from the pool
     """
-    return xnat.connect(
-        server=credentials.host,
-        user=credentials.username,
-        password=credentials.password,
-        extension_types=True,
-        verify=credentials.verify_ssl,
+    install_cassette_from_environment()
+    return _pooled(
+        "xnat",
+        credentials,
+        lambda: xnat.connect(
+            server=credentials.host,
+            user=credentials.username,
+            password=credentials.password,
+            extension_types=True,
+            verify=credentials.verify_ssl,
+        ),
     )
 
 
@@ -61,10 +130,48 @@ def open_pyxnat_session(credentials: XnatCredentials) -> Interface:
 
     Args:
         credentials:
+
+    If the DRC_CASSETTE environment variable is set, requests are recorded to
+    or replayed from a cassette file (see install_cassette_from_environment)
+
+    If a SessionPool is installed, an open session is reused from the pool
     """
-    return Interface(
-        server=credentials.host,
-        user=credentials.username,
-        password=credentials.password,
-        verify=credentials.verify_ssl,
+    install_cassette_from_environment()
+    return _pooled(
+        "pyxnat",
+        credentials,
+        lambda: Interface(
+            server=credentials.host,
+            user=credentials.username,
+            password=credentials.password,
+            verify=credentials.verify_ssl,
+        ),
+    )
+
+
+def get_http_session(session) -> requests.Session:
+    """Return the requests Session used by a pyxnat or xnat session to
+    communicate with the server
+
+    Args:
+        session: pyxnat Interface or xnat session
+    """
+    if isinstance(session, Interface):
+        return session._http
+    return session.interface
+
+
+def _pooled(kind: str, credentials: XnatCredentials, factory):
+    """Open a session with factory, or take one from the installed
+    SessionPool. Either way the result is used as a context manager"""
+    pool = get_session_pool()
+    if pool is None:
+        return factory()
+    key = (
+        kind,
+        credentials.host,
+        credentials.username,
+        credentials.password,
+        credentials.verify_ssl,
     )
+    return pool.session(key=key, factory=factory, http_session=get_http_session)
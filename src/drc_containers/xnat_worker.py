@@ -0,0 +1,278 @@
+import hmac
+import io
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from drc_containers.commands import COMMAND_MODULES, get_command
+from drc_containers.xnat_utils.session_pool import SessionPool, install_session_pool
+
+DEFAULT_PORT = 8765
+
+
+class _ThreadOutput(io.TextIOBase):
+    """Replacement for sys.stdout and sys.stderr which sends the output of
+    each job to that job's buffer, so that concurrent jobs do not mix their
+    output"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        return (buffer or self.stream).write(text)
+
+    def flush(self):
+        buffer = getattr(self._local, "buffer", None)
+        (buffer or self.stream).flush()
+
+    @contextmanager
+    def capture(self, buffer: io.StringIO):
+        self._local.buffer = buffer
+        try:
+            yield
+        finally:
+            self._local.buffer = None
+
+
+class XnatWorker:
+    """A long-lived process which runs commands on request, so that each
+    XNAT event does not pay for starting a container, importing pyxnat and
+    xnat, and logging in
+
+    The command modules are imported once at startup, and XNAT sessions are
+    kept open in a SessionPool between jobs. Jobs run in the worker process,
+    so they share its environment: the XNAT_HOST, XNAT_USER and XNAT_PASS
+    credentials are those of the worker.
+
+    Profiling and cassettes are process-wide: a profile would include the
+    spans of every job running at the same time, and a cassette replaces the
+    transport of every session. They can only be used by a worker which runs
+    one job at a time.
+    """
+
+    def __init__(
+        self, max_jobs: int = 1, max_idle: float = 600, token: str | None = None
+    ):
+        """
+        Args:
+            max_jobs: maximum number of jobs run at once. Must be 1 if the
+                DRC_PROFILE or DRC_CASSETTE environment variable is set
+            max_idle: XNAT sessions idle for longer than this number of
+                seconds are closed instead of being reused
+            token: if set, requests must send this token in an Authorization
+                header
+        """
+        if max_jobs > 1 and (os.getenv("DRC_PROFILE") or os.getenv("DRC_CASSETTE")):
+            raise ValueError(
+                "Jobs cannot run concurrently while DRC_PROFILE or DRC_CASSETTE is set"
+            )
+        self.max_jobs = max_jobs
+        self.pool = SessionPool(max_idle=max_idle)
+        self.token = token
+        self.jobs_run = 0
+        self._jobs = threading.Semaphore(max_jobs)
+        self._lock = threading.Lock()
+        self._stdout = _ThreadOutput(sys.stdout)
+        self._stderr = _ThreadOutput(sys.stderr)
+
+    def start(self):
+        """Import all the commands and install the session pool and output
+        capture"""
+        for name in COMMAND_MODULES:
+            get_command(name)
+        install_session_pool(self.pool)
+        sys.stdout = self._stdout
+        sys.stderr = self._stderr
+
+    def stop(self):
+        """Close the pooled sessions and restore the original output"""
+        install_session_pool(None)
+        self.pool.close()
+        sys.stdout = self._stdout.stream
+        sys.stderr = self._stderr.stream
+
+    def check_job(self, args: list[str]):
+        """Raise ValueError if a job cannot run alongside other jobs
+
+        Args:
+            args: command-line arguments for the command
+        """
+        profiled = any(
+            arg == "--profile" or arg.startswith("--profile=") for arg in args
+        )
+        if self.max_jobs > 1 and profiled:
+            raise ValueError("--profile requires a worker which runs one job at a time")
+
+    def run_job(self, command: str, args: list[str]) -> dict:
+        """Run a command with its command-line arguments
+
+        Args:
+            command: command name, as listed in pyproject.toml
+            args: command-line arguments for the command
+
+        Returns:
+            dict with the exit_code of the command, its output and the
+            number of seconds it took
+        """
+        main = get_command(command)
+        buffer = io.StringIO()
+        with self._jobs:
+            start = time.perf_counter()
+            with self._stdout.capture(buffer), self._stderr.capture(buffer):
+                try:
+                    main(args)
+                    exit_code = 0
+                except SystemExit as ex:
+                    if ex.code is None or isinstance(ex.code, int):
+                        exit_code = ex.code or 0
+                    else:
+                        print(ex.code, file=sys.stderr)
+                        exit_code = 1
+                except Exception:  # noqa: BLE001
+                    # A failed job is reported like a process which crashed,
+                    # without stopping the worker
+                    traceback.print_exc()
+                    exit_code = 1
+            seconds = time.perf_counter() - start
+        with self._lock:
+            self.jobs_run += 1
+        return {"exit_code": exit_code, "output": buffer.getvalue(), "seconds": seconds}
+
+    def status(self) -> dict:
+        return {
+            "jobs_run": self.jobs_run,
+            "sessions_opened": self.pool.opened,
+            "sessions_reused": self.pool.reused,
+        }
+
+    def authorized(self, header: str | None) -> bool:
+        if not self.token:
+            return True
+        return hmac.compare_digest(header or "", f"Bearer {self.token}")
+
+
+def _make_handler(worker: XnatWorker):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, content: dict):
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if not worker.authorized(self.headers.get("Authorization")):
+                self._reply(401, {"error": "Unauthorized"})
+            elif self.path == "/status":
+                self._reply(200, worker.status())
+            else:
+                self._reply(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            if not worker.authorized(self.headers.get("Authorization")):
+                self._reply(401, {"error": "Unauthorized"})
+                return
+            if self.path != "/jobs":
+                self._reply(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                job = json.loads(body)
+                command = job["command"]
+                args = [str(arg) for arg in job.get("args", [])]
+                if command not in COMMAND_MODULES:
+                    raise ValueError(f"Unknown command {command}")
+                worker.check_job(args)
+            except (ValueError, KeyError, TypeError) as ex:
+                self._reply(400, {"error": f"Invalid job: {ex}"})
+                return
+            self._reply(200, worker.run_job(command, args))
+
+    return Handler
+
+
+def xnat_worker(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    max_jobs: int = 1,
+    max_idle: float = 600,
+    token: str | None = None,
+):
+    """Serve jobs over HTTP until interrupted
+
+    Jobs are submitted with xnat_submit, or by POSTing
+    {"command": ..., "args": [...]} to /jobs. The response is sent when the
+    job has finished. GET /status returns the number of jobs run and
+    sessions reused.
+
+    Args:
+        host: address to listen on. The default only accepts connections
+            from the same machine
+        port: port to listen on
+        max_jobs: maximum number of jobs run at once. Must be 1 if the
+            DRC_PROFILE or DRC_CASSETTE environment variable is set
+        max_idle: XNAT sessions idle for longer than this number of seconds
+            are closed instead of being reused
+        token: if set, clients must send this token
+    """
+    worker = XnatWorker(max_jobs=max_jobs, max_idle=max_idle, token=token)
+    server = ThreadingHTTPServer((host, port), _make_handler(worker))
+    server.daemon_threads = True
+    worker.start()
+    print(f"xnat_worker listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        worker.stop()
+
+
+def main(args=None):
+    """Entrypoint for xnat_worker, as listed in pyproject.toml.
+
+    Args:
+        args: list of arguments. If not set these will be read from the
+            command-line
+
+    The command-line arguments are:
+        xnat_worker [--host HOST] [--port PORT] [--jobs N] [--max-idle S]
+
+    The XNAT credentials are read from XNAT_HOST, XNAT_USER and XNAT_PASS as
+    for the commands. If DRC_WORKER_TOKEN is set, clients must send the same
+    token.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--max-idle", type=float, default=600)
+    parsed = parser.parse_args(args)
+
+    xnat_worker(
+        host=parsed.host,
+        port=parsed.port,
+        max_jobs=parsed.jobs,
+        max_idle=parsed.max_idle,
+        token=os.getenv("DRC_WORKER_TOKEN"),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import functools
+
+import pytest
+import requests
+from pyxnat import Interface
+from requests.adapters import HTTPAdapter
+
+from drc_containers.email_listmode import recent_sessions_query
+from drc_containers.email_radreads import radread_query
+from drc_containers.xnat_utils import async_client
+from drc_containers.xnat_utils.async_client import AsyncXnatClient
+from drc_containers.xnat_utils.xnat_credentials import XnatCredentials
+
+httpx = pytest.importorskip("httpx")
+
+SERVER = "https://xnat.example.org"
+CREDENTIALS = XnatCredentials(host=SERVER, username="user", password="password")
+
+# Search results in the CSV format returned by XNAT, whose headers differ
+# from the requested columns
+SEARCH_RESULTS = {
+    "xnat:petSessionData": (
+        "session_id,subject_id,date,label,project,quarantine_status\n"
+        "XNAT_E00001,XNAT_S00001,2024-05-01,11111111_PET,PROJ,active\n"
+        "XNAT_E00002,XNAT_S00002,2024-05-02,22222222_PET,PROJ,active\n"
+    ),
+    "nshdni:radRead": (
+        "nshdni_col_radreadimagesession_id,nshdni_col_radreadproject\n"
+        "XNAT_E00001,PROJ\n"
+    ),
+}
+
+
+def search_result(body: bytes) -> bytes:
+    for root_element, content in SEARCH_RESULTS.items():
+        if f"<xdat:root_element_name>{root_element}<" in body.decode():
+            return content.encode()
+    raise AssertionError("Unexpected search")
+
+
+def handle(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/data/JSESSION":
+        return httpx.Response(200, text="0123456789ABCDEF")
+    assert request.url.path == "/data/search"
+    assert request.url.params["format"] == "csv"
+    return httpx.Response(200, content=search_result(request.content))
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    transport = httpx.MockTransport(handle)
+    monkeypatch.setattr(
+        async_client.httpx,
+        "AsyncClient",
+        functools.partial(httpx.AsyncClient, transport=transport),
+    )
+    return transport
+
+
+def async_search(root_element: str, columns: list[str], constraints: list):
+    async def search():
+        async with AsyncXnatClient(CREDENTIALS) as client:
+            return await client.search(root_element, columns, constraints)
+
+    return asyncio.run(search())
+
+
+def pyxnat_search(
+    monkeypatch, root_element: str, columns: list[str], constraints: list
+):
+    """Run the same search through pyxnat, with the same responses"""
+
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        if request.path_url.startswith("/data/JSESSION"):
+            response._content = b"0123456789ABCDEF"
+        else:
+            response._content = search_result(request.body)
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    interface = Interface(server=SERVER, user="user", password="password")
+    return interface.select(root_element, columns).where(constraints).data
+
+
+def test_search_rows_keyed_by_column(transport):
+    columns, constraints = recent_sessions_query("xnat:petSessionData", 90, "PROJ")
+
+    rows = async_search("xnat:petSessionData", columns, constraints)
+
+    assert rows == [
+        {
+            "session_id": "XNAT_E00001",
+            "subject_id": "XNAT_S00001",
+            "date": "2024-05-01",
+            "label": "11111111_PET",
+            "project": "PROJ",
+        },
+        {
+            "session_id": "XNAT_E00002",
+            "subject_id": "XNAT_S00002",
+            "date": "2024-05-02",
+            "label": "22222222_PET",
+            "project": "PROJ",
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    "root_element, query",
+    [
+        (
+            "xnat:petSessionData",
+            recent_sessions_query("xnat:petSessionData", 90, "PROJ"),
+        ),
+        ("nshdni:radRead", radread_query("PROJ")),
+    ],
+)
+def test_search_keys_match_pyxnat(monkeypatch, transport, root_element, query):
+    columns, constraints = query
+
+    rows = async_search(root_element, columns, constraints)
+
+    assert rows == pyxnat_search(monkeypatch, root_element, columns, constraints)
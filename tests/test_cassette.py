@@ -0,0 +1,119 @@
+import json
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from drc_containers.xnat_utils.cassette import Cassette, CassetteMiss
+
+SERVER = "https://xnat.example.org"
+
+
+class FakeServer:
+    """Replaces the requests transport, numbering the responses it sends"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, adapter, request, **kwargs):
+        self.sent.append((request.method, request.url))
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers["Content-Type"] = "text/plain"
+        response.headers["Set-Cookie"] = "JSESSIONID=SECRET"
+        response._content = f"{len(self.sent)} {request.method} {request.url}".encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    # A function, rather than the bound method, is called with the adapter
+    # both by requests and by the cassette
+    monkeypatch.setattr(
+        HTTPAdapter,
+        "send",
+        lambda adapter, request, **kwargs: server.send(adapter, request, **kwargs),
+    )
+    return server
+
+
+@pytest.fixture
+def cassette_path(server, tmp_path):
+    """A cassette recorded from the fake server"""
+    path = str(tmp_path / "cassette.jsonl")
+    http_session = requests.Session()
+    http_session.auth = ("user", "password")
+    with Cassette(path, mode="record"):
+        http_session.post(f"{SERVER}/data/JSESSION")
+        http_session.get(f"{SERVER}/data/projects")
+        http_session.get(f"{SERVER}/data/projects")
+        http_session.post(f"{SERVER}/data/search", data="<search>A</search>")
+    return path
+
+
+def replay(path: str) -> Cassette:
+    return Cassette(path, mode="replay", time_scale=0)
+
+
+def test_credentials_not_recorded(cassette_path):
+    with open(cassette_path) as f:
+        text = f.read()
+        entries = [json.loads(line) for line in text.splitlines()]
+
+    assert len(entries) == 4
+    assert "SECRET" not in text
+    assert "password" not in text
+    assert entries[0]["body"] == "MDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDA="
+
+
+def test_replay_without_network(server, cassette_path):
+    num_sent = len(server.sent)
+    with replay(cassette_path) as cassette:
+        first = requests.get(f"{SERVER}/data/projects")
+        second = requests.get(f"{SERVER}/data/projects")
+        third = requests.get(f"{SERVER}/data/projects")
+
+    assert len(server.sent) == num_sent
+    # Repeated requests are served in the order they were recorded, and the
+    # last response is kept for further repeats
+    assert first.text == f"2 GET {SERVER}/data/projects"
+    assert second.text == f"3 GET {SERVER}/data/projects"
+    assert third.text == second.text
+    assert first.status_code == 200
+    assert first.headers["Content-Type"] == "text/plain"
+    assert cassette.stats.hits == 3
+
+
+def test_search_matched_on_body_or_path(cassette_path):
+    with replay(cassette_path):
+        exact = requests.post(f"{SERVER}/data/search", data="<search>A</search>")
+        # A search with a different body, for example a later date, is
+        # matched on its method and path
+        loose = requests.post(f"{SERVER}/data/search", data="<search>B</search>")
+
+    assert exact.text == f"4 POST {SERVER}/data/search"
+    assert loose.text == exact.text
+
+
+def test_unrecorded_request_raises_cassette_miss(cassette_path):
+    with replay(cassette_path) as cassette:
+        with pytest.raises(CassetteMiss):
+            requests.get(f"{SERVER}/data/projects/PROJ")
+        with pytest.raises(CassetteMiss):
+            requests.delete(f"{SERVER}/data/projects")
+
+    assert cassette.stats.misses == 2
+    assert cassette.stats.hits == 0
+
+
+def test_uninstall_restores_transport(server, cassette_path):
+    with replay(cassette_path):
+        pass
+
+    requests.get(f"{SERVER}/data/projects/PROJ")
+
+    assert server.sent[-1] == ("GET", f"{SERVER}/data/projects/PROJ")
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from drc_containers.xnat_utils.change_feed import SessionResultCache
+
+HOST = "https://xnat.example.org"
+KEY = "email_listmode-PROJ-90"
+
+
+@dataclass(frozen=True)
+class Record:
+    session_id: str
+    errors: str
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with SessionResultCache(
+        str(tmp_path / "changes.db"), host=HOST, key=KEY, record_type=Record
+    ) as cache:
+        yield cache
+
+
+def test_store_and_record(cache):
+    cache.store("XNAT_E00001", Record("XNAT_E00001", "LM missing"))
+    cache.store("XNAT_E00002", None)
+
+    assert cache.record("XNAT_E00001") == Record("XNAT_E00001", "LM missing")
+    # A session with no problems is stored without a record
+    assert cache.contains("XNAT_E00002")
+    assert cache.record("XNAT_E00002") is None
+    assert not cache.contains("XNAT_E00003")
+    assert cache.records() == {Record("XNAT_E00001", "LM missing")}
+
+
+def test_results_are_kept_per_host_and_key(tmp_path):
+    path = str(tmp_path / "changes.db")
+    with SessionResultCache(path, HOST, KEY, Record) as cache:
+        cache.store("XNAT_E00001", Record("XNAT_E00001", "LM missing"))
+    with SessionResultCache(path, HOST, "email_listmode-PROJ-30", Record) as other:
+        assert not other.contains("XNAT_E00001")
+    with SessionResultCache(path, HOST, KEY, Record) as cache:
+        assert cache.contains("XNAT_E00001")
+
+
+def test_records_of_given_sessions(cache):
+    for n in range(3):
+        session_id = f"XNAT_E0000{n}"
+        cache.store(session_id, Record(session_id, "LM missing"))
+
+    records = cache.records({"XNAT_E00000", "XNAT_E00002", "XNAT_E00009"})
+
+    assert {r.session_id for r in records} == {"XNAT_E00000", "XNAT_E00002"}
+
+
+def test_retain_removes_other_sessions(cache):
+    for n in range(3):
+        session_id = f"XNAT_E0000{n}"
+        cache.store(session_id, Record(session_id, "LM missing"))
+
+    cache.retain({"XNAT_E00001"})
+
+    assert cache.records() == {Record("XNAT_E00001", "LM missing")}
+    assert not cache.contains("XNAT_E00000")
+
+
+def test_discard(cache):
+    cache.store("XNAT_E00001", None)
+    cache.store("XNAT_E00002", None)
+
+    cache.discard({"XNAT_E00001"})
+
+    assert not cache.contains("XNAT_E00001")
+    assert cache.contains("XNAT_E00002")
+
+
+def test_is_unchanged(cache):
+    cache.store("XNAT_E00001", None)
+    cache.store("XNAT_E00002", None)
+    changed = {"XNAT_E00002": "xnat:petSessionData"}
+
+    assert cache.is_unchanged("XNAT_E00001", changed)
+    assert not cache.is_unchanged("XNAT_E00002", changed)
+    # A session with no stored result must be checked
+    assert not cache.is_unchanged("XNAT_E00003", changed)
+    # Every session is checked when there is no change feed
+    assert not cache.is_unchanged("XNAT_E00001", None)
+
+
+def test_changed_since(cache):
+    assert cache.changed_since() is None
+
+    started = datetime.now(timezone.utc) - timedelta(days=2)
+    cache.update(started=started - timedelta(days=7), full=True)
+    cache.update(started=started, full=False)
+
+    # Changes are fetched from the day before the last run
+    expected = (started.date() - timedelta(days=1)).isoformat()
+    assert cache.changed_since() == expected
+
+
+def test_full_check_is_due(cache):
+    started = datetime.now(timezone.utc) - timedelta(days=30)
+    cache.update(started=started, full=True)
+    cache.update(started=datetime.now(timezone.utc), full=False)
+
+    assert cache.changed_since() is None
+
+
+def test_update_before_full_check_sets_no_mark(cache):
+    cache.update(started=datetime.now(timezone.utc), full=False)
+
+    assert cache.changed_since() is None
+
+
+def test_clear(cache):
+    cache.store("XNAT_E00001", Record("XNAT_E00001", "LM missing"))
+
+    cache.clear()
+
+    assert not cache.contains("XNAT_E00001")
+    assert cache.records() == set()
@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+
+import pytest
+
+from drc_containers.xnat_utils.checkpoint import Checkpoint
+
+
+@dataclass(frozen=True)
+class Record:
+    session_id: str
+    error: str
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "state.json")
+
+
+def test_resume_after_interrupted_run(state_path):
+    with (
+        pytest.raises(KeyboardInterrupt),
+        Checkpoint(state_path, "run", Record, save_interval=100) as checkpoint,
+    ):
+        checkpoint.mark_done("S1", Record("S1", "missing"))
+        checkpoint.mark_done("S2")
+        raise KeyboardInterrupt
+
+    resumed = Checkpoint(state_path, "run", Record, resume=True)
+    assert resumed.is_done("S1")
+    assert resumed.is_done("S2")
+    assert not resumed.is_done("S3")
+    assert resumed.records == {Record("S1", "missing")}
+
+
+def test_progress_saved_every_interval(state_path):
+    checkpoint = Checkpoint(state_path, "run", Record, save_interval=2)
+    checkpoint.mark_done("S1")
+    assert not Checkpoint(state_path, "run", Record, resume=True).processed
+    checkpoint.mark_done("S2")
+    assert Checkpoint(state_path, "run", Record, resume=True).processed == {
+        "S1",
+        "S2",
+    }
+
+
+def test_checkpoint_from_different_run_ignored(state_path):
+    checkpoint = Checkpoint(state_path, "project A", Record)
+    checkpoint.mark_done("S1", Record("S1", "missing"))
+    checkpoint.save()
+
+    resumed = Checkpoint(state_path, "project B", Record, resume=True)
+    assert not resumed.is_done("S1")
+    assert not resumed.records
+
+
+def test_not_resumed_unless_requested(state_path):
+    checkpoint = Checkpoint(state_path, "run", Record)
+    checkpoint.mark_done("S1")
+    checkpoint.save()
+
+    assert not Checkpoint(state_path, "run", Record).is_done("S1")
+
+
+def test_clear_removes_state_file(state_path):
+    checkpoint = Checkpoint(state_path, "run", Record)
+    checkpoint.mark_done("S1")
+    checkpoint.save()
+    checkpoint.clear()
+
+    assert not Checkpoint(state_path, "run", Record, resume=True).processed
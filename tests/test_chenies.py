@@ -0,0 +1,93 @@
+from drc_containers.email_chenies import get_mr_subject_labels
+from drc_containers.xnat_utils.query_backend import QueryBackend
+
+
+class StandInBackend(QueryBackend):
+    """Returns fixed rows for each root element, and records the searches"""
+
+    def __init__(self, rows: dict[str, list[dict]]):
+        self.rows = rows
+        self.searches = []
+
+    def search(self, root_element, columns, constraints):
+        self.searches.append((root_element, columns, constraints))
+        return self.rows.get(root_element, [])
+
+
+def test_mr_subject_labels_from_one_subject_search():
+    backend = StandInBackend(
+        {
+            "xnat:subjectData": [
+                {
+                    "subject_id": "XNAT_S00001",
+                    "subject_label": "11111111_A",
+                    "project": "MR1",
+                },
+                {
+                    "subject_id": "XNAT_S00002",
+                    "subject_label": "22222222",
+                    "project": "MR2",
+                },
+            ]
+        }
+    )
+
+    labels = get_mr_subject_labels(None, ["MR1", "MR2"], query_backend=backend)
+
+    assert labels == {"11111111", "22222222"}
+    assert backend.searches == [
+        (
+            "xnat:subjectData",
+            [
+                "xnat:subjectData/SUBJECT_ID",
+                "xnat:subjectData/SUBJECT_LABEL",
+                "xnat:subjectData/PROJECT",
+            ],
+            [
+                ("xnat:mrSessionData/project", "=", "MR1"),
+                ("xnat:mrSessionData/project", "=", "MR2"),
+                "OR",
+            ],
+        )
+    ]
+
+
+def test_mr_subject_labels_of_shared_subjects():
+    # XNAT_S00002 is owned by OTHER and shared into MR1 under another label
+    backend = StandInBackend(
+        {
+            "xnat:subjectData": [
+                {
+                    "subject_id": "XNAT_S00001",
+                    "subject_label": "11111111",
+                    "project": "MR1",
+                },
+                {
+                    "subject_id": "XNAT_S00002",
+                    "subject_label": "OTHER_0002",
+                    "project": "OTHER",
+                },
+            ],
+            "xnat:mrSessionData": [
+                {"subject_label": "22222222_B", "project": "OTHER"},
+            ],
+        }
+    )
+
+    labels = get_mr_subject_labels(None, ["MR1"], query_backend=backend)
+
+    assert labels == {"11111111", "22222222"}
+    root_element, _, constraints = backend.searches[1]
+    assert root_element == "xnat:mrSessionData"
+    assert constraints == [
+        [("xnat:mrSessionData/project", "=", "MR1"), "OR"],
+        [("xnat:mrSessionData/subject_id", "=", "XNAT_S00002"), "OR"],
+        "AND",
+    ]
+
+
+def test_mr_subject_labels_without_projects():
+    backend = StandInBackend({})
+
+    assert get_mr_subject_labels(None, [], query_backend=backend) == set()
+    assert backend.searches == []
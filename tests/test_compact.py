@@ -0,0 +1,111 @@
+import json
+from dataclasses import asdict
+
+from drc_containers.email_listmode import (
+    ListModeError,
+    ListModeRecord,
+    decode_listmode_errors,
+    encode_listmode_errors,
+    listmode_record,
+)
+from drc_containers.xnat_utils.compact import SessionRow, session_rows
+
+ROWS = [
+    {
+        "session_id": "XNAT_E00001",
+        "subject_id": "XNAT_S00001",
+        "date": "2026-10-01",
+        "label": "12345678_03_PETMR",
+        "project": "PROJ",
+    },
+    {
+        "session_id": "XNAT_E00002",
+        "subject_id": "XNAT_S00001",
+        "date": "2026-10-01",
+        "label": "12345678_04_PETMR",
+        "project": "PROJ",
+    },
+]
+
+
+def test_session_rows_keep_values_and_order():
+    rows = session_rows(ROWS)
+
+    assert rows == [
+        SessionRow(
+            session_id=row["session_id"],
+            subject_id=row["subject_id"],
+            date=row["date"],
+            label=row["label"],
+        )
+        for row in ROWS
+    ]
+
+
+def test_session_rows_share_repeated_values():
+    # Build equal strings which are separate objects, as a search returns
+    rows = session_rows(
+        [{key: "".join(value) for key, value in row.items()} for row in ROWS]
+    )
+
+    assert rows[0].subject_id is rows[1].subject_id
+    assert rows[0].date is rows[1].date
+
+
+def test_errors_round_trip():
+    errors = [
+        (ListModeError.LM_FILE_TOO_SMALL, "a.bf - 5"),
+        (ListModeError.WRONG_NORM_COUNT, "1"),
+        (ListModeError.NORM_MISSING, ""),
+    ]
+
+    assert decode_listmode_errors(encode_listmode_errors(errors)) == [
+        "LM File is too small a.bf - 5",
+        "Wrong number of Norm files: 1",
+        "Norm does not exist",
+    ]
+
+
+def test_errors_with_separators_in_details_round_trip():
+    errors = [
+        (ListModeError.LM_FILE_TOO_SMALL, 'a;b:c.bf - 5"'),
+        (ListModeError.LM_MISSING, ""),
+    ]
+
+    assert decode_listmode_errors(encode_listmode_errors(errors)) == [
+        'LM File is too small a;b:c.bf - 5"',
+        "LM does not exist",
+    ]
+
+
+def test_equal_errors_share_one_string():
+    errors = [(ListModeError.WRONG_LM_COUNT, "3")]
+
+    assert encode_listmode_errors(errors) is encode_listmode_errors(list(errors))
+
+
+def test_record_round_trips_through_json():
+    session = session_rows(ROWS)[0]
+    record = listmode_record(session, [(ListModeError.LM_MISSING, "")])
+
+    # Checkpoints, shard results and the change cache store records as JSON
+    restored = ListModeRecord(**json.loads(json.dumps(asdict(record))))
+
+    assert restored == record
+    assert "Errors: LM does not exist<br>" in restored.error_html()
+
+
+def test_no_record_without_errors():
+    assert listmode_record(session_rows(ROWS)[0], []) is None
+
+
+def test_rendered_html_from_earlier_versions_kept():
+    record = ListModeRecord(
+        id="XNAT_E00001",
+        label="12345678_03_PETMR",
+        subject_id="XNAT_S00001",
+        date="2026-10-01",
+        errors="Subject ID: XNAT_S00001 Errors: LM does not exist<br>",
+    )
+
+    assert record.error_html() == record.errors
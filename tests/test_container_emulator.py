@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import pytest
+
+from drc_containers.container_emulator import (
+    load_wrappers,
+    plan_jobs,
+    resolve_command_line,
+)
+
+DEFINITIONS_DIR = str(Path(__file__).parent.parent)
+
+COMMAND = {
+    "command-line": 'email_listmode "#PROJECTID#" "#THRESHOLDDAYS#" "#EMAILLIST#"',
+    "inputs": [
+        {"name": "project-id", "required": True, "replacement-key": "#PROJECTID#"},
+        {"name": "email-list", "required": True, "replacement-key": "#EMAILLIST#"},
+        {
+            "name": "threshold-days",
+            "required": True,
+            "replacement-key": "#THRESHOLDDAYS#",
+            "default-value": 90,
+        },
+    ],
+}
+WRAPPER = {
+    "name": "email-listmode-project",
+    "derived-inputs": [
+        {
+            "derived-from-wrapper-input": "project",
+            "derived-from-xnat-object-property": "id",
+            "provides-value-for-command-input": "project-id",
+        }
+    ],
+}
+
+
+def test_values_derived_from_external_inputs_and_defaults():
+    args = resolve_command_line(
+        COMMAND,
+        WRAPPER,
+        external_inputs={"project": {"id": "PROJ"}},
+        input_values={"email-list": "user1@foo.org, user2@foo.org"},
+    )
+
+    assert args == ["email_listmode", "PROJ", "90", "user1@foo.org, user2@foo.org"]
+
+
+def test_input_values_override_derived_values_and_defaults():
+    args = resolve_command_line(
+        COMMAND,
+        WRAPPER,
+        external_inputs={"project": {"id": "PROJ"}},
+        input_values={
+            "project-id": "OTHER",
+            "email-list": "user1@foo.org",
+            "threshold-days": 30,
+        },
+    )
+
+    assert args == ["email_listmode", "OTHER", "30", "user1@foo.org"]
+
+
+def test_missing_required_input():
+    with pytest.raises(ValueError, match="email-list"):
+        resolve_command_line(
+            COMMAND,
+            WRAPPER,
+            external_inputs={"project": {"id": "PROJ"}},
+            input_values={},
+        )
+
+
+def test_plan_jobs_from_command_definitions():
+    wrappers = load_wrappers(DEFINITIONS_DIR)
+    events = [
+        {
+            "wrapper": "email-listmode-project",
+            "count": 2,
+            "external-inputs": {"project": {"id": "PROJ{n}"}},
+            "inputs": {"email-list": "user1@foo.org"},
+        },
+        {
+            # The cron wrapper has no derived inputs, so the project is set
+            # directly, as by the event subscription
+            "wrapper": "cron-email-listmode-project",
+            "inputs": {"project-id": "CRON", "email-list": "user2@foo.org"},
+        },
+    ]
+
+    jobs = plan_jobs(wrappers, events)
+
+    # Launches of different events are interleaved
+    assert [(name, args[1]) for name, args in jobs] == [
+        ("email-listmode-project", "PROJ0"),
+        ("cron-email-listmode-project", "CRON"),
+        ("email-listmode-project", "PROJ1"),
+    ]
+    assert all(args[0] == "email_listmode" for _, args in jobs)
+
+
+def test_plan_jobs_with_unknown_wrapper():
+    with pytest.raises(ValueError, match="Unknown wrapper"):
+        plan_jobs({}, [{"wrapper": "missing"}])
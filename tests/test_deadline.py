@@ -0,0 +1,90 @@
+import time
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from drc_containers.xnat_utils.deadline import (
+    Deadline,
+    DeadlineExpired,
+    apply_deadline,
+    is_deadline_error,
+)
+
+
+@pytest.fixture
+def timed_out_session(monkeypatch):
+    """Return a requests Session whose requests all time out"""
+
+    def send(self, request, timeout=None, **kwargs):
+        raise requests.exceptions.ReadTimeout(f"Read timed out ({timeout})")
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    return requests.Session()
+
+
+def test_timeout_after_deadline_is_deadline_error(monkeypatch):
+    deadline = Deadline(seconds=60)
+
+    def send(self, request, timeout=None, **kwargs):
+        # The budget runs out while the request is in flight
+        deadline._end -= 60
+        raise requests.exceptions.ReadTimeout(f"Read timed out ({timeout})")
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    http_session = requests.Session()
+    apply_deadline(http_session, deadline)
+
+    with pytest.raises(DeadlineExpired) as ex:
+        http_session.get("https://xnat.invalid/data/projects")
+    assert is_deadline_error(ex.value)
+    assert isinstance(ex.value.__cause__, requests.exceptions.Timeout)
+
+
+def test_timeout_within_deadline_is_not_deadline_error(timed_out_session):
+    apply_deadline(timed_out_session, Deadline(seconds=3600))
+
+    with pytest.raises(requests.exceptions.Timeout) as ex:
+        timed_out_session.get("https://xnat.invalid/data/projects")
+    assert not is_deadline_error(ex.value)
+
+
+def test_no_request_sent_after_deadline(timed_out_session):
+    deadline = Deadline(seconds=10, reserve=10)
+    apply_deadline(timed_out_session, deadline)
+
+    with pytest.raises(DeadlineExpired):
+        timed_out_session.get("https://xnat.invalid/data/projects")
+
+
+def test_reserve_of_long_budget():
+    assert Deadline(seconds=3600).reserve == 30
+    assert Deadline().reserve == 30
+
+
+@pytest.mark.parametrize("seconds", [5, 20, 30])
+def test_short_budget_leaves_time_for_requests(monkeypatch, seconds):
+    def send(self, request, timeout=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.timeout = timeout
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    deadline = Deadline(seconds=seconds)
+    http_session = requests.Session()
+    apply_deadline(http_session, deadline)
+
+    assert deadline.reserve == pytest.approx(seconds * 0.1)
+    assert not deadline.expired()
+    response = http_session.get("https://xnat.invalid/data/projects")
+    assert 0 < response.timeout <= seconds * 0.9
+
+
+def test_reserve_released_for_sending(monkeypatch):
+    deadline = Deadline(seconds=20)
+    monkeypatch.setattr(time, "monotonic", lambda: deadline._end - 1)
+
+    assert deadline.expired()
+    deadline.use_reserve()
+    assert deadline.remaining() == pytest.approx(1)
@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from drc_containers.xnat_utils.deadline import Deadline, DeadlineExpired, apply_deadline
+from drc_containers.xnat_utils.dedup import RequestDeduplicator
+
+SERVER = "https://xnat.example.org"
+
+
+class FakeServer:
+    """Replaces the requests transport, counting the requests sent"""
+
+    def __init__(self):
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def send(self, adapter, request, **kwargs):
+        self.sent.append((request.method, request.url))
+        self.release.wait()
+        response = requests.Response()
+        response.status_code = 200
+        response._content = f"{request.method} {request.url}".encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(HTTPAdapter, "send", server.send)
+    return server
+
+
+@pytest.fixture
+def deduplicator(server):
+    with RequestDeduplicator() as deduplicator:
+        yield deduplicator
+
+
+def session(user: str = "user") -> requests.Session:
+    http_session = requests.Session()
+    http_session.auth = (user, "password")
+    return http_session
+
+
+def test_identical_gets_served_from_memo(server, deduplicator):
+    first = session().get(f"{SERVER}/data/projects")
+    second = session().get(f"{SERVER}/data/projects")
+
+    assert len(server.sent) == 1
+    assert second.content == first.content
+    assert deduplicator.stats.memo_hits == 1
+
+
+def test_requests_with_different_credentials_not_shared(server, deduplicator):
+    session("user1").get(f"{SERVER}/data/projects")
+    session("user2").get(f"{SERVER}/data/projects")
+
+    assert len(server.sent) == 2
+
+
+def test_searches_keyed_by_body(server, deduplicator):
+    http_session = session()
+    http_session.post(f"{SERVER}/data/search", data="<search>A</search>")
+    http_session.post(f"{SERVER}/data/search", data="<search>B</search>")
+    http_session.post(f"{SERVER}/data/search", data="<search>A</search>")
+
+    assert len(server.sent) == 2
+
+
+@pytest.mark.parametrize(
+    "method, url, kwargs",
+    [
+        ("POST", f"{SERVER}/data/JSESSION", {}),
+        ("GET", f"{SERVER}/data/JSESSION", {}),
+        ("GET", f"{SERVER}/data/files/scan.dcm", {"stream": True}),
+    ],
+)
+def test_requests_always_sent(server, deduplicator, method, url, kwargs):
+    http_session = session()
+    http_session.request(method, url, **kwargs)
+    http_session.request(method, url, **kwargs)
+
+    assert len(server.sent) == 2
+
+
+def test_write_clears_memo(server, deduplicator):
+    http_session = session()
+    http_session.get(f"{SERVER}/data/projects/P/subjects")
+    http_session.put(f"{SERVER}/data/projects/P/subjects/S1/projects/Q")
+    http_session.get(f"{SERVER}/data/projects/P/subjects")
+
+    assert [method for method, _ in server.sent] == ["GET", "PUT", "GET"]
+
+
+def test_read_only_requests_keep_memo(server, deduplicator):
+    http_session = session()
+    http_session.get(f"{SERVER}/data/projects/P/subjects")
+    http_session.head(f"{SERVER}/data/projects/P")
+    http_session.get(f"{SERVER}/data/files/scan.dcm", stream=True)
+    http_session.get(f"{SERVER}/data/projects/P/subjects")
+
+    assert [method for method, _ in server.sent] == ["GET", "HEAD", "GET"]
+
+
+def test_identical_requests_in_flight_share_response(server):
+    with RequestDeduplicator(memo_seconds=0) as deduplicator:
+        server.release.clear()
+        responses = []
+
+        def get():
+            responses.append(session().get(f"{SERVER}/data/projects"))
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while deduplicator.stats.requests < 3:
+            time.sleep(0.01)
+        server.release.set()
+        for thread in threads:
+            thread.join()
+
+    assert len(server.sent) == 1
+    assert deduplicator.stats.shared == 2
+    assert len({response.content for response in responses}) == 1
+
+
+class HangingServer(FakeServer):
+    """Holds the first request until released, and answers the others at
+    once"""
+
+    def __init__(self):
+        super().__init__()
+        self.release.clear()
+
+    def send(self, adapter, request, **kwargs):
+        if not self.sent:
+            return super().send(adapter, request, **kwargs)
+        self.sent.append((request.method, request.url))
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        return response
+
+
+@pytest.fixture
+def hanging_server(monkeypatch):
+    server = HangingServer()
+    monkeypatch.setattr(HTTPAdapter, "send", server.send)
+    yield server
+    server.release.set()
+
+
+def start_hanging_request(deduplicator: RequestDeduplicator) -> threading.Thread:
+    thread = threading.Thread(
+        target=lambda: session().get(f"{SERVER}/data/projects"), daemon=True
+    )
+    thread.start()
+    while deduplicator.stats.requests < 1:
+        time.sleep(0.01)
+    return thread
+
+
+def test_request_sent_when_identical_request_hangs(hanging_server):
+    with RequestDeduplicator(memo_seconds=0) as deduplicator:
+        start_hanging_request(deduplicator)
+
+        response = session().get(f"{SERVER}/data/projects", timeout=0.2)
+
+    assert response.status_code == 200
+    assert len(hanging_server.sent) == 2
+    assert deduplicator.stats.shared == 0
+
+
+def test_wait_for_identical_request_stops_at_deadline(hanging_server):
+    with RequestDeduplicator(memo_seconds=0) as deduplicator:
+        start_hanging_request(deduplicator)
+        http_session = session()
+        apply_deadline(http_session, Deadline(seconds=0.2, reserve=0))
+
+        with pytest.raises(DeadlineExpired):
+            http_session.get(f"{SERVER}/data/projects")
+
+    assert len(hanging_server.sent) == 1
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+
+import pytest
+from pyxnat.core.errors import DatabaseError
+
+from drc_containers.xnat_utils.outbox import Outbox, send_or_queue_email
+
+HOST = "https://xnat.example.org"
+
+
+class MailSession:
+    """Stand-in for a pyxnat Interface which records the emails sent
+    through the XNAT mail service"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.sent = []
+
+    def _exec(self, uri, method, body):
+        if self.failures:
+            self.failures -= 1
+            raise DatabaseError("Mail service unavailable")
+        self.sent.append(body["subject"])
+
+
+def enqueue(outbox: Outbox, subject: str = "Report") -> str:
+    return outbox.enqueue(
+        host=HOST, subject=subject, content_html="<p>Report</p>", to=["a@b.org"]
+    )
+
+
+def pending_messages(outbox_dir) -> list[dict]:
+    messages = []
+    for name in sorted(os.listdir(outbox_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(outbox_dir, name)) as f:
+                messages.append(json.load(f))
+    return messages
+
+
+def test_failed_message_retried_later(tmp_path):
+    outbox = Outbox(tmp_path, base_delay=60)
+    enqueue(outbox)
+    session = MailSession(failures=1)
+
+    result = outbox.flush(session, HOST)
+    assert (result.sent, result.pending) == (0, 1)
+    [message] = pending_messages(tmp_path)
+    assert message["attempts"] == 1
+    assert message["last_error"] == "Mail service unavailable"
+
+    # The retry is not yet due
+    assert outbox.flush(session, HOST).pending == 1
+    assert not session.sent
+
+    result = outbox.flush(session, HOST, ignore_schedule=True)
+    assert (result.sent, result.pending) == (1, 0)
+    assert session.sent == ["Report"]
+    assert not pending_messages(tmp_path)
+
+
+def test_retries_within_flush(tmp_path):
+    outbox = Outbox(tmp_path)
+    enqueue(outbox)
+    session = MailSession(failures=2)
+
+    result = outbox.flush(session, HOST, retries=2, retry_delay=0)
+
+    assert result.sent == 1
+    assert session.sent == ["Report"]
+
+
+def test_message_given_up_after_max_attempts(tmp_path):
+    outbox = Outbox(tmp_path, max_attempts=2)
+    enqueue(outbox)
+    session = MailSession(failures=2)
+
+    result = outbox.flush(session, HOST, retries=1, retry_delay=0)
+
+    assert result.failed == 1
+    assert not pending_messages(tmp_path)
+    assert len(os.listdir(tmp_path / "failed")) == 1
+
+
+def test_messages_for_other_servers_left_in_outbox(tmp_path):
+    outbox = Outbox(tmp_path)
+    enqueue(outbox)
+    session = MailSession()
+
+    result = outbox.flush(session, "https://other.example.org")
+
+    assert result.sent == 0
+    assert not session.sent
+    assert len(pending_messages(tmp_path)) == 1
+
+
+def test_programming_errors_not_retried(tmp_path):
+    outbox = Outbox(tmp_path)
+    enqueue(outbox)
+
+    with pytest.raises(AttributeError):
+        outbox.flush(object(), HOST)
+
+
+def test_concurrent_flush_waits_for_lock(tmp_path):
+    outbox = Outbox(tmp_path)
+    enqueue(outbox)
+    session = MailSession()
+    results = []
+
+    def flush():
+        results.append(Outbox(tmp_path).flush(session, HOST))
+
+    with outbox._lock():
+        flusher = threading.Thread(target=flush)
+        flusher.start()
+        flusher.join(timeout=0.2)
+        # The other flush cannot send while the lock is held
+        assert flusher.is_alive()
+        assert not session.sent
+    flusher.join()
+
+    assert outbox.flush(session, HOST).sent == 0
+    assert session.sent == ["Report"]
+    assert results[0].sent == 1
+
+
+def test_send_or_queue_email_sends_earlier_messages(tmp_path):
+    enqueue(Outbox(tmp_path), subject="Earlier report")
+    session = MailSession()
+
+    send_or_queue_email(
+        session=session,
+        host=HOST,
+        subject="Report",
+        content_html="<p>Report</p>",
+        to=["a@b.org"],
+        debug_output=False,
+        outbox_dir=str(tmp_path),
+    )
+
+    assert session.sent == ["Earlier report", "Report"]
+    assert not pending_messages(tmp_path)
@@ -0,0 +1,95 @@
+import pytest
+
+from drc_containers.email_listmode import plan_resource_checks, resource_check_costs
+from drc_containers.email_radreads import scan_check_costs
+from drc_containers.xnat_utils.planner import (
+    BULK,
+    PER_ITEM,
+    REQUEST_SECONDS,
+    QueryPlan,
+    StrategyCost,
+)
+
+
+class CountingBackend:
+    """Stand-in QueryBackend for a project with a number of sessions"""
+
+    def __init__(self, num_project_sessions: int):
+        self.num_project_sessions = num_project_sessions
+        self.counts = 0
+
+    def count_sessions(self, datatype, project_name):
+        self.counts += 1
+        return self.num_project_sessions
+
+
+def test_cost_in_seconds():
+    cost = StrategyCost(strategy=BULK, requests=10, bytes=5_000_000)
+
+    assert cost.seconds == pytest.approx(10 * REQUEST_SECONDS + 1)
+
+
+def test_cheapest_strategy_chosen():
+    plan = QueryPlan()
+    slow = StrategyCost(strategy=PER_ITEM, requests=1000, bytes=0)
+    fast = StrategyCost(strategy=BULK, requests=1, bytes=1000)
+
+    assert plan.choose("scans", items=1000, options=[slow, fast]) == BULK
+    assert plan.strategy("scans") == BULK
+    assert plan.steps[0].rejected == [slow]
+    assert plan.strategy("resources") is None
+
+
+def test_explain_totals_chosen_strategies():
+    plan = QueryPlan(estimate_requests=1)
+    plan.choose("scans", 10, [StrategyCost(PER_ITEM, 10, 100)])
+    plan.choose("resources", 10, [StrategyCost(BULK, 2, 400)])
+
+    explanation = plan.explain()
+
+    assert explanation.startswith("Plan: 2 phases, 1 requests made")
+    assert explanation.endswith("Estimated total: ~12 requests, ~500 bytes")
+
+
+@pytest.mark.parametrize(
+    "costs",
+    [resource_check_costs, scan_check_costs],
+)
+@pytest.mark.parametrize(
+    "num_sessions, num_project_sessions, expected",
+    [
+        # A few recent sessions of a very large project
+        (5, 1_000_000, PER_ITEM),
+        # Most of the sessions of a project
+        (900, 1000, BULK),
+    ],
+)
+def test_strategy_depends_on_cardinality(
+    costs, num_sessions, num_project_sessions, expected
+):
+    plan = QueryPlan()
+    options = costs(num_sessions, num_project_sessions)
+
+    assert plan.choose("phase", num_sessions, options) == expected
+
+
+def test_project_counted_when_bulk_may_be_cheaper():
+    plan = QueryPlan()
+    backend = CountingBackend(num_project_sessions=1_000_000)
+
+    strategy = plan_resource_checks(plan, backend, "xnat:petSessionData", "P", 5)
+
+    assert strategy == PER_ITEM
+    assert backend.counts == 1
+    assert plan.estimate_requests == 1
+
+
+def test_bulk_chosen_for_most_of_project():
+    plan = QueryPlan()
+    backend = CountingBackend(num_project_sessions=1000)
+
+    strategy = plan_resource_checks(plan, backend, "xnat:petSessionData", "P", 900)
+
+    assert strategy == BULK
+    assert plan.steps[0].items == 900
+    assert plan.steps[0].rejected[0].strategy == PER_ITEM
@@ -0,0 +1,82 @@
+import pytest
+
+from drc_containers.xnat_utils import profiling
+from drc_containers.xnat_utils.profiling import Profiler, profile_run, span
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(profiling.time, "perf_counter", clock)
+    monkeypatch.setattr(profiling.time, "thread_time", clock)
+    monkeypatch.delenv("DRC_PROFILE", raising=False)
+    return clock
+
+
+@span("check_session")
+def check_session(clock: Clock):
+    clock.now += 0.5
+
+
+def run_command(clock: Clock):
+    with span("search"):
+        clock.now += 1
+    for _ in range(2):
+        check_session(clock)
+    clock.now += 0.25
+
+
+def test_folded_stacks_give_self_time(clock, tmp_path):
+    output_path = str(tmp_path / "profile")
+
+    with profile_run("email_listmode", output_path=output_path):
+        run_command(clock)
+
+    with open(output_path + ".folded") as f:
+        assert f.read().splitlines() == [
+            "email_listmode 250000",
+            "email_listmode;check_session 1000000",
+            "email_listmode;search 1000000",
+        ]
+
+
+def test_summary(clock):
+    profiler = Profiler("email_listmode")
+    profiler.enter("email_listmode")
+    clock.now += 0.5
+    profiler.enter("check_session")
+    clock.now += 1.5
+    profiler.exit()
+    profiler.exit()
+
+    assert profiler.summary() == (
+        "Profile email_listmode: check_session 1x 1.50s (cpu 1.50s); "
+        "email_listmode 1x 2.00s (cpu 2.00s)"
+    )
+
+
+def test_profile_run_prints_summary(clock, tmp_path, capsys):
+    with profile_run("email_listmode", output_path=str(tmp_path / "profile")):
+        run_command(clock)
+
+    # Spans are listed in the order they first finished
+    assert capsys.readouterr().out == (
+        "Profile email_listmode: search 1x 1.00s (cpu 1.00s); "
+        "check_session 2x 1.00s (cpu 1.00s); email_listmode 1x 2.25s (cpu 2.25s)\n"
+    )
+
+
+def test_spans_not_recorded_without_profiling(clock, tmp_path):
+    with profile_run("email_listmode") as profiler:
+        run_command(clock)
+
+    assert profiler is None
+    assert list(tmp_path.iterdir()) == []
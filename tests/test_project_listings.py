@@ -0,0 +1,147 @@
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+from pyxnat import Interface
+from requests.adapters import HTTPAdapter
+
+from drc_containers.email_listmode import (
+    ListModeError,
+    check_session_from_listing,
+    list_project_resources,
+)
+from drc_containers.email_radreads import list_project_scan_types
+from drc_containers.xnat_utils.query_backend import RestQueryBackend
+
+SERVER = "https://xnat.example.org"
+PET = "xnat:petSessionData"
+MR = "xnat:mrSessionData"
+
+# Responses in the format returned by XNAT for these listings, with one row
+# for each resource or scan of a session and an empty value for a session
+# without any. pyxnat fetches the experiment listings as CSV
+RESPONSES = {
+    ("/data/experiments", PET): (
+        "ID,project,xnat:petsessiondata/subject_id,"
+        "xnat:petsessiondata/resources/resource/label,"
+        "xnat:petsessiondata/resources/resource/file_count,URI\n"
+        "XNAT_E00001,PROJ,XNAT_S00001,LM,2,/data/experiments/XNAT_E00001\n"
+        "XNAT_E00001,PROJ,XNAT_S00001,Norm,2,/data/experiments/XNAT_E00001\n"
+        "XNAT_E00002,PROJ,XNAT_S00002,,,/data/experiments/XNAT_E00002\n"
+    ),
+    ("/data/experiments", MR): (
+        "ID,project,xnat:mrsessiondata/subject_id,"
+        "xnat:mrsessiondata/scans/scan/type,URI\n"
+        "XNAT_E00003,PROJ,XNAT_S00001,T1_MPRAGE,/data/experiments/XNAT_E00003\n"
+        "XNAT_E00003,PROJ,XNAT_S00001,FLAIR,/data/experiments/XNAT_E00003\n"
+        "XNAT_E00004,PROJ,XNAT_S00002,,/data/experiments/XNAT_E00004\n"
+    ),
+    ("/data/projects/PROJ/experiments", PET): json.dumps(
+        {
+            "ResultSet": {
+                "totalRecords": "2",
+                "Result": [
+                    {"ID": "XNAT_E00001", "URI": "/data/experiments/XNAT_E00001"},
+                    {"ID": "XNAT_E00002", "URI": "/data/experiments/XNAT_E00002"},
+                ],
+            }
+        }
+    ),
+    ("/data/projects/PROJ/experiments/XNAT_E00001/resources/LM/files", None): (
+        json.dumps(
+            {
+                "ResultSet": {
+                    "totalRecords": "2",
+                    "Result": [
+                        {"Name": "PET.bf", "Size": "524288", "collection": "LM"},
+                        {"Name": "PET.l", "Size": "1024", "collection": "LM"},
+                    ],
+                }
+            }
+        )
+    ),
+}
+
+
+class RecordedServer:
+    """Replaces the requests transport, answering with RESPONSES"""
+
+    def __init__(self):
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        query = parse_qs(url.query)
+        self.requests.append((url.path, query))
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        response.status_code = 200
+        if url.path == "/data/JSESSION":
+            response._content = b"0123456789ABCDEF"
+            return response
+        content = RESPONSES.get((url.path, query.get("xsiType", [None])[0]))
+        if content is None:
+            response.status_code = 404
+            content = "Not found"
+        response._content = content.encode()
+        return response
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = RecordedServer()
+    monkeypatch.setattr(HTTPAdapter, "send", server.send)
+    return server
+
+
+@pytest.fixture
+def interface(server):
+    return Interface(server=SERVER, user="user", password="password")
+
+
+def test_list_project_resources(server, interface):
+    resources = list_project_resources(interface, PET, "PROJ")
+
+    assert resources == {
+        "XNAT_E00001": [("LM", 2), ("Norm", 2)],
+        "XNAT_E00002": [],
+    }
+    _, query = server.requests[-1]
+    assert query["columns"][0].split(",")[-2:] == [
+        f"{PET}/resources/resource/label",
+        f"{PET}/resources/resource/file_count",
+    ]
+
+
+def test_check_session_from_listing(interface):
+    errors = check_session_from_listing(
+        interface, "XNAT_E00001", "PROJ", resources=[("LM", 2), ("Norm", 2)]
+    )
+
+    assert errors == [(ListModeError.LM_FILE_TOO_SMALL, "PET.bf - 524288")]
+
+
+def test_list_project_scan_types(interface):
+    scan_types = list_project_scan_types(interface, MR, "PROJ")
+
+    assert scan_types == {"XNAT_E00003": ["T1_MPRAGE", "FLAIR"], "XNAT_E00004": []}
+
+
+def test_listing_without_requested_column_is_ignored(monkeypatch, interface):
+    monkeypatch.setitem(
+        RESPONSES,
+        ("/data/experiments", MR),
+        "ID,project,xnat:mrsessiondata/subject_id,URI\n"
+        "XNAT_E00003,PROJ,XNAT_S00001,/data/experiments/XNAT_E00003\n",
+    )
+
+    assert list_project_scan_types(interface, MR, "PROJ") == {}
+
+
+def test_rest_backend_counts_sessions_from_id_listing(server, interface):
+    assert RestQueryBackend(interface).count_sessions(PET, "PROJ") == 2
+    path, query = server.requests[-1]
+    assert path == "/data/projects/PROJ/experiments"
+    assert query["columns"] == ["ID"]
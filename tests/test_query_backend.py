@@ -0,0 +1,194 @@
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from drc_containers.email_chenies import get_mr_subject_labels
+from drc_containers.email_listmode import get_recent_sessions, get_sessions_by_id
+from drc_containers.email_radreads import (
+    SessionRecord,
+    get_sessions_needing_radread,
+    radread_query,
+)
+from drc_containers.xnat_utils.change_feed import SessionResultCache, get_changed_items
+from drc_containers.xnat_utils.query_backend import REPORTING_TABLES, SqlQueryBackend
+
+RECENT = (date.today() - timedelta(days=10)).isoformat()
+OLD = (date.today() - timedelta(days=400)).isoformat()
+
+ELEMENTS = [(1, "xnat:mrSessionData"), (2, "xnat:petmrSessionData")]
+SUBJECTS = [
+    ("XNAT_S00001", "11111111_A", "PETMR"),
+    ("XNAT_S00002", "22222222_B", "MR1"),
+    ("XNAT_S00003", "33333333_C", "OTHER"),
+]
+# (id, label, date, project, element, subject)
+EXPERIMENTS = [
+    ("XNAT_E00001", "11111111_03_PETMR", RECENT, "PETMR", 2, "XNAT_S00001"),
+    ("XNAT_E00002", "11111111_02_PETMR", OLD, "PETMR", 2, "XNAT_S00001"),
+    ("XNAT_E00003", "22222222_MR", RECENT, "MR1", 1, "XNAT_S00002"),
+    ("XNAT_E00004", "33333333_MR", RECENT, "OTHER", 1, "XNAT_S00003"),
+    ("XNAT_E00005", "11111111_MR", RECENT, "MR3", 1, "XNAT_S00001"),
+    ("XNAT_R00001", "11111111_RR", RECENT, "PETMR", None, None),
+]
+
+
+@pytest.fixture
+def backend():
+    connection = sqlite3.connect(":memory:")
+    for table in REPORTING_TABLES:
+        connection.execute(table)
+    connection.executemany("INSERT INTO xdat_meta_element VALUES (?, ?)", ELEMENTS)
+    connection.executemany("INSERT INTO xnat_subjectdata VALUES (?, ?, ?)", SUBJECTS)
+    for n, (experiment_id, label, day, project, element, subject) in enumerate(
+        EXPERIMENTS
+    ):
+        connection.execute(
+            "INSERT INTO xnat_experimentdata VALUES (?, ?, ?, ?, ?, ?)",
+            (experiment_id, label, day, project, element, n),
+        )
+        connection.execute(
+            "INSERT INTO xnat_experimentdata_meta_data VALUES (?, ?)",
+            (n, f"{day} 12:00:00"),
+        )
+        if subject:
+            connection.execute(
+                "INSERT INTO xnat_subjectassessordata VALUES (?, ?)",
+                (experiment_id, subject),
+            )
+    # The MR session of OTHER is shared into MR2
+    connection.execute(
+        "INSERT INTO xnat_experimentdata_share VALUES (?, ?, ?)",
+        ("XNAT_E00004", "MR2", "33333333_MR"),
+    )
+    connection.execute(
+        "INSERT INTO nshdni_radread VALUES (?, ?)", ("XNAT_R00001", "XNAT_E00001")
+    )
+    connection.executemany(
+        "INSERT INTO wrk_workflowdata VALUES (?, ?, ?, ?, ?)",
+        [
+            (1, "XNAT_E00001", "PETMR", "xnat:petmrSessionData", f"{RECENT} 09:00"),
+            (2, "XNAT_E00002", "PETMR", "xnat:petmrSessionData", f"{OLD} 09:00"),
+            (3, "XNAT_E00003", "MR1", "xnat:mrSessionData", f"{RECENT} 09:00"),
+        ],
+    )
+    with SqlQueryBackend(connection) as backend:
+        yield backend
+
+
+def test_recent_sessions(backend):
+    rows = get_recent_sessions(None, "xnat:petmrSessionData", 90, "PETMR", backend)
+
+    assert rows == [
+        {
+            "session_id": "XNAT_E00001",
+            "subject_id": "XNAT_S00001",
+            "date": RECENT,
+            "label": "11111111_03_PETMR",
+            "project": "PETMR",
+        }
+    ]
+
+
+def test_sessions_by_id(backend):
+    rows = get_sessions_by_id(
+        backend,
+        "xnat:petmrSessionData",
+        "PETMR",
+        ["XNAT_E00002", "XNAT_E00003", "XNAT_E99999"],
+    )
+
+    assert [row["session_id"] for row in rows] == ["XNAT_E00002"]
+    assert rows[0]["label"] == "11111111_02_PETMR"
+
+
+def test_sessions_shared_into_project(backend):
+    rows = get_recent_sessions(None, "xnat:mrSessionData", 90, "MR2", backend)
+
+    # As in the REST search, the row gives the original project and label
+    assert [(row["session_id"], row["project"]) for row in rows] == [
+        ("XNAT_E00004", "OTHER")
+    ]
+
+
+def test_count_sessions(backend):
+    assert backend.count_sessions("xnat:petmrSessionData", "PETMR") == 2
+    # Sessions shared into the project are counted
+    assert backend.count_sessions("xnat:mrSessionData", "MR2") == 1
+    assert backend.count_sessions("xnat:mrSessionData", "PETMR") == 0
+
+
+def test_mr_subject_labels(backend):
+    labels = get_mr_subject_labels(None, ["MR1", "MR2"], query_backend=backend)
+
+    assert labels == {"22222222", "33333333"}
+
+
+def test_subjects_with_sessions_in_project(backend):
+    rows = backend.search(
+        "xnat:subjectData",
+        ["xnat:subjectData/SUBJECT_ID", "xnat:subjectData/PROJECT"],
+        [
+            ("xnat:mrSessionData/project", "=", "MR2"),
+            ("xnat:mrSessionData/project", "=", "MR3"),
+            "OR",
+        ],
+    )
+
+    # One row per subject, including the subject of the session shared
+    # into MR2
+    assert sorted(rows, key=lambda row: row["subject_id"]) == [
+        {"subject_id": "XNAT_S00001", "project": "PETMR"},
+        {"subject_id": "XNAT_S00003", "project": "OTHER"},
+    ]
+
+
+def test_unsupported_subject_constraint(backend):
+    with pytest.raises(ValueError):
+        backend.search(
+            "xnat:subjectData",
+            ["xnat:subjectData/SUBJECT_ID"],
+            [("nshdni:radRead/project", "=", "PETMR")],
+        )
+
+
+def test_radreads(backend):
+    rows = backend.search("nshdni:radRead", *radread_query("PETMR"))
+
+    assert rows == [{"nshdni_col_radreadimagesession_id": "XNAT_E00001"}]
+
+
+def test_radread_cache_keeps_only_candidates(backend, tmp_path):
+    with SessionResultCache(
+        str(tmp_path / "changes.db"), "host", "radreads", SessionRecord
+    ) as cache:
+        cache.update(started=datetime.now(timezone.utc), full=True)
+        for session_id in ["XNAT_E00001", "XNAT_E00002", "XNAT_E09999"]:
+            cache.store(session_id, SessionRecord(session_id, "label", "subject"))
+
+        records = get_sessions_needing_radread(
+            None, "PETMR", [], query_backend=backend, result_cache=cache
+        )
+
+        # XNAT_E00001 now has a read and XNAT_E09999 no longer exists
+        assert {r.id for r in records} == {"XNAT_E00002"}
+        assert cache.records() == records
+
+
+def test_changed_items(backend):
+    changed = get_changed_items(backend, "PETMR", RECENT)
+
+    assert changed == {"XNAT_E00001": "xnat:petmrSessionData"}
+
+
+@pytest.mark.parametrize(
+    "root_element, columns",
+    [
+        ("xnat:projectData", ["xnat:projectData/ID"]),
+        ("xnat:mrSessionData", ["xnat:mrSessionData/UNKNOWN_FIELD"]),
+        ("xnat:mrSessionData", ["xnat:petmrSessionData/LABEL"]),
+    ],
+)
+def test_unsupported_search(backend, root_element, columns):
+    with pytest.raises(ValueError):
+        backend.search(root_element, columns, [])
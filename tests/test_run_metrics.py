@@ -0,0 +1,65 @@
+from drc_containers.xnat_utils.run_metrics import (
+    RunMetrics,
+    append_history,
+    find_regressions,
+    read_history,
+)
+
+
+def run(duration: float, project: str = "PROJ", status: str = "ok") -> RunMetrics:
+    return RunMetrics(
+        command="email_listmode",
+        project=project,
+        duration_seconds=duration,
+        status=status,
+    )
+
+
+def test_slow_run_flagged():
+    slow = run(300)
+    runs = [run(100), run(110), run(90), run(105), slow]
+
+    assert find_regressions(runs) == [(slow, 102.5)]
+
+
+def test_no_regression_within_normal_variation():
+    runs = [run(100), run(110), run(90), run(105), run(140)]
+
+    assert find_regressions(runs) == []
+
+
+def test_variable_run_times_not_flagged():
+    # The deviation of the baseline runs is large, so a run which takes
+    # twice the baseline is not unusual
+    runs = [run(20), run(200), run(100), run(210)]
+
+    assert find_regressions(runs) == []
+
+
+def test_failed_runs_excluded_from_baseline():
+    runs = [run(100), run(1000, status="error"), run(100), run(100), run(300)]
+
+    assert [
+        (r.duration_seconds, baseline) for r, baseline in find_regressions(runs)
+    ] == [(300, 100)]
+
+
+def test_baseline_kept_per_project():
+    runs = [run(100), run(100), run(100), run(300, project="OTHER")]
+
+    assert find_regressions(runs) == []
+
+
+def test_empty_history(tmp_path):
+    runs = read_history(str(tmp_path / "history.jsonl"))
+
+    assert runs == []
+    assert find_regressions(runs) == []
+
+
+def test_history_round_trip(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    for duration in [100, 110, 300]:
+        append_history(path, run(duration))
+
+    assert [r.duration_seconds for r in read_history(path)] == [100, 110, 300]
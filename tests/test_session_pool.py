@@ -0,0 +1,140 @@
+import pytest
+import requests
+
+from drc_containers.xnat_utils import session_pool
+from drc_containers.xnat_utils.session_pool import SessionPool
+
+KEY = ("https://xnat.example.org", "user")
+
+
+class FakeSession:
+    """Stands in for an xnat session, with a requests Session and a cache"""
+
+    def __init__(self):
+        self.http_session = requests.Session()
+        self.cache = {}
+        self.cache_clears = 0
+        self.closed = False
+
+    def clearcache(self):
+        self.cache.clear()
+        self.cache_clears += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_pool.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def pool(clock):
+    pool = SessionPool(max_idle=600, max_cache_age=300)
+    yield pool
+    pool.close()
+
+
+def use(pool: SessionPool, key: tuple = KEY):
+    return pool.session(
+        key=key, factory=FakeSession, http_session=lambda s: s.http_session
+    )
+
+
+def test_session_reused(pool):
+    with use(pool) as first:
+        pass
+    with use(pool) as second:
+        pass
+
+    assert second is first
+    assert (pool.opened, pool.reused) == (1, 1)
+
+
+def test_sessions_not_shared_between_keys(pool):
+    with use(pool) as first:
+        pass
+    with use(pool, key=("https://other.example.org", "user")) as second:
+        pass
+
+    assert second is not first
+    assert pool.opened == 2
+
+
+def test_concurrent_jobs_get_their_own_sessions(pool):
+    with use(pool) as first, use(pool) as second:
+        assert second is not first
+
+
+def test_hooks_and_adapters_removed_before_reuse(pool):
+    with use(pool) as session:
+        original_adapter = session.http_session.get_adapter("https://")
+        session.http_session.hooks["response"].append(lambda r, **kwargs: r)
+        session.http_session.mount("https://", requests.adapters.HTTPAdapter())
+    with use(pool) as session:
+        assert session.http_session.hooks["response"] == []
+        assert session.http_session.get_adapter("https://") is original_adapter
+
+
+def test_cache_kept_between_jobs(pool, clock):
+    with use(pool) as session:
+        session.cache["projects"] = ["PROJ"]
+    clock.now += 60
+    with use(pool) as session:
+        assert session.cache == {"projects": ["PROJ"]}
+        assert session.cache_clears == 0
+
+
+def test_old_cache_cleared_before_reuse(pool, clock):
+    with use(pool) as session:
+        session.cache["projects"] = ["PROJ"]
+    # The session is kept busy, so it never becomes idle
+    for _ in range(4):
+        clock.now += 100
+        with use(pool) as session:
+            pass
+
+    assert session.cache == {}
+    assert session.cache_clears == 1
+
+
+def test_idle_session_closed(pool, clock):
+    with use(pool) as first:
+        pass
+    clock.now += 601
+    with use(pool) as second:
+        pass
+
+    assert second is not first
+    assert first.closed
+    assert pool.opened == 2
+
+
+def test_session_closed_after_exception(pool):
+    with pytest.raises(RuntimeError), use(pool) as first:
+        raise RuntimeError("job failed")
+    with use(pool) as second:
+        pass
+
+    assert first.closed
+    assert second is not first
+
+
+def test_close(pool):
+    with use(pool) as session:
+        pass
+
+    pool.close()
+
+    assert session.closed
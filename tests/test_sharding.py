@@ -0,0 +1,105 @@
+import json
+import os
+from dataclasses import dataclass
+
+import pytest
+
+from drc_containers.xnat_utils.deadline import Coverage
+from drc_containers.xnat_utils.sharding import (
+    Shard,
+    merge_partial_results,
+    remove_partial_results,
+    write_partial_results,
+)
+
+KEY = "email_listmode-PROJ-90"
+SESSION_IDS = [f"XNAT_E{n:05d}" for n in range(200)]
+
+
+@dataclass(frozen=True)
+class Record:
+    session_id: str
+
+
+def test_every_session_in_exactly_one_shard():
+    shards = [Shard(index, 4) for index in range(4)]
+    for session_id in SESSION_IDS:
+        assert sum(shard.contains(session_id) for shard in shards) == 1
+    # The hash is spread over all the shards
+    assert all(any(shard.contains(s) for s in SESSION_IDS) for shard in shards)
+
+
+def test_shard_assignment_is_stable():
+    # sha1("XNAT_E00001") starts with 0xdc55..., which is 1 modulo 4
+    assert Shard(1, 4).contains("XNAT_E00001")
+
+
+@pytest.mark.parametrize("arg", ["4/4", "-1/4", "0/0", "1", "a/b"])
+def test_invalid_shard(arg):
+    with pytest.raises(ValueError):
+        Shard.parse(arg)
+
+
+def write_shards(shard_dir, num_shards):
+    for index in range(num_shards):
+        shard = Shard(index, num_shards)
+        session_ids = [s for s in SESSION_IDS if shard.contains(s)]
+        write_partial_results(
+            shard_dir=shard_dir,
+            key=KEY,
+            shard=shard,
+            # Every shard also reports the same shared record
+            records={Record(s) for s in session_ids[:2]} | {Record("shared")},
+            coverage=Coverage(checked=len(session_ids), total=len(session_ids)),
+        )
+
+
+def test_merge_partial_results(tmp_path):
+    write_shards(tmp_path, 3)
+    coverage = Coverage()
+
+    records = merge_partial_results(tmp_path, KEY, 3, Record, coverage)
+
+    assert len(records) == 7
+    assert Record("shared") in records
+    assert coverage.checked == coverage.total == len(SESSION_IDS)
+    assert coverage.complete
+
+
+def test_missing_shard_truncates_coverage(tmp_path):
+    write_shards(tmp_path, 3)
+    coverage = Coverage()
+
+    records = merge_partial_results(tmp_path, KEY, 4, Record, coverage)
+
+    assert not records
+    assert not coverage.complete
+
+
+def test_stale_shard_results_ignored(tmp_path):
+    write_shards(tmp_path, 2)
+    path = tmp_path / f"{KEY}.shard-1-of-2.json"
+    partial = json.loads(path.read_text())
+    partial["written"] = "2020-01-01T00:00:00+00:00"
+    path.write_text(json.dumps(partial))
+    coverage = Coverage()
+
+    records = merge_partial_results(tmp_path, KEY, 2, Record, coverage)
+
+    shard = Shard(0, 2)
+    assert len(records) == 3
+    assert all(shard.contains(r.session_id) for r in records - {Record("shared")})
+    assert coverage.checked == sum(shard.contains(s) for s in SESSION_IDS)
+    assert coverage.truncated
+    assert not coverage.complete
+
+
+def test_remove_partial_results(tmp_path):
+    write_shards(tmp_path, 2)
+
+    remove_partial_results(tmp_path, KEY, 2)
+
+    assert not os.listdir(tmp_path)
+    coverage = Coverage()
+    assert not merge_partial_results(tmp_path, KEY, 2, Record, coverage)
+    assert coverage.truncated
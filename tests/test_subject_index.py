@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from drc_containers.xnat_utils.subject_index import SubjectLabelIndex
+
+HOST = "https://xnat.example.org"
+
+
+@pytest.fixture
+def index(tmp_path):
+    with SubjectLabelIndex(str(tmp_path / "subjects.db"), host=HOST) as index:
+        yield index
+
+
+def test_new_project_needs_full_refresh(index):
+    assert index.inserted_since("MR1") is None
+    assert index.prefixes("MR1") == set()
+
+
+def test_incremental_refresh_adds_prefixes(index):
+    now = datetime.now(timezone.utc)
+    index.update("MR1", {"11111111", "22222222"}, started=now, full=True)
+    index.update("MR1", {"22222222", "33333333"}, started=now, full=False)
+
+    assert index.prefixes("MR1") == {"11111111", "22222222", "33333333"}
+
+
+def test_sessions_fetched_from_day_before_last_refresh(index):
+    full_refresh = datetime.now(timezone.utc) - timedelta(days=3)
+    refresh = datetime.now(timezone.utc) - timedelta(hours=12)
+    index.update("MR1", {"11111111"}, started=full_refresh, full=True)
+    index.update("MR1", set(), started=refresh, full=False)
+
+    # Going back a day means that sessions added in the 24 hours before the
+    # last refresh are searched again
+    expected = (refresh.date() - timedelta(days=1)).isoformat()
+    assert index.inserted_since("MR1") == expected
+
+
+def test_stale_project_needs_full_refresh(index):
+    full_refresh = datetime.now(timezone.utc) - timedelta(days=8)
+    index.update("MR1", {"11111111"}, started=full_refresh, full=True)
+    # An incremental refresh does not postpone the full refresh
+    index.update("MR1", set(), started=datetime.now(timezone.utc), full=False)
+
+    assert index.inserted_since("MR1") is None
+
+
+def test_full_refresh_removes_missing_prefixes(index):
+    now = datetime.now(timezone.utc)
+    index.update("MR1", {"11111111", "22222222"}, started=now, full=True)
+    index.update("MR1", {"22222222"}, started=now, full=True)
+
+    assert index.prefixes("MR1") == {"22222222"}
+
+
+def test_index_kept_per_host_and_project(tmp_path):
+    path = str(tmp_path / "subjects.db")
+    now = datetime.now(timezone.utc)
+    with SubjectLabelIndex(path, host=HOST) as index:
+        index.update("MR1", {"11111111"}, started=now, full=True)
+        index.update("MR2", {"22222222"}, started=now, full=True)
+    with SubjectLabelIndex(path, host="https://other.example.org") as other:
+        assert other.prefixes("MR1") == set()
+        assert other.inserted_since("MR1") is None
+    with SubjectLabelIndex(path, host=HOST) as index:
+        assert index.prefixes("MR1") == {"11111111"}
+        assert index.inserted_since("MR1") is not None
+
+
+def test_full_refresh_days(tmp_path):
+    full_refresh = datetime.now(timezone.utc) - timedelta(hours=25)
+    with SubjectLabelIndex(
+        str(tmp_path / "subjects.db"), host=HOST, full_refresh_days=1
+    ) as index:
+        index.update("MR1", {"11111111"}, started=full_refresh, full=True)
+
+        assert index.inserted_since("MR1") is None
@@ -0,0 +1,25 @@
+import pytest
+
+from drc_containers.xnat_worker import XnatWorker
+
+
+@pytest.mark.parametrize("variable", ["DRC_PROFILE", "DRC_CASSETTE"])
+def test_concurrent_jobs_refused_with_process_wide_state(monkeypatch, variable):
+    monkeypatch.setenv(variable, "/tmp/run")
+
+    with pytest.raises(ValueError):
+        XnatWorker(max_jobs=2)
+    assert XnatWorker(max_jobs=1).max_jobs == 1
+
+
+@pytest.mark.parametrize(
+    "args", [["PROJ", "--profile", "/tmp/run"], ["PROJ", "--profile=/tmp/run"]]
+)
+def test_profiled_job_refused_by_concurrent_worker(monkeypatch, args):
+    monkeypatch.delenv("DRC_PROFILE", raising=False)
+    monkeypatch.delenv("DRC_CASSETTE", raising=False)
+
+    with pytest.raises(ValueError):
+        XnatWorker(max_jobs=2).check_job(args)
+    XnatWorker(max_jobs=1).check_job(args)
+    XnatWorker(max_jobs=2).check_job(["PROJ", "--profile-memory"])